@@ -0,0 +1,204 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This module implements the equivalence checking by SAT sweeping and
+# register correspondence, as described in "Sequential Equivalence
+# Checking without State Space Traversal" by C.A.J. van Eijk.
+
+from pysmt.shortcuts import And, Not, EqualsOrIff
+from pysmt.rewritings import conjunctive_partition
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import substitute, get_free_variables
+from cosa.representation import TS, HTS
+from cosa.encoders.miter import S1, S2
+
+from cosa.analyzers.bmc_safety import BMCSafety
+from cosa.analyzers.simulator import ConcreteSimulator
+
+class BMCEquivalence(BMCSafety):
+    """Equivalence checking of the miter of two systems.
+
+    Candidate equivalences between the signals and registers of the two
+    systems are found by random simulation, preferring the pairs with
+    the same name or structure, and are proven by induction up to a
+    fixpoint. The proven equivalences are merged in the miter before
+    checking its property.
+    """
+
+    def __init__(self, hts, config):
+        BMCSafety.__init__(self, hts, config)
+
+    def _systems_vars(self):
+        is_scalar = lambda v: v.symbol_type().is_bool_type() or v.symbol_type().is_bv_type()
+        sort = lambda vars_: sorted([v for v in vars_ if is_scalar(v)], key=lambda v: v.symbol_name())
+        vars1 = sort([v for v in self.hts.vars if v.symbol_name().startswith(S1)])
+        vars2 = sort([v for v in self.hts.vars if v.symbol_name().startswith(S2)])
+        return (vars1, vars2)
+
+    def _structural_matches(self, vars1, vars2):
+        # wires with the same definition, up to the names of the two systems
+        candidates = (set(vars1) | set(vars2)) - self.hts.state_vars
+        (definitions, _) = HTS.find_definitions(conjunctive_partition(self.hts.single_invar()), candidates)
+
+        rename = dict([(v.symbol_name(), S1+v.symbol_name()[len(S2):]) for v in vars2])
+        exprs1 = {}
+        for v1 in vars1:
+            if v1 in definitions:
+                exprs1.setdefault(substitute(definitions[v1], rename), v1)
+
+        matches = {}
+        for v2 in vars2:
+            if v2 in definitions:
+                v1 = exprs1.get(substitute(definitions[v2], rename))
+                if (v1 is not None) and (v1.symbol_type() == v2.symbol_type()):
+                    matches[v2] = v1
+        return matches
+
+    def _signatures(self, lanes, depth):
+        if lanes <= 0:
+            return None
+
+        simulator = ConcreteSimulator(self.hts, self.config.sim_seed)
+        formulae = [self.hts.single_init(), self.hts.single_invar(), self.hts.single_trans()]
+        undeclared = any([TS.get_ref_var(v) not in simulator.index for v in get_free_variables(And(formulae))])
+        if undeclared or (not simulator.is_supported()):
+            Logger.log("Random simulation not supported by the miter", 1)
+            return None
+
+        states = []
+        for lane in range(lanes):
+            (t, lane_states) = simulator.run(depth)
+            states += lane_states
+
+        if not states:
+            return None
+
+        return dict([(v, tuple([state[i] for state in states])) for (i, v) in enumerate(simulator.vars)])
+
+    def candidates(self, lanes, depth):
+        """Pairs of variables of the two systems that are candidate equivalences"""
+
+        (vars1, vars2) = self._systems_vars()
+
+        names = dict([(v.symbol_name()[len(S1):], v) for v in vars1])
+        matches = self._structural_matches(vars1, vars2)
+        for v2 in vars2:
+            v1 = names.get(v2.symbol_name()[len(S2):])
+            if (v1 is not None) and (v1.symbol_type() == v2.symbol_type()):
+                matches[v2] = v1
+
+        signatures = self._signatures(lanes, depth)
+        if signatures is None:
+            return [(matches[v2], v2) for v2 in vars2 if v2 in matches]
+
+        # the signals with the same values in all the simulations
+        classes = {}
+        for v1 in vars1:
+            classes.setdefault((v1.symbol_type(), signatures[v1]), []).append(v1)
+
+        candidates = []
+        for v2 in vars2:
+            eqclass = classes.get((v2.symbol_type(), signatures[v2]))
+            if eqclass is None:
+                continue
+            v1 = matches[v2] if matches.get(v2) in eqclass else eqclass[0]
+            candidates.append((v1, v2))
+
+        return candidates
+
+    def _refine(self, candidates, t):
+        """Removes the candidates falsified at time t, until the remaining ones hold"""
+
+        while candidates:
+            self._push(self.solver)
+            self._add_assertion(self.solver, Not(And([self.at_time(EqualsOrIff(v1, v2), t) for (v1, v2) in candidates])))
+
+            if not self._solve(self.solver):
+                self._pop(self.solver)
+                break
+
+            relevant_vars = set([])
+            for (v1, v2) in candidates:
+                relevant_vars |= set([TS.get_timed(v1, t), TS.get_timed(v2, t)])
+            model = self._get_model(self.solver, relevant_vars)
+            self._pop(self.solver)
+
+            candidates = [(v1, v2) for (v1, v2) in candidates \
+                          if model[TS.get_timed(v1, t)] == model[TS.get_timed(v2, t)]]
+            Logger.log("Candidate equivalences: %s"%len(candidates), 2)
+
+        return candidates
+
+    def sweep(self, candidates):
+        """Returns the largest subset of the candidates that is inductive"""
+
+        init = self.hts.single_init()
+        invar = self.hts.single_invar()
+        trans = self.hts.single_trans()
+
+        self._init_at_time(self.hts.vars, 1)
+
+        # the equivalences hold in the initial states
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(And(init, invar), 0))
+        candidates = self._refine(candidates, 0)
+
+        # and are preserved by the transitions, assuming all of them
+        self._reset_assertions(self.solver)
+        self._add_assertion(self.solver, self.at_time(invar, 0))
+        self._add_assertion(self.solver, self.unroll(trans, invar, 1))
+
+        while candidates:
+            self._push(self.solver)
+            self._add_assertion(self.solver, self.at_time(And([EqualsOrIff(v1, v2) for (v1, v2) in candidates]), 0))
+            inductive = self._refine(candidates, 1)
+            self._pop(self.solver)
+
+            if len(inductive) == len(candidates):
+                break
+            candidates = inductive
+
+        return candidates
+
+    def merge(self, equivalences):
+        """Miter where the variables of the second system are replaced by their equivalent ones"""
+
+        merged = dict([(v2, v1) for (v1, v2) in equivalences])
+        apply = lambda f: f.substitute(HTS.definition_map(merged, f))
+
+        ts = TS("Merged miter")
+        ts.vars = set(self.hts.vars)
+        ts.state_vars = set(self.hts.state_vars)
+        ts.input_vars = set(self.hts.input_vars)
+        ts.output_vars = set(self.hts.output_vars)
+        ts.set_behavior(apply(self.hts.single_init()), apply(self.hts.single_trans()), apply(self.hts.single_invar()))
+        ts.logic = self.hts.logic
+
+        hts = HTS(self.hts.name)
+        hts.add_ts(ts)
+        if self.hts.lemmas is not None:
+            for lemma in self.hts.lemmas:
+                hts.add_lemma(apply(lemma))
+        # the merged variables are still part of the traces
+        hts.eliminated = merged
+        return hts
+
+    def equivalence(self, prop, k, k_min):
+        candidates = self.candidates(self.config.sweeping_sim, k)
+        Logger.log("Candidate equivalences: %s"%len(candidates), 1)
+
+        equivalences = self.sweep(candidates)
+        Logger.log("Proven equivalences: %s"%len(equivalences), 1)
+
+        hts = self.merge(equivalences)
+        bmc_safety = BMCSafety(hts, self.config)
+        bmc_safety.set_budget(self.budget)
+        return bmc_safety.safety(hts.apply_definitions(prop), k, k_min)
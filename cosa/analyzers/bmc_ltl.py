@@ -108,8 +108,6 @@ class BMCLTL(BMCTemporal, BMCSafety):
                 Logger.log("Lemmas imply the property", 1)
                 Logger.log("", 0, not(Logger.level(1)))
                 return (0, True)
-
-        hts.reset_formulae()
         
         return self.solve_inc(hts, prop, k)
 
@@ -151,7 +149,8 @@ class BMCLTL(BMCTemporal, BMCSafety):
         self._add_assertion(self.solver, init_0)
         
         for t in range(1, k+1, 1):
-            
+            self._step(t)
+
             trans_t = self.unroll(trans, invar, t)
             self._add_assertion(self.solver, trans_t)
                 
@@ -12,12 +12,17 @@
 # "Efficient Anytime Techniques for Model-Based Safety Analysis" by
 # M. Bozzano, A. Cimatti, A. Griggio, and C. Mattarei.
 
-from pysmt.shortcuts import And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify
+from multiprocessing import Process, Manager
+from multiprocessing.connection import wait
+
+from pysmt.shortcuts import And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, simplify, BV, Array
 from pysmt.typing import BOOL, BVType, ArrayType
 from pysmt.rewritings import disjunctive_partition, conjunctive_partition
 
 from cosa.utils.logger import Logger
-from cosa.utils.formula_mngm import substitute, get_free_variables, SortingNetwork
+from cosa.utils.budget import BudgetExhausted, MEMORY
+from cosa.utils.formula_mngm import substitute, get_free_variables
+from cosa.utils.cardinality import Cardinality
 from cosa.representation import TS, HTS
 
 from cosa.problem import VerificationStatus
@@ -111,7 +116,8 @@ class BMCParametric(BMCSafety):
         if cardinality == -2:
             (t, status) = self.solve_safety_inc_fwd(self.hts, prop, k_max, k_min, all_vars=False, generalize=generalize)
         else:
-            sn = SortingNetwork.sorting_network(parameters)
+            # only the outputs up to the cardinality are used
+            sn = Cardinality.at_least(parameters, cardinality+1)
 
             if increase_k:
                 # Approach with incremental increase of bmc k
@@ -196,11 +202,21 @@ class BMCParametric(BMCSafety):
                 trace = self.generate_trace(model, time, get_free_variables(prop))
                 traces.append(trace)
 
+        region = self._sort_region(self.region)
+
+        if status == True:
+            return (VerificationStatus.TRUE, traces, region)
+        elif status is not None:
+            return (VerificationStatus.FALSE, traces, region)
+        else:
+            return (VerificationStatus.UNK, traces, region)
+
+    def _sort_region(self, formula):
         region = []
         dass = {}
 
         # Sorting result by size
-        for ass in list(disjunctive_partition(self.region)):
+        for ass in list(disjunctive_partition(formula)):
             cp = list(conjunctive_partition(ass))
             size = len(cp)
             if size not in dass:
@@ -212,9 +228,163 @@ class BMCParametric(BMCSafety):
         for size in indexes:
             region += dass[size]
 
-        if status == True:
+        return region
+
+    def _parameter_cubes(self, parameters, processes):
+        # Fixes the first parameters to obtain at least one cube per process
+        fixed = 0
+        while ((1 << fixed) < processes) and (fixed < len(parameters)):
+            fixed += 1
+
+        cubes = []
+        for i in range(1 << fixed):
+            cubes.append([(parameters[j], ((i >> j) & 1) == 1) for j in range(fixed)])
+
+        return cubes
+
+    def _value_to_data(self, value):
+        if value.is_bool_constant():
+            return ("B", value.constant_value())
+        if value.is_bv_constant():
+            return ("BV", value.constant_value(), value.bv_width())
+        if value.is_array_value():
+            assigned = [(self._value_to_data(i), self._value_to_data(v)) for (i, v) in value.array_value_assigned_values_map().items()]
+            return ("A", value.array_value_index_type(), self._value_to_data(value.array_value_default()), assigned)
+
+        Logger.error("Unsupported value \"%s\""%value)
+
+    def _value_from_data(self, data):
+        if data[0] == "B":
+            return TRUE() if data[1] else FALSE()
+        if data[0] == "BV":
+            return BV(data[1], data[2])
+
+        assigned = dict([(self._value_from_data(i), self._value_from_data(v)) for (i, v) in data[3]])
+        return Array(data[1], self._value_from_data(data[2]), assigned)
+
+    def _parametric_cube(self, prop, cube, k_max, k_min, parameters, monotonic, at_most):
+        # Runs in a worker process: formulae cannot be shared with the
+        # parent, hence the results are returned by name
+        Logger.log("Exploring cube \"%s\""%(", ".join(["%s=%s"%(p, v) for (p, v) in cube])), 1)
+
+        cube_constr = Or([Not(p) if v else p for (p, v) in cube])
+        stopped = None
+        try:
+            (status, _, region) = self.parametric_safety(Or(prop, cube_constr), k_max, k_min, parameters, monotonic, at_most)
+        except (BudgetExhausted, MemoryError) as e:
+            # the assignments found before running out of budget are still valid
+            Logger.log("Cube \"%s\" stopped: %s"%(", ".join(["%s=%s"%(p, v) for (p, v) in cube]), e), 1)
+            status = VerificationStatus.UNK
+            region = self._sort_region(self.region or FALSE())
+            if isinstance(e, BudgetExhausted):
+                stopped = (e.budget, e.k)
+            else:
+                stopped = (MEMORY, None if self.budget is None else self.budget.depth())
+
+        terms = []
+        for ass in region:
+            if ass == FALSE():
+                continue
+            lits = []
+            for lit in conjunctive_partition(ass):
+                if lit == TRUE():
+                    continue
+                if lit.is_not():
+                    lits.append((lit.arg(0).symbol_name(), False))
+                elif lit.is_iff() or lit.is_equals():
+                    lits.append((lit.arg(0).symbol_name(), lit.arg(1) == TRUE()))
+                else:
+                    lits.append((lit.symbol_name(), True))
+            terms.append(frozenset(lits))
+
+        models = []
+        for (model, time) in (self.models or []):
+            models.append((dict([(v.symbol_name(), self._value_to_data(val)) for (v, val) in model.items()]), time))
+
+        return (status, terms, models, stopped)
+
+    def _minimize_region(self, terms):
+        # DNF minimization by absorption: a cube is dropped when a smaller
+        # one implies it
+        minimal = []
+        for term in sorted(set(terms), key=lambda t: (len(t), sorted(t))):
+            if not any(kept.issubset(term) for kept in minimal):
+                minimal.append(term)
+
+        return minimal
+
+    def parallel_parametric_safety(self, prop, k_max, k_min, parameters, monotonic=True, at_most=-1, processes=1):
+        if len(parameters) == 0:
+            Logger.error("Parameters size cannot be 0")
+
+        cubes = self._parameter_cubes(parameters, processes)
+        Logger.log("Parametric analysis split in %d cubes over %d processes"%(len(cubes), processes), 1)
+
+        retdic = {}
+        with Manager() as manager:
+            ret = manager.dict({})
+
+            # each idle process picks up the next cube
+            pending = list(range(len(cubes)))
+            running = []
+            while pending or running:
+                while pending and (len(running) < processes):
+                    c = pending.pop(0)
+                    worker = Process(target=self._run_as_process, \
+                                     args=(self._parametric_cube, c, ret, \
+                                           *[prop, cubes[c], k_max, k_min, parameters, monotonic, at_most]))
+                    worker.start()
+                    running.append(worker)
+
+                wait([worker.sentinel for worker in running])
+                for worker in [w for w in running if not w.is_alive()]:
+                    worker.join()
+                    running.remove(worker)
+
+            for key,val in ret.items():
+                retdic[key] = val
+
+        if len(retdic) < len(cubes):
+            # e.g., killed by the resource limits
+            Logger.warning("Parametric worker terminated without a result")
+            for c in range(len(cubes)):
+                retdic.setdefault(c, (VerificationStatus.UNK, [], [], None))
+
+        statuses = [retdic[c][0] for c in range(len(cubes))]
+        for c in range(len(cubes)):
+            if (retdic[c][3] is not None) and (self.budget is not None):
+                # the region is partial, and the budget is reported as exhausted
+                self.budget.stop(*retdic[c][3])
+        terms = [t for c in range(len(cubes)) for t in retdic[c][1]]
+
+        vartypes = dict([(v.symbol_name(), v.symbol_type()) for v in self.hts.vars])
+        sym = lambda name: Symbol(name, vartypes[name]) if name in vartypes else Symbol(name, BOOL)
+
+        self.region = FALSE()
+        self.models = []
+        for term in self._minimize_region(terms):
+            self.region = Or(self.region, And([sym(n) if v else Not(sym(n)) for (n, v) in sorted(term)]))
+
+        for c in range(len(cubes)):
+            for (model, time) in retdic[c][2]:
+                model = dict([(Symbol(n, self._value_from_data(d).get_type()), self._value_from_data(d)) for (n, d) in model.items()])
+                self.models.append((model, time))
+
+        self.region = simplify(self.region)
+
+        traces = None
+        if (len(self.models) > 0) and (self.region not in [TRUE(), FALSE()]):
+            traces = []
+            for (model, time) in self.models:
+                model = self._remap_model(self.hts.vars, model, time)
+                trace = self.generate_trace(model, time, get_free_variables(prop))
+                traces.append(trace)
+
+        region = self._sort_region(self.region)
+
+        if all([s == VerificationStatus.TRUE for s in statuses]):
             return (VerificationStatus.TRUE, traces, region)
-        elif status is not None:
-            return (VerificationStatus.FALSE, traces, region)
-        else:
+        elif VerificationStatus.UNK in statuses:
             return (VerificationStatus.UNK, traces, region)
+        else:
+            return (VerificationStatus.FALSE, traces, region)
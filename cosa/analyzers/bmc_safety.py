@@ -15,14 +15,20 @@ from multiprocessing import Process, Manager
 from pysmt.shortcuts import And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify
 from pysmt.shortcuts import Interpolator
 from pysmt.oracles import get_logic
+from pysmt.rewritings import conjunctive_partition
 
 from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
+from cosa.utils.budget import BudgetExhausted
 from cosa.utils.formula_mngm import substitute, get_free_variables
 from cosa.utils.generic import status_bar
+from cosa.utils.smt2_tracer import close_tracers
 from cosa.representation import TS, HTS
 
 from cosa.problem import VerificationStatus
 from cosa.analyzers.mcsolver import TraceSolver, BMCSolver, VerificationStrategy
+from cosa.analyzers.simulator import ConcreteSimulator
+from cosa.analyzers.replay import TraceReplayer
 
 FWDK = "FWD-K"
 
@@ -41,27 +47,41 @@ class BMCSafety(BMCSolver):
     def __init__(self, hts, config):
         BMCSolver.__init__(self, hts, config)
 
-    def loop_free(self, vars_, k_end, k_start=0):
-        Logger.log("Simple path from %s to %s"%(k_start, k_end), 2)
+    def _equal_states(self, solver, vars_, k_end):
+        # pairs of steps with the same state in the current model
+        lvars = list(vars_)
+        model = self._get_model(solver, [TS.get_timed(v, t) for t in range(k_end+1) for v in lvars])
+
+        first = {}
+        pairs = []
+        for t in range(k_end+1):
+            state = tuple([model[TS.get_timed(v, t)] for v in lvars])
+            if state in first:
+                pairs.append((first[state], t))
+            else:
+                first[state] = t
 
-        if k_end == k_start:
-            return TRUE()
+        return pairs
 
-        def not_eq_states(vars1, vars2):
-            assert len(vars1) == len(vars2)
-            eqvars = []
-            for i in range(len(vars1)):
-                eqvars.append(EqualsOrIff(vars1[i], vars2[i]))
-            return Not(And(eqvars))
+    def _solve_loop_free(self, solver, vars_, k_end, loop_free):
+        """Solves adding the simple path constraints only between the equal states of the models.
 
-        lvars = list(vars_)
-        end_vars = [TS.get_timed(v, k_end) for v in lvars]
+        The new constraints are appended to loop_free, returns True if
+        the solver has a model without equal states.
+        """
+
+        while self._solve(solver):
+            pairs = self._equal_states(solver, vars_, k_end)
+            if len(pairs) == 0:
+                return True
 
-        formula = []
-        for t in range(k_start, k_end, 1):
-            formula.append(not_eq_states(end_vars, [TS.get_timed(v, t) for v in lvars]))
+            Logger.log("Simple path between %s"%(", ".join(["%s and %s"%p for p in pairs])), 2)
+            for (t1, t2) in pairs:
+                distinct = Not(And([EqualsOrIff(TS.get_timed(v, t1), TS.get_timed(v, t2)) for v in vars_]))
+                self._add_assertion(solver, distinct, comment="loop_free")
+                loop_free.append(distinct)
 
-        return And(formula)
+        return False
 
     def set_preferred(self, preferred):
         if self.preferred is None:
@@ -72,6 +92,8 @@ class BMCSafety(BMCSolver):
         if self.config.strategy == VerificationStrategy.NU:
             self._init_at_time(self.hts.vars, 1)
             (t, model) = self.sim_no_unroll(self.hts, prop, k)
+        elif self.config.strategy == VerificationStrategy.CONC:
+            (t, model) = self.sim_concrete(self.hts, prop, k)
         else:
             self._init_at_time(self.hts.vars, k)
             if prop == TRUE():
@@ -96,8 +118,6 @@ class BMCSafety(BMCSolver):
                 Logger.log("", 0, not(Logger.level(1)))
                 return (0, True)
 
-        hts.reset_formulae()
-
         if self.config.incremental:
             return self.solve_safety_inc(hts, prop, k, k_min, processes)
 
@@ -131,7 +151,17 @@ class BMCSafety(BMCSolver):
 
     def _run_as_process(self, function, name, ret, *args):
         if ret is None: ret = {}
-        ret[name] = function(*args)
+        if self.budget is not None:
+            self.budget.limit_process()
+        try:
+            ret[name] = function(*args)
+        except BudgetExhausted as e:
+            ret[name] = (e.k, None)
+        except MemoryError:
+            ret[name] = (None if self.budget is None else self.budget.depth(), None)
+        finally:
+            # the process exits without running the exit handlers
+            close_tracers()
 
     def _status_checker(self, status, threads):
 
@@ -146,6 +176,8 @@ class BMCSafety(BMCSolver):
 
             if (len(status.keys()) >= threads):
                 return False
+            if (self.budget is not None) and (self.budget.remaining_time() == 0):
+                return False
             if (status is not None) and (len(status.keys()) > 0):
                 (t, model) = [val for key,val in status.items() if val is not None][0]
                 if (model != None):
@@ -220,6 +252,9 @@ class BMCSafety(BMCSolver):
             if (len(tru_res) > 0) and (len(fal_res) > 0):
                 Logger.warning("Unconsistent results")
 
+            if (self.budget is not None) and (len(tru_res) + len(fal_res) + len(unk_res) == 0):
+                self.budget.check()
+
             if len(fal_res) > 0:
                 winning = fal_res[0]
             elif len(tru_res) > 0:
@@ -227,7 +262,9 @@ class BMCSafety(BMCSolver):
             elif len(unk_res) > 0:
                 winning = unk_res[0]
             else:
-                Logger.error("No solution")
+                # the workers terminated without a result (e.g., killed by the resource limits)
+                Logger.warning("No solver returned a result")
+                return (None if self.budget is None else self.budget.depth(), None)
 
             Logger.msg("(%s)"%(winning[0]), 0, not(Logger.level(1)))
 
@@ -288,6 +325,7 @@ class BMCSafety(BMCSolver):
 
         t = 1 if has_next else 0
         while (t < k+1):
+            self._step(t)
             Logger.log("\nSolving for k=%s"%t, 1)
             int_c = 0
             init_0 = self.at_time(init, 0)
@@ -343,94 +381,111 @@ class BMCSafety(BMCSolver):
         return (t-1, None)
 
     def solve_safety_inc_int(self, hts, prop, k):
+        # Interpolation sequence based model checking, as described in
+        # "Interpolation-sequence based model checking" by Y. Vizel and
+        # O. Grumberg. The unrolling is kept in a single solver, and each
+        # frame R[j] over-approximates the states reachable in j steps as
+        # a set of conjuncts refined by the interpolants of every bound.
+        # The interpolator has no incremental interface, hence the
+        # sequence is computed again at each bound from the blocks of the
+        # unrolling, which are built only once.
+
         init = hts.single_init()
         trans = hts.single_trans()
         invar = hts.single_invar()
 
-        solver_proof = self.solver.copy("inc_int_proof")
-        solver = self.solver.copy("inc_int")
-
+        # properties with next are violated by the last transition, which
+        # is then part of the last block of the sequence
         has_next = TS.has_next(prop)
+        shift = 1 if has_next else 0
 
-        map_10 = dict([(TS.get_timed_name(v.symbol_name(), 1), TS.get_timed_name(v.symbol_name(), 0)) for v in hts.vars])
+        solver = self.solver.copy("inc_int")
+        solver_proof = self.solver.copy("inc_int_proof")
+
+        self._reset_assertions(solver)
+        self._reset_assertions(solver_proof)
 
         itp = Interpolator(logic=get_logic(trans))
-        init = And(init, invar)
         nprop = Not(prop)
 
-        def check_overappr(Ri, R):
-            self._reset_assertions(solver_proof)
-            self._add_assertion(solver_proof, And(Ri, Not(R)))
-
-            if not self._solve(solver_proof):
-                Logger.log("Proof found with k=%s"%(t), 1)
-                return TRUE()
-
-            Logger.log("Extending initial states (%s)"%int_c, 1)
-            return Or(R, Ri)
-
-        t = 1 if has_next else 0
+        init_0 = self.at_time(And(init, invar), 0)
+        Logger.log("Add init and invar", 2)
+        self._add_assertion(solver, init_0)
 
-        trans_t = self.unroll(trans, invar, k+1, gen_list=True)
+        # blocks of the unrolling, the first one includes the initial states
+        blocks = []
+        frames = [[And(init, invar)]]
+
+        maps_t = {}
+        def untime(formula, t):
+            if t not in maps_t:
+                maps_t[t] = dict([(TS.get_timed_name(v.symbol_name(), t), v.symbol_name()) for v in hts.vars])
+            return substitute(formula, maps_t[t])
+
+        def fixpoint(t):
+            # R[j] is contained in the union of the previous frames
+            for j in range(1, t+1):
+                self._push(solver_proof)
+                self._add_assertion(solver_proof, self.at_time(And(frames[j]), 0))
+                self._add_assertion(solver_proof, self.at_time(Not(Or([And(frame) for frame in frames[:j]])), 0))
+                holds = not self._solve(solver_proof)
+                self._pop(solver_proof)
+                if holds:
+                    return j
+            return None
 
-        pivot = 2
-        trans_tA = And(trans_t[:pivot])
-        init_0 = self.at_time(init, 0)
+        t = 0
+        while (t < k+1):
+            self._step(t)
 
-        is_sat = True
-        Ri = None
+            if t > 0:
+                trans_t = self.unroll(trans, invar, t, t-1)
+                self._add_assertion(solver, trans_t)
+                blocks.append(And(init_0, trans_t) if t == 1 else trans_t)
+                frames.append([])
 
-        self._reset_assertions(solver)
+            if t < shift:
+                t += 1
+                continue
 
-        while (t < k+1):
             Logger.log("\nSolving for k=%s"%t, 1)
-            int_c = 0
-            R = init_0
 
-            # trans_t is composed as trans_i, invar_i, trans_i+1, invar_i+1, ...
-            self._add_assertion(solver, trans_t[2*t])
-            self._add_assertion(solver, trans_t[(2*t)+1])
-
-            while True:
-                Logger.log("Add init and invar", 2)
-                self._push(solver)
-                self._add_assertion(solver, R)
+            npropt = self.at_time(nprop, t-shift)
+            self._push(solver)
+            Logger.log("Add property time %d"%t, 2)
+            self._add_assertion(solver, npropt)
 
-                npropt = self.at_time(nprop, t-1 if has_next else t)
-                Logger.log("Add property time %d"%t, 2)
-                self._add_assertion(solver, npropt)
+            if self._solve(solver):
+                Logger.log("Counterexample found with k=%s"%(t), 1)
+                model = self._get_model(solver)
+                return (t, model)
 
-                Logger.log("Interpolation at k=%s"%(t), 2)
+            self._pop(solver)
+            Logger.log("No counterexample found with k=%s"%(t), 1)
+            Logger.msg(".", 0, not(Logger.level(1)))
 
-                if t > 0:
-                    trans_tB = And(trans_t[pivot:(t*2)])
-                    Ri = And(itp.binary_interpolant(And(R, trans_tA), And(trans_tB, npropt)))
-                    is_sat = Ri == None
+            # frames refined at this bound
+            depth = t-shift
 
-                if is_sat and self._solve(solver):
-                    if R == init_0:
-                        Logger.log("Counterexample found with k=%s"%(t), 1)
-                        model = self._get_model(solver)
-                        return (t, model)
-                    else:
-                        Logger.log("No counterexample or proof found with k=%s"%(t), 1)
-                        Logger.msg(".", 0, not(Logger.level(1)))
-                        self._pop(solver)
-                        break
-                else:
-                    self._pop(solver)
-                    if Ri is None:
-                        break
+            if depth > 0:
+                Logger.log("Interpolation at k=%s"%(t), 2)
+                itps = itp.sequence_interpolant(blocks[:depth] + [And(blocks[depth:] + [npropt])])
+                if itps is None:
+                    Logger.error("Interpolation sequence not found with k=%s"%(t))
 
-                    Ri = substitute(Ri, map_10)
-                    res = check_overappr(Ri, R)
+                refined = 0
+                for j in range(1, depth+1):
+                    for conjunct in conjunctive_partition(untime(itps[j-1], j)):
+                        if (conjunct != TRUE()) and (conjunct not in frames[j]):
+                            frames[j].append(conjunct)
+                            refined += 1
 
-                    if res == TRUE():
-                        Logger.log("Proof found with k=%s"%(t), 1)
-                        return (t, True)
+                Logger.log("Refining frames with %s conjuncts"%(refined), 1)
 
-                    R = res
-                    int_c += 1
+                j = fixpoint(depth)
+                if j is not None:
+                    Logger.log("Proof found with k=%s (frame %s)"%(t, j), 1)
+                    return (t, True)
 
             t += 1
 
@@ -443,6 +498,7 @@ class BMCSafety(BMCSolver):
 
         t = k_min
         while (t < k+1):
+            self._step(t)
             self._reset_assertions(self.solver)
             formula = And(init, invar)
             formula = self.at_time(formula, 0)
@@ -529,7 +585,9 @@ class BMCSafety(BMCSolver):
             if all_vars:
                 relevant_vars = hts.vars
             else:
-                relevant_vars = hts.state_vars | hts.output_vars
+                # the variables with a next value, including the ones not declared as state
+                next_vars = [TS.get_ref_var(v) for v in get_free_variables(hts.single_trans()) if TS.is_prime(v)]
+                relevant_vars = hts.state_vars | (set(next_vars) - hts.input_vars)
 
         init = hts.single_init()
         trans = hts.single_trans()
@@ -537,7 +595,8 @@ class BMCSafety(BMCSolver):
 
         acc_init = TRUE()
         acc_prop = TRUE()
-        acc_loop_free = TRUE()
+        acc_loop_free = []
+        ind_loop_free = 0
         trans_t = TRUE()
 
         if self.config.simplify:
@@ -545,9 +604,10 @@ class BMCSafety(BMCSolver):
             if Logger.level(2):
                 timer = Logger.start_timer("Simplify")
 
-            init = simplify(init)
-            trans = simplify(trans)
-            invar = simplify(invar)
+            with Profiler.span("simplify"):
+                init = simplify(init)
+                trans = simplify(trans)
+                invar = simplify(invar)
             if Logger.level(2):
                 Logger.get_timer(timer)
 
@@ -582,6 +642,7 @@ class BMCSafety(BMCSolver):
             self._solve(solver)
             Logger.msg("_", 0, not(Logger.level(1)))
         while (t < k+1):
+            self._step(t)
             if not skip_push:
                 self._push(solver)
                 skip_push = False
@@ -645,18 +706,18 @@ class BMCSafety(BMCSolver):
 
             if prove:
                 if t > k_min:
-                    loop_free = self.loop_free(relevant_vars, t, t-1)
+                    # The simple path constraints are added lazily,
+                    # only between the equal states of the models
 
                     # Checking I & T & loopFree
                     acc_init = And(acc_init, self.at_time(Not(init), t))
-                    acc_loop_free = And(acc_loop_free, loop_free)
 
                     self._push(solver)
 
                     self._add_assertion(solver, acc_init)
-                    self._add_assertion(solver, acc_loop_free)
+                    self._add_assertion(solver, And(acc_loop_free), comment="loop_free")
 
-                    if self._solve(solver):
+                    if self._solve_loop_free(solver, relevant_vars, t, acc_loop_free):
                         Logger.log("Induction (I & lF) failed with k=%s"%(t), 1)
                     else:
                         Logger.log("Induction (I & lF) holds with k=%s"%(t), 1)
@@ -666,13 +727,14 @@ class BMCSafety(BMCSolver):
 
                     # Checking T & loopFree & !P
                     self._add_assertion(solver_ind, trans_t, comment="trans")
-                    self._add_assertion(solver_ind, loop_free, comment="loop_free")
+                    self._add_assertion(solver_ind, And(acc_loop_free[ind_loop_free:]), comment="loop_free")
+                    ind_loop_free = len(acc_loop_free)
 
                     self._push(solver_ind)
 
                     self._add_assertion(solver_ind, self.at_time(Not(prop), t_prop))
 
-                    if self._solve(solver_ind):
+                    if self._solve_loop_free(solver_ind, relevant_vars, t, acc_loop_free):
                         Logger.log("Induction (lF & !P) failed with k=%s"%(t), 1)
                     else:
                         Logger.log("Induction (lF & !P) holds with k=%s"%(t), 1)
@@ -680,6 +742,10 @@ class BMCSafety(BMCSolver):
 
                     self._pop(solver_ind)
 
+                    # the constraints found under the property are kept
+                    self._add_assertion(solver_ind, And(acc_loop_free[ind_loop_free:]), comment="loop_free")
+                    ind_loop_free = len(acc_loop_free)
+
                     self._add_assertion(solver_ind, self.at_time(prop, t_prop), "prop")
                 else:
                     if not next_prop:
@@ -722,6 +788,7 @@ class BMCSafety(BMCSolver):
         t = 0
         k_min = 1 if has_next else 0
         while (t < k+1):
+            self._step(t)
             if not skip_push:
                 self._push(solver)
                 skip_push = False
@@ -804,6 +871,7 @@ class BMCSafety(BMCSolver):
 
         t = 0
         while (t < k+1):
+            self._step(t)
             self._push(solver)
             even = (t % 2) == 0
             th = int(t/2)
@@ -839,6 +907,11 @@ class BMCSafety(BMCSolver):
 
 
     def safety(self, prop, k, k_min, processes=1):
+        if self.config.random_sim > 0:
+            res = self.random_simulation(prop, k, self.config.random_sim)
+            if res is not None:
+                return res
+
         lemmas = self.hts.lemmas
         self._init_at_time(self.hts.vars, k)
         (t, model) = self.solve_safety(self.hts, prop, k, k_min, lemmas, processes)
@@ -848,10 +921,108 @@ class BMCSafety(BMCSolver):
         elif model is not None:
             model = self._remap_model(self.hts.vars, model, t)
             trace = self.generate_trace(model, t, get_free_variables(prop))
+            if self.config.validate_traces and (not self.validate_trace(prop, trace)):
+                return (VerificationStatus.UNK, None, t-1 if t > 0 else None)
             return (VerificationStatus.FALSE, trace, t)
         else:
             return (VerificationStatus.UNK, None, t)
 
+    def validate_trace(self, prop, trace):
+        """Replays a counterexample on the model, returns False if it is not confirmed"""
+
+        replayer = TraceReplayer(self.hts, solver_name=self.config.solver_name)
+        simulator = replayer.simulator
+        if (not simulator.is_supported()) or (not simulator.is_supported([prop])) or \
+           any([TS.is_prev(v) or (TS.get_ref_var(v) not in simulator.index) for v in get_free_variables(prop)]):
+            Logger.log("Trace validation not supported by the model", 1)
+            return True
+
+        if Logger.level(1):
+            timer = Logger.start_timer("Trace validation")
+
+        result = replayer.replay(replayer.load_model(trace.model, trace.length), prop)
+
+        if Logger.level(1):
+            Logger.get_timer(timer)
+
+        if not result.valid:
+            Logger.warning("Counterexample not confirmed: %s"%(result))
+            return False
+
+        if result.holds:
+            Logger.warning("Counterexample not confirmed: the property holds along the trace")
+            return False
+
+        Logger.log("Counterexample confirmed by the replay (%s)"%(result), 1)
+        return True
+
+    def random_simulation(self, prop, k, lanes):
+        simulator = ConcreteSimulator(self.hts, self.config.sim_seed)
+
+        prop_vars = get_free_variables(prop)
+        if (not simulator.is_supported()) or (not simulator.is_supported([prop])) or \
+           any([TS.is_prev(v) or (TS.get_ref_var(v) not in simulator.index) for v in prop_vars]):
+            Logger.log("Random simulation not supported by the model", 1)
+            return None
+
+        if Logger.level(1):
+            timer = Logger.start_timer("Random simulation")
+
+        (t, states, coverage) = simulator.run_batch(k, Not(prop), lanes)
+
+        if Logger.level(1):
+            Logger.get_timer(timer)
+
+        if t > -1:
+            Logger.log("Counterexample found by random simulation at k=%s"%(t), 1)
+            trace = self.generate_trace(simulator.to_model(states), t, prop_vars)
+            return (VerificationStatus.FALSE, trace, t)
+
+        Logger.log("Random simulation coverage: %s lanes, depth %s, %s distinct states, %s deadlocked lanes, %d steps/s"% \
+                   (lanes, coverage[0], coverage[1], coverage[2], coverage[3]), 1)
+        return None
+
+    def replay(self, prop, filename, remap=None, abstract_clock_list=None):
+        replayer = TraceReplayer(self.hts, remap, self.config.solver_name)
+        steps = replayer.load(filename, abstract_clock_list)
+
+        if Logger.level(1):
+            timer = Logger.start_timer("Trace replay")
+
+        result = replayer.replay(steps, prop)
+
+        if Logger.level(1):
+            Logger.get_timer(timer)
+
+        if not result.valid:
+            Logger.warning("%s (\"%s\")"%(result, filename))
+            return (VerificationStatus.UNK, None, result.step)
+
+        if not result.holds:
+            Logger.log("%s (\"%s\")"%(result, filename), 1)
+            trace = self.generate_trace(replayer.to_model(result), result.step, get_free_variables(prop))
+            return (VerificationStatus.FALSE, trace, result.step)
+
+        Logger.log("Property holds along the trace \"%s\""%(filename), 1)
+        return (VerificationStatus.UNK, None, len(steps)-1)
+
+    def sim_concrete(self, hts, cover, k):
+        simulator = ConcreteSimulator(hts, self.config.sim_seed)
+
+        inputs = None
+        if self.config.sim_inputs is not None:
+            inputs = simulator.load_inputs(self.config.sim_inputs)
+
+        if Logger.level(1):
+            timer = Logger.start_timer("Concrete simulation")
+
+        (t, states) = simulator.run(k, cover, inputs)
+
+        if Logger.level(1):
+            Logger.get_timer(timer)
+
+        return (t, simulator.to_model(states))
+
     def sim_no_unroll(self, hts, cover, k, all_vars=True, inc=False):
         init = hts.single_init()
         invar = hts.single_invar()
@@ -877,6 +1048,7 @@ class BMCSafety(BMCSolver):
         self._reset_assertions(self.solver)
 
         # Picking Initial State
+        self._step(0)
         Logger.log("\nSolving for k=0", 1)
         self._add_assertion(self.solver, And(init_0, invar_0))
 
@@ -899,6 +1071,7 @@ class BMCSafety(BMCSolver):
 
         init_model = None
         for t in range(1, k + 1):
+            self._step(t)
             Logger.log("\nSolving for k=%s"%(t), 1)
 
             if not inc:
@@ -16,9 +16,9 @@ from pysmt.smtlib.printers import SmtPrinter, SmtDagPrinter
 from pysmt.typing import BOOL
 
 from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
 from cosa.utils.formula_mngm import substitute, get_free_variables
 from cosa.representation import TS, HTS
-from cosa.encoders.coreir import CoreIRParser, SEP
 
 from cosa.printers.template import HIDDEN_VAR
 from cosa.analyzers.mcsolver import VerificationStrategy
@@ -76,9 +76,10 @@ class BMCTemporal(BMCSolver):
             if Logger.level(1):
                 timer = Logger.start_timer("Simplify")
 
-            init = simplify(init)
-            trans = simplify(trans)
-            invar = simplify(invar)
+            with Profiler.span("simplify"):
+                init = simplify(init)
+                trans = simplify(trans)
+                invar = simplify(invar)
 
             if Logger.level(1):
                 Logger.get_timer(timer)
@@ -111,6 +112,7 @@ class BMCTemporal(BMCSolver):
         
         t = 0 
         while (t < k+1):
+            self._step(t)
             self._push(self.solver)
 
             loopback = FALSE()
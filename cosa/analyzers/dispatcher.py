@@ -9,36 +9,43 @@
 # limitations under the License.
 
 import copy
+import hashlib
 import os
 import pickle
 
 from collections import Sequence
 from pathlib import Path
-from typing import List, NamedTuple, Optional, Union
+from typing import List, NamedTuple, Optional, Set, Union
 
 from pysmt.fnode import FNode
 from pysmt.shortcuts import Symbol, Implies, get_free_variables, BV, TRUE, simplify, And, EqualsOrIff, Array
+from pysmt.rewritings import conjunctive_partition
 
 from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
+from cosa.utils.budget import Budget, BudgetExhausted
+from cosa.utils.formula_mngm import structural_hash
 from cosa.analyzers.mcsolver import CONST_ARRAYS_SUPPORT
 from cosa.analyzers.bmc_safety import BMCSafety
+from cosa.analyzers.bmc_equivalence import BMCEquivalence
 from cosa.analyzers.bmc_parametric import BMCParametric
 from cosa.analyzers.bmc_ltl import BMCLTL
 from cosa.problem import VerificationType, VerificationStatus, Trace
 from cosa.encoders.miter import Miter
 from cosa.encoders.formulae import StringParser
 from cosa.representation import HTS, TS, L_ABV
-from cosa.encoders.btor2 import BTOR2Parser
 from cosa.encoders.init_state import InitParser
 from cosa.encoders.ltl import LTLParser
 from cosa.encoders.factory import ModelParsersFactory, ClockBehaviorsFactory, GeneratorsFactory
 from cosa.modifiers.factory import ModelModifiersFactory
 from cosa.modifiers.coi import ConeOfInfluence
+from cosa.modifiers.passes import ModelPasses
+from cosa.modifiers.phase_abstraction import PhaseAbstraction
+from cosa.modifiers.memories import MemoryAbstraction
 from cosa.encoders.template import ModelInformation
 from cosa.encoders.parametric_behavior import ParametricBehavior
 from cosa.printers.trace import TextTracePrinter, VCDTracePrinter
 from cosa.modifiers.model_extension import ModelExtension
-from cosa.encoders.symbolic_transition_system import SymbolicSimpleTSParser
 from cosa.printers.factory import HTSPrintersFactory
 from cosa.printers.hts import STSHTSPrinter
 from cosa.problem import ProblemsManager, MODEL_SP, FILE_SP
@@ -49,6 +56,18 @@ FLAG_ST = "]"
 FLAG_SP = "+"
 
 COSACACHEDIR = ".CoSA/cache"
+COSARESULTSDIR = ".CoSA/results"
+PROFILE_EXT = "json"
+
+# general options affecting the encoding of a model file
+MODEL_OPTIONS = ["abstract_clock", "add_clock", "boolean", "devel", "model_extension", "no_arrays", \
+                 "opt_circuit", "run_coreir_passes", "symbolic_init", "synchronize", "verific", "zero_init"]
+
+# problem options affecting the result of a problem (besides its cone of influence)
+RESULT_OPTIONS = ["bmc_length", "bmc_length_min", "cardinality", "full_trace", "functional_ftrans", "incremental", "prove", \
+                  "random_sim", "sim_inputs", "sim_seed", "simplify", "solver_name", "solver_options", \
+                  "strategy", "sweeping", "sweeping_sim", "trace_all_vars", "trace_values_base", "trace_vars_change", \
+                  "validate_traces", "verification"]
 
 class ProblemSolver(object):
     parser = None
@@ -56,14 +75,25 @@ class ProblemSolver(object):
     lparser = None
     model_info = None
     coi = None
+    relative_path = None
+    models = None
+    cois = None
+    results = None
 
-    def __init__(self):
+    def __init__(self, keep_models=False):
         self.sparser = None
         self.lparser = None
         self.coi = None
         self.model_info = ModelInformation()
+        self.relative_path = Path(".")
         self.properties = [] # contains the parsed properties -- PySMT objects
 
+        # parsed models, COI dependencies and results kept in memory between runs
+        if keep_models:
+            self.models = {}
+            self.cois = {}
+            self.results = {}
+
         GeneratorsFactory.init_generators()
         ClockBehaviorsFactory.init_clockbehaviors()
 
@@ -103,9 +133,8 @@ class ProblemSolver(object):
                                           map_function=self.parser.remap_an2or, \
                                           find_loop=trace.infinite, \
                                           abstract_clock_list=abstract_clock_list)
-        traceH = Trace(hr_trace, trace.length)
+        traceH = hr_trace
         traceH.extension = hr_printer.get_file_ext()
-        traceH.human_readable = hr_trace.human_readable
         traces.append(traceH)
 
         # VCD format
@@ -118,11 +147,17 @@ class ProblemSolver(object):
                                                 length=trace.length, \
                                                 map_function=self.parser.remap_an2or, \
                                                 abstract_clock_list=self.model_info.abstract_clock_list)
-            traceV = Trace(vcd_trace, trace.length)
+            traceV = vcd_trace
             traceV.extension = vcd_printer.get_file_ext()
-            traceV.human_readable = vcd_trace.human_readable
             traces.append(traceV)
 
+        # traces are printed lazily, when profiling they are printed here to be measured
+        if Profiler.enabled:
+            for trace in traces:
+                with Profiler.span("trace printing", extension=trace.extension):
+                    trace.strtrace = str(trace)
+                    trace.writer = None
+
         return traces
 
     def __solve_problem(self,
@@ -130,15 +165,25 @@ class ProblemSolver(object):
                         prop:Optional[FNode],
                         lemmas:Optional[List[FNode]],
                         assumptions:Optional[List[FNode]],
-                        problem:NamedTuple)->str:
+                        problem:NamedTuple,
+                        projection:Optional[Set[FNode]]=None,
+                        budget:Optional[Budget]=None)->str:
 
         trace = None
         traces = None
         region = None # only used for parametric model checking
+        k = None
 
         accepted_ver = False
 
         assert hts.assumptions is None, "There should not be any left-over assumptions from previous problems"
+
+        # the wires removed by the functional encoding are substituted in the property and lemmas
+        hts.set_functional(problem.functional_ftrans)
+        if prop is not None:
+            prop = hts.apply_definitions(prop)
+        lemmas = [hts.apply_definitions(lemma) for lemma in lemmas]
+
         for assump in assumptions:
             hts.add_assumption(assump)
         for lemma in lemmas:
@@ -149,41 +194,65 @@ class ProblemSolver(object):
         bmc_ltl = BMCLTL(hts, problem)
         res = VerificationStatus.UNC
 
+        for engine in [bmc_safety, bmc_parametric, bmc_ltl]:
+            engine.set_projection(projection)
+            engine.set_budget(budget)
+
         bmc_length = problem.bmc_length
         bmc_length_min = problem.bmc_length_min
 
         if problem.verification is None:
             Logger.log("Skipping problem because no verification is selected.", 0)
-            return None, None, None, None
+            return None, None, None, None, None
 
         if problem.verification == VerificationType.SAFETY:
             accepted_ver = True
             Logger.log("Property: %s"%(prop.serialize(threshold=100)), 2)
-            res, trace, _ = bmc_safety.safety(prop, bmc_length, bmc_length_min, problem.processes)
+            if problem.replay is not None:
+                res, trace, k = bmc_safety.replay(prop, str(self.relative_path / problem.replay), self.parser.remap_or2an, \
+                                                  self.model_info.abstract_clock_list)
+            else:
+                res, trace, k = bmc_safety.safety(prop, bmc_length, bmc_length_min, problem.processes)
 
         if problem.verification == VerificationType.LTL:
             accepted_ver = True
-            res, trace, _ = bmc_ltl.ltl(prop, bmc_length, bmc_length_min)
+            res, trace, k = bmc_ltl.ltl(prop, bmc_length, bmc_length_min)
 
         if problem.verification == VerificationType.SIMULATION:
             accepted_ver = True
             res, trace = bmc_safety.simulate(prop, bmc_length)
+            k = bmc_length
 
         if problem.verification == VerificationType.PARAMETRIC:
             accepted_ver = True
             Logger.log("Property: %s"%(prop.serialize(threshold=100)), 2)
-            res, traces, region = bmc_parametric.parametric_safety(prop, bmc_length, bmc_length_min, ModelExtension.get_parameters(hts), at_most=problem.cardinality)
+            parameters = ModelExtension.get_parameters(hts)
+            if projection is not None:
+                bmc_parametric.set_projection(projection | set(parameters))
+            if problem.parametric_parallel and (problem.processes > 1):
+                res, traces, region = bmc_parametric.parallel_parametric_safety(prop, bmc_length, bmc_length_min, parameters, \
+                                                                                at_most=problem.cardinality, processes=problem.processes)
+            else:
+                res, traces, region = bmc_parametric.parametric_safety(prop, bmc_length, bmc_length_min, parameters, at_most=problem.cardinality)
+            # the parameters are explored up to the bound
+            k = bmc_length
 
         if problem.verification == VerificationType.EQUIVALENCE:
             accepted_ver = True
-            bmcseq = BMCSafety(hts, problem)
-            res, trace, t = bmcseq.safety(prop, bmc_length, bmc_length_min)
+            if problem.sweeping:
+                bmceq = BMCEquivalence(hts, problem)
+                bmceq.set_budget(budget)
+                res, trace, k = bmceq.equivalence(prop, bmc_length, bmc_length_min)
+            else:
+                bmcseq = BMCSafety(hts, problem)
+                bmcseq.set_budget(budget)
+                res, trace, k = bmcseq.safety(prop, bmc_length, bmc_length_min)
 
         if not accepted_ver:
             Logger.error("Invalid verification type")
 
         Logger.log("\n*** Problem \"%s\" is %s ***"%(problem.name, res), 1)
-        return res, trace, traces, region
+        return res, trace, traces, region, k
 
     def get_file_flags(self, strfile):
         if FLAG_SR not in strfile:
@@ -243,13 +312,45 @@ class ProblemSolver(object):
         with open(ltl_file, 'wb') as f:
             pickle.dump(ltl, f)
 
+    def _result_to_cache(self, cachedir, key, status, k, traces):
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+        # traces are stored already printed, as the models depend on the current environment
+        strtraces = [(trace.extension, trace.length, trace.human_readable, str(trace)) for trace in traces]
+
+        with open("%s/%s.res"%(cachedir, key), 'wb') as f:
+            pickle.dump((status, k, strtraces), f)
+
+    def _result_from_cache(self, cachedir, key, clean):
+        result_file = "%s/%s.res"%(cachedir, key)
+
+        if not os.path.isfile(result_file):
+            return None
+
+        if clean:
+            os.remove(result_file)
+            return None
+
+        with open(result_file, 'rb') as f:
+            (status, k, strtraces) = pickle.load(f)
+
+        traces = []
+        for (extension, length, human_readable, strtrace) in strtraces:
+            trace = Trace(strtrace, length)
+            trace.extension = extension
+            trace.human_readable = human_readable
+            traces.append(trace)
+
+        return (status, k, traces)
+
     def _from_cache(self, cachedir, filename, config, flags):
         hts_file = "%s/%s.ssts"%(cachedir, filename)
         mi_file = "%s/%s.mi"%(cachedir, filename)
         inv_file = "%s/%s.inv"%(cachedir, filename)
         ltl_file = "%s/%s.ltl"%(cachedir, filename)
 
-        parser = SymbolicSimpleTSParser()
+        parser = ModelParsersFactory.parsers_by_extension("ssts")[0]
 
         hts = parser.parse_file(Path(hts_file), config, flags)[0]
 
@@ -268,6 +369,51 @@ class ProblemSolver(object):
 
         return (hts, inv, ltl, model_info)
 
+    def get_file_paths(self, model_files, relative_path):
+        paths = []
+        for strfile in model_files.split(FILE_SP):
+            (strfile, flags) = self.get_file_flags(strfile)
+            if len(strfile) > 1 and strfile[:2] == '~/':
+                filepath = Path.home() / Path(strfile[2:])
+            else:
+                filepath = Path(strfile)
+            if filepath.parts[0] != "/":
+                filepath = relative_path / filepath
+            paths.append((filepath, flags))
+        return paths
+
+    def _model_stamp(self, filepath, flags, general_config):
+        options = tuple([getattr(general_config, o, None) for o in MODEL_OPTIONS])
+        return (filepath.stat().st_mtime, tuple(flags) if flags is not None else None, options)
+
+    def _get_coi(self, hts):
+        if self.cois is None:
+            self.cois = {}
+
+        # the dependency graph only depends on the (cached) transition systems
+        key = frozenset(hts.tss)
+        if key not in self.cois:
+            self.cois[key] = ConeOfInfluence()
+        return self.cois[key]
+
+    def _result_key(self, hts, prop, lemmas, assumptions, problem, general_config):
+        coi_hts = self._get_coi(hts).compute(hts, prop)
+
+        # conjuncts are sorted to be independent from the order of the systems
+        hashes = []
+        for formulae in [[coi_hts.single_init()], [coi_hts.single_invar()], [coi_hts.single_trans()], \
+                         [prop], lemmas, assumptions]:
+            conjuncts = []
+            for formula in formulae:
+                if formula is not None:
+                    conjuncts += [structural_hash(f) for f in conjunctive_partition(formula)]
+            hashes.append(",".join(sorted(conjuncts)))
+
+        options = ["%s=%s"%(o, getattr(problem, o)) for o in RESULT_OPTIONS]
+        options.append("vcd=%s"%general_config.vcd)
+
+        return hashlib.sha1(";".join(hashes + options).encode()).hexdigest()
+
     def parse_model(self, \
                     model_files,
                     relative_path, \
@@ -279,27 +425,18 @@ class ProblemSolver(object):
         invar_props = []
         ltl_props = []
 
-        models = model_files.split(FILE_SP)
         cache_files = general_config.cache_files
         clean_cache = general_config.clean_cache
 
-        for strfile in models:
-            (strfile, flags) = self.get_file_flags(strfile)
-            if len(strfile) > 1 and strfile[:2] == '~/':
-                filepath = Path.home() / Path(strfile[2:])
-            else:
-                filepath = Path(strfile)
-            if filepath.parts[0] != "/":
-                filepath = relative_path / filepath
+        for (filepath, flags) in self.get_file_paths(model_files, relative_path):
             filetype = filepath.suffix[1:]
             parser = None
 
-            for av_parser in ModelParsersFactory.get_parsers():
+            for av_parser in ModelParsersFactory.parsers_by_extension(filetype):
                 assert av_parser.name is not None
-                if filetype in av_parser.get_extensions():
-                    parser = av_parser
-                    if not self.parser:
-                        self.parser = av_parser
+                parser = av_parser
+                if not self.parser:
+                    self.parser = av_parser
 
             if parser is not None:
                 if not filepath.is_file():
@@ -313,12 +450,21 @@ class ProblemSolver(object):
                     cachefile = "%s-%s"%(md5, cf)
                     cachedir = filepath.parent / COSACACHEDIR
 
-                if cache_files and self._is_cached(cachedir, cachefile, clean_cache):
+                # the init option modifies the parsed systems in place
+                stamp = None
+                if (self.models is not None) and (general_config.init is None):
+                    stamp = self._model_stamp(filepath, flags, general_config)
+
+                if (stamp is not None) and (filepath in self.models) and (self.models[filepath][0] == stamp):
+                    Logger.msg("Reusing parsed file \"%s\"... "%(filepath), 0)
+                    (hts_a, inv_a, ltl_a, model_info) = self.models[filepath][1]
+                elif cache_files and self._is_cached(cachedir, cachefile, clean_cache):
                     Logger.msg("Loading from cache file \"%s\"... "%(filepath), 0)
                     (hts_a, inv_a, ltl_a, model_info) = self._from_cache(cachedir, cachefile, general_config, flags)
                 else:
                     Logger.msg("Parsing file \"%s\"... "%(filepath), 0)
-                    (hts_a, inv_a, ltl_a) = parser.parse_file(filepath, general_config, flags)
+                    with Profiler.span("parse", file=str(filepath)):
+                        (hts_a, inv_a, ltl_a) = parser.parse_file(filepath, general_config, flags)
 
                     model_info = parser.get_model_info()
 
@@ -328,6 +474,11 @@ class ProblemSolver(object):
                     if cache_files and not clean_cache:
                         self._to_cache(cachedir, cachefile, hts_a, inv_a, ltl_a, model_info)
 
+                if stamp is not None:
+                    if (filepath in self.models) and (self.models[filepath][0] != stamp):
+                        self.cois.clear()
+                    self.models[filepath] = (stamp, (hts_a, inv_a, ltl_a, model_info))
+
                 self.model_info.combine(model_info)
                 hts.combine(hts_a)
 
@@ -344,7 +495,99 @@ class ProblemSolver(object):
 
         return (hts, invar_props, ltl_props)
 
-    def solve_problems(self, problems_config:ProblemsManager)->None:
+    def _projection(self, hts:HTS, prop:FNode, problem:NamedTuple)->Set[FNode]:
+        """Variables printed in the traces, including the state when the traces have a loop"""
+
+        projection = hts.input_vars | hts.output_vars | get_free_variables(prop)
+        if problem.verification in [VerificationType.LIVENESS, VerificationType.EVENTUALLY, VerificationType.LTL]:
+            # the variables with a next value, including the ones not declared as state
+            next_vars = [TS.get_ref_var(v) for v in get_free_variables(hts.single_trans()) if TS.is_prime(v)]
+            projection = projection | hts.state_vars | set(next_vars)
+        return projection
+
+    def _problems_formulae(self, problems_config:ProblemsManager, embedded_props:List)->Optional[List]:
+        """Properties, lemmas, assumptions and preconditions of the problems, None if they cannot be parsed yet"""
+
+        try:
+            formulae = [prop[2] for prop in embedded_props]
+            for problem in problems_config.problems:
+                parser = self.lparser if problem.verification == VerificationType.LTL else self.sparser
+                formulae += self.convert_formulae([problem.properties], parser, problems_config.relative_path)[0]
+                for converted in self.convert_formulae([problem.lemmas, problem.assumptions, problem.precondition],
+                                                       self.sparser, problems_config.relative_path):
+                    formulae += converted
+        except Exception:
+            return None
+
+        return formulae
+
+    def _observed_vars(self, problems_config:ProblemsManager, embedded_props:List)->Optional[Set]:
+        """Variables referred by the problems, None if they cannot be parsed yet"""
+
+        formulae = self._problems_formulae(problems_config, embedded_props)
+        if formulae is None:
+            return None
+
+        observed = set([])
+        for formula in formulae:
+            observed |= set([TS.get_ref_var(v) for v in get_free_variables(formula)])
+        return observed
+
+    def phase_abstraction(self, hts:HTS, problems_config:ProblemsManager, embedded_props:List)->HTS:
+        clocks = set(self.model_info.clock_list)
+
+        # a step is a clock cycle: next, prev and the temporal operators would refer to cycles instead of phases
+        formulae = self._problems_formulae(problems_config, embedded_props)
+        if formulae is None:
+            return hts
+        temporal = any([problem.verification == VerificationType.LTL for problem in problems_config.problems])
+        timed = any([TS.has_next(f) or any([TS.is_prev(v) for v in get_free_variables(f)]) for f in formulae])
+        if temporal or timed:
+            Logger.log("Phase abstraction not applicable to problems with next, prev or temporal operators", 1)
+            return hts
+
+        # the clock should not be observed by the problems
+        observed = self._observed_vars(problems_config, embedded_props)
+        if observed is None:
+            return hts
+
+        equivalences = [problem for problem in problems_config.problems \
+                        if problem.verification == VerificationType.EQUIVALENCE]
+        systems = [hts] + [problems_config.get_second_model(problem) for problem in equivalences]
+
+        abstraction = PhaseAbstraction.abstract(systems, sorted(clocks, key=lambda c: c.symbol_name()), observed)
+        if abstraction is None:
+            return hts
+
+        (folded, abstract_clock_list) = abstraction
+        for (problem, hts2) in zip(equivalences, folded[1:]):
+            problems_config.add_second_model(problem, hts2)
+
+        # the traces are revised as for the abstract clock encoding
+        self.model_info.abstract_clock_list = abstract_clock_list
+        if self.models is not None:
+            self.coi = ConeOfInfluence()
+
+        return folded[0]
+
+    def memory_abstraction(self, hts:HTS, problems_config:ProblemsManager, embedded_props:List)->HTS:
+        if any([problem.verification == VerificationType.EQUIVALENCE for problem in problems_config.problems]):
+            Logger.log("Memories encoding not applicable to equivalence checking", 1)
+            return hts
+
+        # the memories observed by the problems are kept as arrays
+        observed = self._observed_vars(problems_config, embedded_props)
+        if observed is None:
+            return hts
+
+        hts = MemoryAbstraction.run(hts, problems_config.general_config.memories,
+                                    problems_config.general_config.memory_blast_size, observed)
+        if self.models is not None:
+            self.coi = ConeOfInfluence()
+
+        return hts
+
+    def solve_problems(self, problems_config:ProblemsManager, callback=None)->None:
 
         general_config  = problems_config.general_config
         model_extension = general_config.model_extension
@@ -354,6 +597,13 @@ class ProblemSolver(object):
         self.lparser = LTLParser()
 
         self.coi = ConeOfInfluence()
+        self.relative_path = problems_config.relative_path
+        self.model_info = ModelInformation()
+        self.properties = []
+
+        profile = general_config.profile
+        Profiler.enabled = profile is not None
+        Profiler.reset("model")
 
         modifier = None
         if general_config.model_extension is not None:
@@ -367,6 +617,9 @@ class ProblemSolver(object):
                                                        "System 1",
                                                        modifier)
 
+        if (self.models is not None) and (general_config.init is None):
+            self.coi = self._get_coi(hts)
+
         # Generate second models if any are necessary
         for problem in problems_config.problems:
             if problem.verification == VerificationType.EQUIVALENCE:
@@ -455,8 +708,26 @@ class ProblemSolver(object):
             Logger.msg("Set {}/{} state elements to zero "
                        "in initial state\n".format(num_def_init_vars, num_state_vars), 1)
 
+        # folds the two phases of the clock, when the registers are triggered on one edge
+        if general_config.phase_abstraction and general_config.add_clock and \
+           (not general_config.abstract_clock) and (general_config.clock_behaviors is None) and \
+           self.model_info.clock_list and (general_config.init is None):
+            hts = self.phase_abstraction(hts, problems_config, invar_props+ltl_props)
+
+        # simplifies the flattened model, keeping the variables visible to the problems
+        if general_config.passes is not None:
+            protected = hts.input_vars | hts.output_vars | hts.state_vars | set(self.model_info.clock_list)
+            hts = ModelPasses.run(hts, general_config.passes, protected)
+
+        # encodes the memories as arrays, locations, or abstract reads
+        if general_config.memories is not None:
+            hts = self.memory_abstraction(hts, problems_config, invar_props+ltl_props)
+
         problems_config.hts = hts
 
+        if profile is not None:
+            Profiler.write("%s-model.%s"%(profile, PROFILE_EXT), general_config.profile_format)
+
         # TODO: Update this so that we can control whether embedded assertions are solved automatically
         if not general_config.skip_embedded:
             for invar_prop in invar_props:
@@ -483,6 +754,10 @@ class ProblemSolver(object):
                 Logger.log("\n*** Analyzing problem \"%s\" ***"%(problem.name), 1)
                 Logger.msg("Solving \"%s\" "%problem.name, 0, not(Logger.level(1)))
 
+            Profiler.reset(problem.name)
+            # the budget also includes the encoding of the problem
+            budget = Budget.from_problem(problem)
+
             # apply parametric behaviors (such as toggling the clock)
             # Note: This is supposed to be *before* creating the combined system for equivalence checking
             #       we want this assumption to be applied to both copies of the clock
@@ -539,6 +814,13 @@ class ProblemSolver(object):
                     assert len(precondition) == 1, "There should only be one precondition"
                     prop = Implies(precondition[0], prop)
 
+                # the variables removed by the model passes are replaced by their definitions
+                if problem_hts.eliminated:
+                    if prop is not None:
+                        prop = problem_hts.apply_definitions(prop)
+                    lemmas = [problem_hts.apply_definitions(lemma) for lemma in lemmas]
+                    assumptions = [problem_hts.apply_definitions(assumption) for assumption in assumptions]
+
                 # TODO: keep assumptions separate from the hts
                 # IMPORTANT: CLEAR ANY PREVIOUS ASSUMPTIONS AND LEMMAS
                 #   This was previously done in __solve_problem and has been moved here
@@ -553,39 +835,123 @@ class ProblemSolver(object):
                 if problem.coi:
                     if Logger.level(2):
                         timer = Logger.start_timer("COI")
-                    hts = self.coi.compute(hts, prop)
+                    with Profiler.span("coi"):
+                        hts = self.coi.compute(hts, prop)
                     if Logger.level(2):
                         Logger.get_timer(timer)
 
                 if general_config.time:
                     timer_solve = Logger.start_timer("Problem %s"%problem.name, False)
 
-                status, trace, traces, region =  self.__solve_problem(problem_hts,
-                                                              prop,
-                                                              lemmas,
-                                                              assumptions,
-                                                              problem)
-
-                # set status for this problem
-                problems_config.set_problem_status(problem, status)
-
-                # TODO: Determine whether we need both trace and traces
-                assert trace is None or traces is None, "Expecting either a trace or a list of traces"
-                if trace is not None:
-                    problem_traces = self.__process_trace(hts, trace, general_config, problem)
-                    problems_config.set_problem_traces(problem, problem_traces)
-
-                if traces is not None:
-                    traces_to_add = []
-                    for trace in traces:
-                        problem_trace = self.__process_trace(hts, trace, general_config, problem)
-                        for pt in problem_trace:
-                            traces_to_add.append(pt)
-                    problems_config.set_problem_traces(problem, traces_to_add)
-
-                if problem.verification == VerificationType.PARAMETRIC:
-                    assert region is not None
-                    problems_config.set_problem_region(problem, region)
+                # the traces are printed on the solved system
+                trace_hts = hts
+
+                # models are restricted to the variables printed in the traces
+                projection = None
+                if (not (general_config.vcd or problem.full_trace or problem.trace_all_vars)) and \
+                   (prop is not None) and (problem.verification != VerificationType.EQUIVALENCE):
+                    projection = self._projection(hts, prop, problem)
+
+                # problems with the same cone of influence and options have the same result
+                result_key = None
+                if ((self.results is not None) or general_config.cache_results) and \
+                   (problem.replay is None) and (not problem.skip_solving):
+                    result_key = self._result_key(problem_hts, prop, lemmas, assumptions, problem, general_config)
+
+                # the regions of parametric problems are not stored on disk
+                cache_result = (result_key is not None) and general_config.cache_results and \
+                               (problem.verification != VerificationType.PARAMETRIC)
+                resultsdir = problems_config.relative_path / COSARESULTSDIR
+
+                cached = None
+                exhausted = None
+                if cache_result:
+                    cached = self._result_from_cache(resultsdir, result_key, general_config.clean_cache)
+
+                if cached is not None:
+                    (status, k, problem_traces) = cached
+                    Logger.log("Loading result from cache (k=%s)"%(k), 1)
+                    problems_config.set_problem_status(problem, status)
+                    if status == VerificationStatus.UNK:
+                        problems_config.set_problem_depth(problem, k)
+                    if problem_traces:
+                        problems_config.set_problem_traces(problem, problem_traces)
+                else:
+                    if (self.results is not None) and (result_key in self.results):
+                        Logger.log("Reusing the previous result of an equivalent problem", 1)
+                        status, trace, traces, region, k = self.results[result_key]
+                    else:
+                        try:
+                            with Profiler.span("verification", type=str(problem.verification)):
+                                status, trace, traces, region, k = self.__solve_problem(problem_hts,
+                                                                                        prop,
+                                                                                        lemmas,
+                                                                                        assumptions,
+                                                                                        problem,
+                                                                                        projection,
+                                                                                        budget)
+
+                                # the traces of the abstract memories are confirmed on the concrete ones
+                                if (problem_hts.concrete is not None) and ((trace is not None) or traces):
+                                    Logger.log("Solving again with the concrete memories", 1)
+                                    trace_hts = ParametricBehavior.apply_to_problem(problem_hts.concrete, problem,
+                                                                                    general_config, self.model_info)
+                                    if projection is not None:
+                                        projection = self._projection(trace_hts, prop, problem)
+                                    status, trace, traces, region, k = self.__solve_problem(trace_hts,
+                                                                                            prop,
+                                                                                            lemmas,
+                                                                                            assumptions,
+                                                                                            problem,
+                                                                                            projection,
+                                                                                            budget)
+                        except BudgetExhausted as e:
+                            Logger.log("\n%s"%(e), 1)
+                            status, trace, traces, region, k = VerificationStatus.UNK, None, None, None, e.k
+                            exhausted = e.budget
+                            problems_config.set_problem_exhausted(problem, exhausted)
+                        finally:
+                            # the cone of influence of the next problems is computed on the model
+                            problem_hts.set_functional(False)
+
+                        # the workers stopped by the budget return partial results
+                        if (exhausted is None) and (budget is not None) and (budget.stopped is not None):
+                            (exhausted, k) = budget.stopped
+                            problems_config.set_problem_exhausted(problem, exhausted)
+
+                        # the results of exhausted budgets depend on the machine load
+                        if (self.results is not None) and (result_key is not None) and (exhausted is None):
+                            self.results[result_key] = (status, trace, traces, region, k)
+
+                    # set status for this problem
+                    problems_config.set_problem_status(problem, status)
+
+                    # TODO: Determine whether we need both trace and traces
+                    assert trace is None or traces is None, "Expecting either a trace or a list of traces"
+                    if trace is not None:
+                        problem_traces = self.__process_trace(trace_hts, trace, general_config, problem)
+                        problems_config.set_problem_traces(problem, problem_traces)
+
+                    if traces is not None:
+                        traces_to_add = []
+                        for trace in traces:
+                            problem_trace = self.__process_trace(trace_hts, trace, general_config, problem)
+                            for pt in problem_trace:
+                                traces_to_add.append(pt)
+                        problems_config.set_problem_traces(problem, traces_to_add)
+
+                    if problem.verification == VerificationType.PARAMETRIC:
+                        assert (region is not None) or (exhausted is not None)
+                        problems_config.set_problem_region(problem, region)
+
+                    if status == VerificationStatus.UNK:
+                        problems_config.set_problem_depth(problem, k)
+
+                    if cache_result and (status is not None) and (exhausted is None) and (not general_config.clean_cache):
+                        problem_traces = []
+                        if problems_config.has_problem_trace(problem):
+                            problem_traces = problems_config.get_problem_traces(problem)
+                        self._result_to_cache(resultsdir, result_key, status, k, problem_traces)
 
                 if status is not None:
                     Logger.msg(" %s\n"%status, 0, not(Logger.level(1)))
@@ -611,6 +977,12 @@ class ProblemSolver(object):
                     problems_config.set_problem_time(problem,
                                                      Logger.get_timer(timer_solve, False))
 
+                if profile is not None:
+                    Profiler.write("%s-%s.%s"%(profile, problem.name, PROFILE_EXT), general_config.profile_format)
+
+                if callback is not None:
+                    callback(problem)
+
             except KeyboardInterrupt as e:
                 Logger.msg("\b\b Skipped!\n", 0)
 
@@ -8,25 +8,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+
 from six.moves import cStringIO
 
-from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, BOOL, simplify, BVAdd, BVUGE
+from pysmt.shortcuts import BV, And, Or, Solver, TRUE, FALSE, Not, EqualsOrIff, Implies, Iff, Symbol, simplify, BVAdd, BVUGE
+from pysmt.shortcuts import get_env
 from pysmt.rewritings import conjunctive_partition
 from pysmt.smtlib.printers import SmtDagPrinter
 from pysmt.logics import convert_logic_from_string, QF_BV, QF_ABV
+from pysmt.exceptions import SolverReturnedUnknownResultError
 
 from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
+from cosa.utils.budget import BudgetExhausted, WALL_TIME, SOLVER_TIME
 from cosa.representation import TS, HTS
 from cosa.utils.formula_mngm import substitute, get_free_variables
 from cosa.printers.trace import TextTracePrinter, VCDTracePrinter
 from cosa.problem import Trace
 from cosa.utils.generic import status_bar
+from cosa.utils.smt2_tracer import SMT2Tracer, GZ_EXT
 
 class VerificationStrategy(object):
     FWD = "FWD"
     BWD = "BWD"
     ZZ  = "ZZ"
     NU  = "NU"
+    CONC = "CONC"
     INT  = "INT"
     LTL  = "LTL"
     AUTO = "AUTO"
@@ -43,6 +51,7 @@ def get_verification_strategies():
     strategies.append((VerificationStrategy.ZZ,    "Mixed Forward and Backward reachability (Zig-Zag)"))
     strategies.append((VerificationStrategy.INT,   "Interpolation"))
     strategies.append((VerificationStrategy.NU,    "States picking without unrolling (only for simulation)"))
+    strategies.append((VerificationStrategy.CONC,  "Concrete simulation without solver (only for simulation)"))
     strategies.append((VerificationStrategy.LTL,   "Pure LTL verification (without optimizations)"))
     strategies.append((VerificationStrategy.ALL,   "Use all techniques"))
     return strategies
@@ -56,29 +65,33 @@ class TraceSolver(object):
     solver_options = None
     basename = None
     trace_file = None
+    tracer = None
+    trace_async = False
     solver = None
-    smt2vars = None
-    smt2vars_inc = None
 
-    def __init__(self, solver_name, name, logic, incremental, solver_options, basename=None):
+    def __init__(self, solver_name, name, logic, incremental, solver_options, basename=None, trace_async=False):
         self.solver_name = solver_name
         self.name = name
         self.logic = logic
         self.incremental = incremental
         self.solver_options = solver_options
         self.basename = basename
-        self.smt2vars = set([])
+        self.trace_async = trace_async
         self.solver = Solver(name=solver_name, logic=logic, incremental=incremental, solver_options=solver_options)
-        self.smt2vars_inc = []
         if basename is not None:
-            self.trace_file = "%s-%s.smt2"%(basename, name)
+            compressed = basename.endswith(GZ_EXT)
+            if compressed:
+                basename = basename[:-len(GZ_EXT)]
+            self.trace_file = "%s-%s.smt2%s"%(basename, name, GZ_EXT if compressed else "")
+            self.tracer = SMT2Tracer(self.trace_file, logic, trace_async)
 
     def clear(self):
         self.solver.exit()
         self.solver = Solver(name=self.solver_name, logic=self.logic, incremental=self.incremental, solver_options=self.solver_options)
 
     def copy(self, name=None):
-        return TraceSolver(self.solver_name, self.name if name is None else name, self.logic, self.incremental, self.solver_options, self.basename)
+        return TraceSolver(self.solver_name, self.name if name is None else name, self.logic, self.incremental, self.solver_options, \
+                           self.basename, self.trace_async)
 
 class BMCSolver(object):
 
@@ -93,14 +106,54 @@ class BMCSolver(object):
 
         basename = None
         if self.config.smt2_tracing is not None:
-            basename = ".".join(self.config.smt2_tracing.split(".")[:-1])
+            # compressed traces keep the extension, e.g., trace.smt2.gz -> trace-main.smt2.gz
+            tracing = self.config.smt2_tracing
+            compressed = tracing.endswith(GZ_EXT)
+            if compressed:
+                tracing = tracing[:-len(GZ_EXT)]
+            basename = ".".join(tracing.split(".")[:-1])
+            if compressed:
+                basename += GZ_EXT
         logic = convert_logic_from_string(self.hts.logic)
         self.solver = TraceSolver(config.solver_name, "main", logic=logic, incremental=config.incremental,
-                                  solver_options=config.solver_options, basename=basename)
+                                  solver_options=config.solver_options, basename=basename, trace_async=config.smt2_tracing_async)
 
         self.varmapf_t = None
         self.varmapb_t = None
 
+        self.projection = None
+        self.definition_vars = set([])
+        self.budget = None
+
+    def set_projection(self, vars):
+        """Restricts the models to the given variables, None extracts all of them"""
+        self.projection = None if vars is None else set([TS.get_ref_var(v) for v in vars])
+
+        # the removed wires are evaluated from the variables of their definitions
+        self.definition_vars = set([])
+        definitions = self.hts.definitions()
+        if (self.projection is not None) and definitions:
+            wires = set([v for v in self.projection if v in definitions])
+            for var in wires:
+                self.definition_vars |= get_free_variables(definitions[var])
+            self.definition_vars -= self.projection
+            self.projection = (self.projection - wires) | self.definition_vars
+
+    def set_budget(self, budget):
+        """Stops the search with BudgetExhausted when the budget runs out, None for no limits"""
+        self.budget = budget
+
+    def _step(self, t):
+        Profiler.step("k", k=t)
+        if self.budget is not None:
+            self.budget.k = t
+            self.budget.check()
+
+    def _set_solver_timeout(self, solver, seconds):
+        # only z3 supports a timeout on each call
+        if (seconds is not None) and (solver.solver_name == "z3"):
+            solver.solver.z3.set("timeout", max(int(seconds*1000), 1))
+
     def unroll(self, trans, invar, k_end, k_start=0, gen_list=False):
         Logger.log("Unroll from %s to %s"%(k_start, k_end), 2)
 
@@ -110,12 +163,13 @@ class BMCSolver(object):
 
         formula = []
         t = k_start
-        while t < k_end:
-            to_t = t+1 if fwd else t
-            formula.append(time_function(trans, t))
-            formula.append(time_function(invar, to_t))
-            Logger.log("Add trans, k=%s"%t, 2)
-            t += 1
+        with Profiler.span("unroll", k_start=k_start, k_end=k_end):
+            while t < k_end:
+                to_t = t+1 if fwd else t
+                formula.append(time_function(trans, t))
+                formula.append(time_function(invar, to_t))
+                Logger.log("Add trans, k=%s"%t, 2)
+                t += 1
 
         if gen_list:
             return formula
@@ -135,6 +189,7 @@ class BMCSolver(object):
         if self.config.strategy in [VerificationStrategy.AUTO, \
                                     VerificationStrategy.FWD, \
                                     VerificationStrategy.NU, \
+                                    VerificationStrategy.CONC, \
                                     VerificationStrategy.INT, \
                                     VerificationStrategy.LTL, \
                                     VerificationStrategy.ALL, \
@@ -187,21 +242,16 @@ class BMCSolver(object):
                 self.varmapb_t[t-1] = dict(varmapb)
 
     def at_time(self, formula, t):
+        Profiler.count("substitutions")
         return substitute(formula, self.varmapf_t[t])
 
     def at_ptime(self, formula, t):
+        Profiler.count("substitutions")
         return substitute(formula, self.varmapb_t[t])
 
     def _write_smt2_log(self, solver, line):
-        # don't include any escape characters in smt2 output
-        # they can't be quoted away with "|" and should only
-        # be a part of a name, because auto-generated names don't
-        # use escape characters
-        line = line.replace("\\", "")
-        tracefile = solver.trace_file
-        if tracefile is not None:
-            with open(tracefile, "a") as f:
-                f.write(line+"\n")
+        if solver.tracer is not None:
+            solver.tracer.write(line)
 
     def _write_smt2_comment(self, solver, line):
         return self._write_smt2_log(solver, ";; %s"%line)
@@ -214,45 +264,25 @@ class BMCSolver(object):
         return buf.getvalue()
     
     def _add_assertion(self, solver, formula, comment=None):
+        Profiler.count("assertions")
         if not self.config.skip_solving:
             solver.solver.add_assertion(formula)
 
         if Logger.level(3):
             print(self._formula_to_smt2(formula)+"\n")
 
-        if solver.trace_file is not None:
+        if solver.tracer is not None:
             if comment:
                 self._write_smt2_comment(solver, "%s: START"%comment)
 
-            formula_fv = get_free_variables(formula)
-
-            for v in formula_fv:
-                if v in solver.smt2vars:
-                    continue
-
-                symbol_name = self._formula_to_smt2(v)
-                if v.symbol_type() == BOOL:
-                    self._write_smt2_log(solver, "(declare-fun %s () Bool)" % (symbol_name))
-                elif v.symbol_type().is_array_type():
-                    st = v.symbol_type()
-                    assert st.index_type.is_bv_type(), "Expecting BV indices"
-                    assert st.elem_type.is_bv_type(), "Expecting BV elements"
-                    self._write_smt2_log(solver, "(declare-fun %s () (Array (_ BitVec %s) (_ BitVec %s)))"%(symbol_name, st.index_type.width, st.elem_type.width))
-                elif v.symbol_type().is_bv_type():
-                    self._write_smt2_log(solver, "(declare-fun %s () (_ BitVec %s))" % (symbol_name, v.symbol_type().width))
-                else:
-                    Logger.error("Unhandled type in smt2 translation")
-
+            solver.tracer.declare(formula)
             self._write_smt2_log(solver, "")
 
-            for v in formula_fv:
-                solver.smt2vars.add(v)
-
             if formula.is_and():
                 for f in conjunctive_partition(formula):
-                    self._write_smt2_log(solver, "(assert %s)"%self._formula_to_smt2(f))
+                    solver.tracer.assert_formula(f)
             else:
-                self._write_smt2_log(solver, "(assert %s)"%self._formula_to_smt2(formula))
+                solver.tracer.assert_formula(formula)
 
             if comment:
                 self._write_smt2_comment(solver, "%s: END"%comment)
@@ -263,22 +293,45 @@ class BMCSolver(object):
         if not self.config.skip_solving:
             solver.solver.push()
 
-        solver.smt2vars_inc.append(solver.smt2vars)
-        self._write_smt2_log(solver, "(push 1)")
+        if solver.tracer is not None:
+            solver.tracer.push()
 
     def _pop(self, solver):
         Logger.log("Pop solver \"%s\""%solver.name, 2)
         if not self.config.skip_solving:
             solver.solver.pop()
 
-        solver.smt2vars = solver.smt2vars_inc.pop()
-        self._write_smt2_log(solver, "(pop 1)")
+        if solver.tracer is not None:
+            solver.tracer.pop()
 
     def _get_model(self, solver, relevant_vars=None):
-        if relevant_vars is None:
-            return dict(solver.solver.get_model())
+        with Profiler.span("model extraction"):
+            if relevant_vars is None:
+                if (self.projection is None) or (self.varmapf_t is None):
+                    return dict(solver.solver.get_model())
+                return self._get_projected_model(solver)
+
+            # a single model for all the values
+            model = solver.solver.get_model()
+            return dict([(v, model.get_value(v)) for v in relevant_vars])
+
+    def _get_projected_model(self, solver):
+        # only the timed copies of the projection that have been
+        # instantiated can be part of the model
+        symbols = get_env().formula_manager.symbols
+        names = [v.symbol_name() for v in self.projection]
+
+        steps = [(TS.get_timed_name, t) for t in self.varmapf_t]
+        if self.varmapb_t is not None:
+            steps += [(TS.get_ptimed_name, t) for t in self.varmapb_t if t >= 0]
+
+        model = {}
+        for (timed, t) in steps:
+            step_vars = [symbols[n] for n in [timed(name, t) for name in names] if n in symbols]
+            if step_vars:
+                model.update(solver.solver.get_values(step_vars))
 
-        return dict([(v, solver.solver.get_value(v)) for v in relevant_vars])
+        return model
 
     def _reset_assertions(self, solver, clear=False):
         if clear:
@@ -286,16 +339,16 @@ class BMCSolver(object):
         if not self.config.skip_solving:
             solver.solver.reset_assertions()
 
-        if solver.trace_file is not None:
-            solver.smt2vars = set([])
-            with open(solver.trace_file, "w") as f:
-                f.write("(set-logic %s)\n"%self.hts.logic)
+        if solver.tracer is not None:
+            solver.tracer.reset()
 
     def _solve(self, solver):
         Logger.log("Solve solver \"%s\""%solver.name, 2)
 
         self._write_smt2_log(solver, "(check-sat)")
         self._write_smt2_log(solver, "")
+        if solver.tracer is not None:
+            solver.tracer.flush()
 
         if self.config.skip_solving:
             return None
@@ -303,7 +356,25 @@ class BMCSolver(object):
         if Logger.level(2):
             timer = Logger.start_timer("Solve")
 
-        r = solver.solver.solve()
+        if self.budget is not None:
+            self._set_solver_timeout(solver, self.budget.remaining_time())
+            start = time.time()
+
+        Profiler.count("solver calls")
+        with Profiler.span("solve", solver=solver.name):
+            try:
+                r = solver.solver.solve()
+            except SolverReturnedUnknownResultError:
+                if self.budget is None:
+                    raise
+                # the solver reached the timeout
+                self.budget.add_solver_time(time.time()-start)
+                budget = WALL_TIME if self.budget.solver_time_limit is None else SOLVER_TIME
+                raise BudgetExhausted(self.budget.exhausted() or budget, self.budget.depth())
+
+        if self.budget is not None:
+            self.budget.add_solver_time(time.time()-start)
+            self.budget.check()
 
         if Logger.level(2):
             self.total_time += Logger.get_timer(timer)
@@ -346,6 +417,8 @@ class BMCSolver(object):
 
         h_init = hts.single_init()
         h_trans = hts.single_trans()
+        invar = hts.single_invar()
+        n_invar = TS.to_next(invar)
 
         holding_lemmas = []
         lindex = 1
@@ -354,13 +427,15 @@ class BMCSolver(object):
         flemmas = 0
         for lemma in lemmas:
             Logger.log("\nChecking Lemma %s/%s"%(lindex,nlemmas), 1)
-            invar = hts.single_invar()
             init = And(h_init, invar)
-            trans = And(invar, h_trans, TS.to_next(invar))
+            trans = And(invar, h_trans, n_invar)
             if self._check_lemma(hts, lemma, init, trans):
                 holding_lemmas.append(lemma)
                 hts.add_assumption(lemma)
-                hts.reset_formulae()
+                # only the new lemma is added to the invariant
+                if not TS.has_next(lemma):
+                    invar = And(invar, lemma)
+                    n_invar = And(n_invar, TS.to_next(lemma))
 
                 Logger.log("Lemma %s holds"%(lindex), 1)
                 tlemmas += 1
@@ -398,10 +473,36 @@ class BMCSolver(object):
 
         for var in vars:
             for t in range(int(k/2)+1, k+1, 1):
-                retmodel[TS.get_timed(var, t)] = model[TS.get_ptimed(var, k-t)]
+                if TS.get_ptimed(var, k-t) in model:
+                    retmodel[TS.get_timed(var, t)] = model[TS.get_ptimed(var, k-t)]
 
         return retmodel
 
+    def _complete_model(self, model, length):
+        definitions = self.hts.definitions()
+        if (not definitions) or (self.varmapf_t is None):
+            return model
+
+        model = dict(model)
+        for t in range(length+1):
+            if t not in self.varmapf_t:
+                break
+            varmap = self.varmapf_t[t]
+            for (var, definition) in definitions.items():
+                values = {}
+                for v in get_free_variables(definition):
+                    timed_v = Symbol(varmap.get(v.symbol_name(), v.symbol_name()), v.symbol_type())
+                    if timed_v in model:
+                        values[v] = model[timed_v]
+                value = definition.substitute(values).simplify()
+                if value.is_constant():
+                    model[TS.get_timed(var, t)] = value
+
+        if self.definition_vars:
+            model = dict([(v, value) for (v, value) in model.items() if TS.get_ref_var(v) not in self.definition_vars])
+
+        return model
+
     def generate_trace(self, \
                        model, \
                        length, \
@@ -409,7 +510,7 @@ class BMCSolver(object):
                        find_loop=False):
 
         trace = Trace()
-        trace.model = model
+        trace.model = self._complete_model(model, length)
         trace.length = length
         trace.infinite = find_loop
         trace.prop_vars = xvars
@@ -0,0 +1,349 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from pysmt.shortcuts import And, EqualsOrIff, get_model
+
+from cosa.utils.logger import Logger
+from cosa.representation import TS
+from cosa.encoders.modules import SEP
+from cosa.analyzers.simulator import ConcreteSimulator, ArrayValue
+
+TXT_STATE = re.compile(r"--->\s+(INIT|STATE\s+(?P<step>\d+))")
+TXT_ASSIGN = re.compile(r"\s*(I|S\d+):\s*(?P<name>.*\S)\s*=\s*(?P<value>\S+)\s*$")
+VCD_EXTRACT = re.compile(r"\[\d+:\d+\]$")
+
+class MissingValue(Exception):
+    index = None
+
+    def __init__(self, index):
+        Exception.__init__(self, "Missing value of variable %s"%index)
+        self.index = index
+
+class ReplayResult(object):
+    """Outcome of the replay of a trace.
+
+    step is the first step violating the model (valid is False) or the
+    property (holds is False), and states contains the replayed states up
+    to that step.
+    """
+
+    valid = True
+    holds = True
+    step = -1
+    message = None
+    states = None
+
+    def __init__(self, states):
+        self.states = states
+
+    def __repr__(self):
+        if self.message is None:
+            return "Trace replayed for %s steps"%(len(self.states)-1)
+        return self.message
+
+class TraceReplayer(object):
+    """Replays a trace on an HTS by concrete evaluation.
+
+    A trace is a list of steps, each of them being a dictionary from
+    variable index to value. Variables missing in a step are computed from
+    the model definitions, and the remaining ones (e.g., the initial content
+    of the memories) are solved for by the solver, if any. Otherwise the
+    trace is reported as under-specified.
+    """
+
+    simulator = None
+    remap = None
+    solver_name = None
+
+    def __init__(self, hts, remap=None, solver_name=None):
+        self.simulator = ConcreteSimulator(hts)
+        self.names = dict([(v.symbol_name(), v) for v in self.simulator.vars])
+        self.remap = remap
+        self.solver_name = solver_name
+
+    def _lookup(self, name):
+        if self.remap is not None:
+            name = self.remap(name)
+        return self.names[name] if name in self.names else None
+
+    def _fnode_value(self, value):
+        if value.is_array_value():
+            assignments = value.array_value_assigned_values_map()
+            return ArrayValue(self._fnode_value(value.array_value_default()), \
+                              dict([(self._fnode_value(i), self._fnode_value(v)) for (i, v) in assignments.items()]))
+        if value.is_store():
+            # e.g., the array values in the models of z3
+            array = self._fnode_value(value.arg(0))
+            if array is not None:
+                return array.store(self._fnode_value(value.arg(1)), self._fnode_value(value.arg(2)))
+            return None
+        if value.is_bool_constant():
+            return value.constant_value()
+        if value.is_bv_constant():
+            return int(value.constant_value())
+
+        return None
+
+    def _parse_value(self, value, vtype):
+        if vtype.is_bv_type():
+            for (sep, base) in [("'h", 16), ("'b", 2), ("'d", 10)]:
+                if sep in value:
+                    return int(value.split(sep)[1], base) & ((1 << vtype.width) - 1)
+        return self.simulator.parse_value(value, vtype)
+
+    def load_model(self, model, length):
+        """Loads the steps from a model (e.g., the one in a Trace)"""
+
+        steps = [dict() for t in range(length+1)]
+        index = self.simulator.index
+        for (var, value) in model.items():
+            time = TS.get_time(var)
+            if (time is None) or (time < 0) or (time > length):
+                continue
+            refvar = TS.get_ref_var(var)
+            if refvar not in index:
+                continue
+            value = self._fnode_value(value)
+            if value is not None:
+                steps[time][index[refvar]] = value
+
+        return steps
+
+    def load_txt(self, filename):
+        """Loads the steps from a textual trace, where each step only lists the changed values"""
+
+        index = self.simulator.index
+        steps = []
+        with open(filename, "r") as f:
+            for line in f.read().split("\n"):
+                if TXT_STATE.match(line.strip()):
+                    steps.append(dict(steps[-1]) if steps else {})
+                    continue
+                match = TXT_ASSIGN.match(line)
+                if (match is None) or (not steps):
+                    continue
+                var = self._lookup(match.group("name"))
+                if var is None:
+                    Logger.warning("Variable \"%s\" in trace \"%s\" is not part of the model"%(match.group("name"), filename))
+                    continue
+                if var.symbol_type().is_array_type():
+                    continue
+                steps[-1][index[var]] = self._parse_value(match.group("value"), var.symbol_type())
+
+        return steps
+
+    def load_vcd(self, filename):
+        """Loads the steps from a VCD, where each timestamp is a step"""
+
+        index = self.simulator.index
+        codes = {}
+        scopes = []
+        steps = []
+        changed = False
+
+        with open(filename, "r") as f:
+            tokens = f.read().split()
+
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token == "$scope":
+                scopes.append(tokens[i+2])
+                i += 4
+                continue
+            if token == "$upscope":
+                scopes.pop()
+                i += 2
+                continue
+            if token == "$var":
+                end = tokens.index("$end", i)
+                code = tokens[i+3]
+                name = VCD_EXTRACT.sub("", "".join(tokens[i+4:end]))
+                var = None
+                for prefix in [scopes[1:], scopes]:
+                    var = self._lookup(SEP.join(prefix + [name]))
+                    if var is not None:
+                        break
+                if (var is not None) and (not var.symbol_type().is_array_type()):
+                    codes[code] = var
+                i = end + 1
+                continue
+            if token.startswith("$"):
+                if token not in ["$dumpvars", "$end"]:
+                    i = tokens.index("$end", i)
+                i += 1
+                continue
+            if token.startswith("#"):
+                steps.append(dict(steps[-1]) if steps else {})
+                changed = False
+                i += 1
+                continue
+
+            if token[0] in "bB":
+                (value, code) = (token[1:], tokens[i+1])
+                i += 2
+            else:
+                (value, code) = (token[0], token[1:])
+                i += 1
+
+            if (code in codes) and steps and (re.match("^[01]+$", value) is not None):
+                var = codes[code]
+                value = int(value, 2)
+                steps[-1][index[var]] = (value == 1) if var.symbol_type().is_bool_type() else value
+                changed = True
+
+        # the last timestamp only closes the previous step
+        if (len(steps) > 1) and (not changed):
+            steps.pop()
+
+        return steps
+
+    def load(self, filename, abstract_clock_list=None):
+        if not filename.endswith(".vcd"):
+            return self.load_txt(filename)
+
+        steps = self.load_vcd(filename)
+
+        # VCDs of models with abstract clocks have two steps per transition
+        if abstract_clock_list:
+            clocks = set([self.simulator.index[clock] for (clock, _) in abstract_clock_list if clock in self.simulator.index])
+            steps = [dict([(i, v) for (i, v) in step.items() if i not in clocks]) for step in steps[0::2]]
+
+        return steps
+
+    def _matches(self, state, step):
+        for (i, value) in step.items():
+            if state[i] != value:
+                return i
+        return None
+
+    def _evaluate(self, step, advance):
+        def sample(i):
+            if i not in step:
+                raise MissingValue(i)
+            return step[i]
+
+        try:
+            return (advance(sample), None)
+        except MissingValue as e:
+            return (None, e.index)
+
+    def _at_time(self, formula, t):
+        varmap = {}
+        for v in self.simulator.vars:
+            varmap[v] = TS.get_timed(v, t)
+            varmap[TS.get_prime(v)] = TS.get_timed(v, t+1)
+            varmap[TS.get_prev(v)] = TS.get_timed(v, t-1)
+        return formula.substitute(varmap)
+
+    def _solve(self, steps):
+        # values of all the variables such that the steps are a behavior of
+        # the model, None if there is no such behavior
+        simulator = self.simulator
+        hts = simulator.hts
+        (init, invar, trans) = (hts.single_init(), hts.single_invar(), hts.single_trans())
+
+        formulae = [self._at_time(init, 0)]
+        for (t, step) in enumerate(steps):
+            formulae.append(self._at_time(invar, t))
+            if t > 0:
+                formulae.append(self._at_time(trans, t-1))
+            for (i, value) in step.items():
+                var = simulator.vars[i]
+                formulae.append(EqualsOrIff(TS.get_timed(var, t), simulator.to_fnode(value, var.symbol_type())))
+
+        model = get_model(And(formulae), solver_name=self.solver_name)
+        if model is None:
+            return None
+
+        values = []
+        for t in range(len(steps)):
+            step = [(i, self._fnode_value(model.get_value(TS.get_timed(v, t)))) for (i, v) in enumerate(simulator.vars)]
+            values.append(dict([(i, value) for (i, value) in step if value is not None]))
+        return values
+
+    def replay(self, steps, prop=None):
+        """Replays the steps, stopping at the first step violating the model or the property"""
+
+        simulator = self.simulator
+        if simulator._init_f is None:
+            simulator.compile()
+
+        check = None
+        has_next = False
+        if prop is not None:
+            check = simulator.compile_check(prop)
+            has_next = TS.has_next(prop)
+
+        states = []
+        result = ReplayResult(states)
+        values = steps
+
+        t = 0
+        while t < len(steps):
+            if t == 0:
+                (state, missing) = self._evaluate(values[t], simulator._init_f)
+            else:
+                (state, missing) = self._evaluate(values[t], lambda sample: simulator._step_f(states[-1], sample))
+
+            reason = None
+            if missing is not None:
+                name = simulator.vars[missing].symbol_name()
+                if (self.solver_name is None) or (values is not steps):
+                    reason = "the value of \"%s\" is under-specified"%(name)
+                else:
+                    # the values missing in the trace are solved for, and the replay restarts
+                    Logger.log("Solving the values missing in the trace, e.g., \"%s\""%(name), 1)
+                    values = self._solve(steps)
+                    if values is not None:
+                        del(states[:])
+                        t = 0
+                        continue
+                    # the first step not matched by any behavior of the model
+                    t = 0
+                    while self._solve(steps[:t+1]) is not None:
+                        t += 1
+                    reason = "no behavior of the model matches the trace"
+            elif state is None:
+                reason = "the model constraints are violated"
+            else:
+                mismatch = self._matches(state, steps[t])
+                if mismatch is not None:
+                    reason = "value of \"%s\" differs from the trace (%s)"%(simulator.vars[mismatch].symbol_name(), steps[t][mismatch])
+
+            if reason is not None:
+                result.valid = False
+                result.step = t
+                result.message = "Trace violates the model at step %s: %s"%(t, reason)
+                return result
+
+            states.append(state)
+            t += 1
+
+            if check is None:
+                continue
+
+            if has_next:
+                if (len(states) > 1) and (not check(states[-2], state)):
+                    result.holds = False
+            elif not check(state):
+                result.holds = False
+
+            if not result.holds:
+                result.step = len(states)-1
+                result.message = "Property violated at step %s"%(result.step)
+                return result
+
+        return result
+
+    def to_model(self, result):
+        return self.simulator.to_model(result.states)
@@ -0,0 +1,1095 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import time
+
+import pysmt.operators as op
+from pysmt.shortcuts import TRUE, FALSE, BV, Array, Ite, Implies, EqualsOrIff, And
+from pysmt.rewritings import conjunctive_partition
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.representation import TS
+
+INIT = "init"
+TRANS = "trans"
+INVAR = "invar"
+
+ARRAY_OPERATORS = [op.ARRAY_SELECT, op.ARRAY_STORE, op.ARRAY_VALUE]
+
+class ArrayValue(object):
+
+    __slots__ = ["default", "values"]
+
+    def __init__(self, default, values=None):
+        self.default = default
+        self.values = values if values is not None else {}
+
+    def select(self, idx):
+        return self.values.get(idx, self.default)
+
+    def store(self, idx, value):
+        values = dict(self.values)
+        values[idx] = value
+        return ArrayValue(self.default, values)
+
+    def __eq__(self, other):
+        if not isinstance(other, ArrayValue):
+            return False
+        if self.default != other.default:
+            return False
+        for idx in set(self.values.keys()) | set(other.values.keys()):
+            if self.select(idx) != other.select(idx):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.default, frozenset([(i, v) for (i, v) in self.values.items() if v != self.default])))
+
+def _signed(a, w):
+    return a - (1 << w) if (a >> (w-1)) else a
+
+def _udiv(a, b, m):
+    return (a // b) if b else m
+
+def _urem(a, b):
+    return (a % b) if b else a
+
+def _sdiv(a, b, w):
+    m = (1 << w) - 1
+    (sa, sb) = (_signed(a, w), _signed(b, w))
+    if sb == 0:
+        return 1 if sa < 0 else m
+    q = abs(sa) // abs(sb)
+    return (-q if (sa < 0) != (sb < 0) else q) & m
+
+def _srem(a, b, w):
+    m = (1 << w) - 1
+    (sa, sb) = (_signed(a, w), _signed(b, w))
+    if sb == 0:
+        return a
+    r = abs(sa) % abs(sb)
+    return (-r if sa < 0 else r) & m
+
+def _ashr(a, b, w):
+    if b >= w:
+        return ((1 << w) - 1) if (a >> (w-1)) else 0
+    return (_signed(a, w) >> b) & ((1 << w) - 1)
+
+def _shl(a, b, w):
+    return ((a << b) & ((1 << w) - 1)) if b < w else 0
+
+def _sext(a, w, n):
+    return (a | (((1 << n) - 1) << w)) if (a >> (w-1)) else a
+
+def _rol(a, n, w):
+    n = n % w
+    return ((a << n) | (a >> (w - n))) & ((1 << w) - 1)
+
+def _array(default, assignments):
+    return ArrayValue(default, dict(assignments))
+
+def _eq(a, b, ones):
+    if not isinstance(a, tuple):
+        return ones ^ (a ^ b)
+    m = ones
+    for (x, y) in zip(a, b):
+        m &= ones ^ (x ^ y)
+    return m
+
+def _ite(c, a, b, ones):
+    nc = ones ^ c
+    if not isinstance(a, tuple):
+        return (c & a) | (nc & b)
+    return tuple([(c & x) | (nc & y) for (x, y) in zip(a, b)])
+
+def _unslice(value, lanes):
+    # per-lane values of a lane mask (Booleans) or of bit planes (bit-vectors)
+    if not isinstance(value, tuple):
+        return [((value >> j) & 1) == 1 for j in range(lanes)]
+    values = [0]*lanes
+    for (b, plane) in enumerate(value):
+        while plane:
+            low = plane & -plane
+            values[low.bit_length()-1] |= 1 << b
+            plane ^= low
+    return values
+
+def _slice(values, width):
+    # lane mask (width is None) or bit planes of the per-lane values
+    if width is None:
+        return sum([1 << j for (j, v) in enumerate(values) if v])
+    planes = [0]*width
+    for (j, v) in enumerate(values):
+        b = 0
+        while v:
+            if v & 1:
+                planes[b] |= 1 << j
+            v >>= 1
+            b += 1
+    return tuple(planes)
+
+def _perlane(function, width, lanes, *args):
+    return _slice([function(*values) for values in zip(*[_unslice(a, lanes) for a in args])], width)
+
+class FormulaCompiler(object):
+    """Compiles pysmt formulae into straight-line Python code over integers.
+
+    Bit-vectors are represented as non-negative integers, Booleans as bool
+    and arrays as ArrayValue objects. Each subformula is assigned to a
+    temporary variable, hence common subexpressions are computed once.
+    """
+
+    namespace = {"_signed": _signed, "_udiv": _udiv, "_urem": _urem, "_sdiv": _sdiv, "_srem": _srem, \
+                 "_ashr": _ashr, "_shl": _shl, "_sext": _sext, "_rol": _rol, "_array": _array}
+
+    def __init__(self, resolve, lines, prefix="t"):
+        self.resolve = resolve
+        self.lines = lines
+        self.prefix = prefix
+        self.memo = {}
+        self.count = 0
+
+        self.templates = {
+            op.AND: lambda f, a: "(%s)"%(" and ".join(a)),
+            op.OR: lambda f, a: "(%s)"%(" or ".join(a)),
+            op.NOT: lambda f, a: "(not %s)"%a[0],
+            op.IMPLIES: lambda f, a: "((not %s) or %s)"%(a[0], a[1]),
+            op.IFF: lambda f, a: "(%s == %s)"%(a[0], a[1]),
+            op.EQUALS: lambda f, a: "(%s == %s)"%(a[0], a[1]),
+            op.ITE: lambda f, a: self.ite(a[0], a[1], a[2]),
+            op.BV_NOT: lambda f, a: "(%s ^ %d)"%(a[0], self._mask(f)),
+            op.BV_AND: lambda f, a: "(%s & %s)"%(a[0], a[1]),
+            op.BV_OR: lambda f, a: "(%s | %s)"%(a[0], a[1]),
+            op.BV_XOR: lambda f, a: "(%s ^ %s)"%(a[0], a[1]),
+            op.BV_NEG: lambda f, a: "((-%s) & %d)"%(a[0], self._mask(f)),
+            op.BV_ADD: lambda f, a: "((%s + %s) & %d)"%(a[0], a[1], self._mask(f)),
+            op.BV_SUB: lambda f, a: "((%s - %s) & %d)"%(a[0], a[1], self._mask(f)),
+            op.BV_MUL: lambda f, a: "((%s * %s) & %d)"%(a[0], a[1], self._mask(f)),
+            op.BV_UDIV: lambda f, a: "_udiv(%s, %s, %d)"%(a[0], a[1], self._mask(f)),
+            op.BV_UREM: lambda f, a: "_urem(%s, %s)"%(a[0], a[1]),
+            op.BV_SDIV: lambda f, a: "_sdiv(%s, %s, %d)"%(a[0], a[1], f.bv_width()),
+            op.BV_SREM: lambda f, a: "_srem(%s, %s, %d)"%(a[0], a[1], f.bv_width()),
+            op.BV_LSHL: lambda f, a: "_shl(%s, %s, %d)"%(a[0], a[1], f.bv_width()),
+            op.BV_LSHR: lambda f, a: "(%s >> %s)"%(a[0], a[1]),
+            op.BV_ASHR: lambda f, a: "_ashr(%s, %s, %d)"%(a[0], a[1], f.bv_width()),
+            op.BV_ROL: lambda f, a: "_rol(%s, %d, %d)"%(a[0], f.bv_rotation_step(), f.bv_width()),
+            op.BV_ROR: lambda f, a: "_rol(%s, %d, %d)"%(a[0], f.bv_width() - (f.bv_rotation_step() % f.bv_width()), f.bv_width()),
+            op.BV_ZEXT: lambda f, a: a[0],
+            op.BV_SEXT: lambda f, a: "_sext(%s, %d, %d)"%(a[0], f.arg(0).bv_width(), f.bv_extend_step()),
+            op.BV_CONCAT: lambda f, a: "((%s << %d) | %s)"%(a[0], f.arg(1).bv_width(), a[1]),
+            op.BV_EXTRACT: lambda f, a: "((%s >> %d) & %d)"%(a[0], f.bv_extract_start(), self._mask(f)),
+            op.BV_ULT: lambda f, a: "(%s < %s)"%(a[0], a[1]),
+            op.BV_ULE: lambda f, a: "(%s <= %s)"%(a[0], a[1]),
+            op.BV_SLT: lambda f, a: "(_signed(%s, %d) < _signed(%s, %d))"%(a[0], f.arg(0).bv_width(), a[1], f.arg(0).bv_width()),
+            op.BV_SLE: lambda f, a: "(_signed(%s, %d) <= _signed(%s, %d))"%(a[0], f.arg(0).bv_width(), a[1], f.arg(0).bv_width()),
+            op.BV_COMP: lambda f, a: self.ite("(%s == %s)"%(a[0], a[1]), "1", "0"),
+            op.ARRAY_SELECT: lambda f, a: "%s.select(%s)"%(a[0], a[1]),
+            op.ARRAY_STORE: lambda f, a: "%s.store(%s, %s)"%(a[0], a[1], a[2]),
+            op.ARRAY_VALUE: lambda f, a: "_array(%s, [%s])"%(a[0], ", ".join(["(%s, %s)"%(a[i], a[i+1]) for i in range(1, len(a), 2)])),
+        }
+
+    def _mask(self, formula):
+        return (1 << formula.bv_width()) - 1
+
+    def ite(self, cond, then_c, else_c):
+        return "(%s if %s else %s)"%(then_c, cond, else_c)
+
+    def check(self, check):
+        # the state is None as soon as a constraint is violated
+        return ["if not %s: return None"%check]
+
+    def result(self, values, checks):
+        return ["return [%s]"%(", ".join(values))]
+
+    def constant(self, formula):
+        if formula.is_bool_constant():
+            return "True" if formula.constant_value() else "False"
+        if formula.is_bv_constant():
+            return "%d"%formula.constant_value()
+
+        Logger.error("Unsupported constant \"%s\" in concrete simulation"%formula)
+
+    def compile(self, formula):
+        stack = [(formula, False)]
+        while stack:
+            (f, expanded) = stack.pop()
+            if f in self.memo:
+                continue
+
+            if f.is_symbol():
+                self.memo[f] = self.resolve(f)
+                continue
+
+            if f.is_constant():
+                self.memo[f] = self.constant(f)
+                continue
+
+            if not expanded:
+                stack.append((f, True))
+                stack += [(a, False) for a in f.args() if a not in self.memo]
+                continue
+
+            if f.node_type() not in self.templates:
+                Logger.error("Unsupported operator \"%s\" in concrete simulation"%(op.op_to_str(f.node_type())))
+
+            code = self.templates[f.node_type()](f, [self.memo[a] for a in f.args()])
+            name = "%s%d"%(self.prefix, self.count)
+            self.count += 1
+            self.lines.append("%s = %s"%(name, code))
+            self.memo[f] = name
+
+        return self.memo[formula]
+
+class BitSlicedCompiler(FormulaCompiler):
+    """Compiles pysmt formulae into Python code evaluating a batch of lanes at once.
+
+    Booleans are integers with one bit per lane, and bit-vectors are tuples
+    of such integers (bit planes, least significant first), hence Boolean
+    and bitwise operators evaluate all the lanes with one operation per bit.
+    Arithmetic operators are evaluated lane by lane. Arrays are not supported.
+    """
+
+    namespace = dict(FormulaCompiler.namespace)
+    namespace.update({"_eq": _eq, "_ite": _ite, "_perlane": _perlane})
+
+    def __init__(self, resolve, lines, prefix="t"):
+        FormulaCompiler.__init__(self, resolve, lines, prefix)
+
+        # operators evaluated lane by lane, with the code of FormulaCompiler
+        self.scalar = self.templates
+        self.templates = dict([(o, self.per_lane) for o in self.scalar if o not in ARRAY_OPERATORS])
+
+        planes = lambda f, a, code: "tuple([%s for (x, y) in zip(%s, %s)])"%(code, a[0], a[1])
+        self.templates.update({
+            op.AND: lambda f, a: "(%s)"%(" & ".join(a)),
+            op.OR: lambda f, a: "(%s)"%(" | ".join(a)),
+            op.NOT: lambda f, a: "(_ones ^ %s)"%a[0],
+            op.IMPLIES: lambda f, a: "((_ones ^ %s) | %s)"%(a[0], a[1]),
+            op.IFF: lambda f, a: "_eq(%s, %s, _ones)"%(a[0], a[1]),
+            op.EQUALS: lambda f, a: "_eq(%s, %s, _ones)"%(a[0], a[1]),
+            op.ITE: lambda f, a: self.ite(a[0], a[1], a[2]),
+            op.BV_NOT: lambda f, a: "tuple([_ones ^ x for x in %s])"%a[0],
+            op.BV_AND: lambda f, a: planes(f, a, "x & y"),
+            op.BV_OR: lambda f, a: planes(f, a, "x | y"),
+            op.BV_XOR: lambda f, a: planes(f, a, "x ^ y"),
+            op.BV_ZEXT: lambda f, a: "(%s + (0,)*%d)"%(a[0], f.bv_extend_step()),
+            op.BV_SEXT: lambda f, a: "(%s + (%s[-1],)*%d)"%(a[0], a[0], f.bv_extend_step()),
+            op.BV_CONCAT: lambda f, a: "(%s + %s)"%(a[1], a[0]),
+            op.BV_EXTRACT: lambda f, a: "%s[%d:%d]"%(a[0], f.bv_extract_start(), f.bv_extract_end()+1),
+            op.BV_COMP: lambda f, a: "(_eq(%s, %s, _ones),)"%(a[0], a[1]),
+            op.BV_ROL: lambda f, a: self.rotate(a[0], f.bv_rotation_step(), f.bv_width()),
+            op.BV_ROR: lambda f, a: self.rotate(a[0], -f.bv_rotation_step(), f.bv_width()),
+        })
+
+    def per_lane(self, formula, args):
+        names = ["x%d"%i for i in range(len(args))]
+        code = self.scalar[formula.node_type()](formula, names)
+        width = formula.bv_width() if formula.get_type().is_bv_type() else None
+        return "_perlane(lambda %s: %s, %s, _lanes, %s)"%(", ".join(names), code, width, ", ".join(args))
+
+    def rotate(self, value, step, width):
+        step = step % width
+        return "(%s[%d:] + %s[:%d])"%(value, width-step, value, width-step)
+
+    def ite(self, cond, then_c, else_c):
+        return "_ite(%s, %s, %s, _ones)"%(cond, then_c, else_c)
+
+    def constant(self, formula):
+        if formula.is_bool_constant():
+            return "_ones" if formula.constant_value() else "0"
+        if formula.is_bv_constant():
+            value = formula.constant_value()
+            return "(%s,)"%(", ".join(["_ones" if (value >> b) & 1 else "0" for b in range(formula.bv_width())]))
+
+        Logger.error("Unsupported constant \"%s\" in bit-sliced simulation"%formula)
+
+    def check(self, check):
+        # the lanes violating the constraints are removed from the returned mask
+        return []
+
+    def result(self, values, checks):
+        return ["return ([%s], %s)"%(", ".join(values), " & ".join(["_ones"] + checks))]
+
+class Definition(object):
+    """Value of a variable as a chain of (guard, expression, context),
+    falling back to a random (or given) value when no guard holds."""
+
+    var = None
+    cases = None
+    exact = False
+    keep = False
+
+    def __init__(self, var, exact=False, keep=False):
+        self.var = var
+        self.cases = []
+        self.exact = exact
+        self.keep = keep
+
+class ConcreteSimulator(object):
+    """Simulates an HTS by evaluating its formulae on concrete values.
+
+    Equalities (and ftrans assignments) of the model are oriented into
+    definitions which are evaluated in topological order, the remaining
+    variables are sampled, and all the constraints that are not
+    definitions are checked on the resulting state. A state violating
+    some constraint is sampled again up to a number of retries.
+    """
+
+    hts = None
+    vars = None
+    retries = 100
+
+    compiler_class = FormulaCompiler
+
+    def __init__(self, hts, seed=0):
+        self.hts = hts
+        self.vars = sorted(hts.vars, key=lambda v: v.symbol_name())
+        self.index = dict([(v, i) for (i, v) in enumerate(self.vars)])
+        self.random = random.Random(seed)
+        self._init_f = None
+        self._step_f = None
+
+    def _sample_value(self, vtype):
+        if vtype.is_bool_type():
+            return self.random.getrandbits(1) == 1
+        if vtype.is_bv_type():
+            return self.random.getrandbits(vtype.width)
+        if vtype.is_array_type():
+            return ArrayValue(self._sample_value(vtype.elem_type))
+
+        Logger.error("Unsupported type \"%s\" in concrete simulation"%vtype)
+
+    def _is_target(self, var, layer, context):
+        if not var.is_symbol():
+            return False
+        if (layer == TRANS) and (context == TRANS):
+            return TS.is_prime(var) and (TS.get_ref_var(var) in self.index)
+        return (not TS.is_prime(var)) and (not TS.is_prev(var)) and (var in self.index)
+
+    def _target(self, var):
+        return TS.get_ref_var(var) if TS.is_prime(var) else var
+
+    def _orient(self, formula, layer, context, defined, avoid=()):
+        if formula.is_symbol() and self._is_target(formula, layer, context):
+            return (formula, TRUE())
+        if formula.is_not() and formula.arg(0).is_symbol() and self._is_target(formula.arg(0), layer, context):
+            return (formula.arg(0), FALSE())
+        if formula.is_equals() or formula.is_iff():
+            (l, r) = (formula.arg(0), formula.arg(1))
+            for skip in [avoid, ()]:
+                for (v, e) in [(l, r), (r, l)]:
+                    if self._is_target(v, layer, context) and (self._target(v) not in defined) and (self._target(v) not in skip):
+                        return (v, e)
+            # (cond <-> (v = c)) with v of size 1 defines v
+            if formula.is_iff():
+                for (c, e) in [(l, r), (r, l)]:
+                    if e.is_equals() and e.arg(0).get_type().is_bv_type() and (e.arg(0).bv_width() == 1):
+                        (v, val) = (e.arg(0), e.arg(1)) if e.arg(1).is_bv_constant() else (e.arg(1), e.arg(0))
+                        if val.is_bv_constant() and self._is_target(v, layer, context) and (self._target(v) not in defined):
+                            return (v, Ite(c, val, BV(1-val.constant_value(), 1)))
+        return None
+
+    def _deps(self, cases, layer):
+        deps = set([])
+        for (guard, expr, context) in cases:
+            for v in get_free_variables(guard) | get_free_variables(expr):
+                if (layer == TRANS) and (context == TRANS):
+                    if TS.is_prime(v):
+                        deps.add(TS.get_ref_var(v))
+                elif not TS.is_prime(v) and not TS.is_prev(v):
+                    deps.add(v)
+        return set([v for v in deps if v in self.index])
+
+    def _extract(self, layer, conjuncts, ftrans):
+        # conjuncts is a list of (formula, context); returns the
+        # definitions and the constraints of the layer
+        definitions = {}
+        constraints = []
+        guarded = []
+
+        is_alias = lambda f, c: (f.is_equals() or f.is_iff()) and \
+                   self._is_target(f.arg(0), layer, c) and self._is_target(f.arg(1), layer, c)
+
+        aliases = [(f, c) for (f, c) in conjuncts if is_alias(f, c)]
+        conjuncts = [(f, c) for (f, c) in conjuncts if not is_alias(f, c)]
+
+        for (var, cond_assign_list) in ftrans.items():
+            context = TRANS if TS.is_prime(var) else INVAR
+            if (cond_assign_list[0][0] == TRUE()) and is_alias(EqualsOrIff(var, cond_assign_list[0][1]), context):
+                aliases.append((EqualsOrIff(var, cond_assign_list[0][1]), context))
+                continue
+            if (layer == TRANS) and (context == TRANS):
+                definition = Definition(TS.get_ref_var(var), keep=True)
+            elif context == INVAR:
+                definition = Definition(var)
+            else:
+                continue
+            for (condition, value) in cond_assign_list:
+                definition.cases.append((condition, value, context))
+                if condition == TRUE():
+                    break
+            definition.exact = True
+            if definition.var not in definitions:
+                definitions[definition.var] = definition
+
+        for (formula, context) in conjuncts:
+            if formula.is_implies():
+                for conseq in conjunctive_partition(formula.arg(1)):
+                    oriented = self._orient(conseq, layer, context, {})
+                    if oriented is not None:
+                        guarded.append((self._target(oriented[0]), formula.arg(0), oriented[1], context))
+
+        for (formula, context) in conjuncts:
+            oriented = self._orient(formula, layer, context, definitions)
+            if oriented is not None:
+                var = self._target(oriented[0])
+                if var not in definitions:
+                    definition = Definition(var, exact=True)
+                    definition.cases.append((TRUE(), oriented[1], context))
+                    definitions[var] = definition
+                    continue
+
+            constraints.append((formula, context))
+
+        constraints += self._extract_aliases(aliases, definitions, set([g[0] for g in guarded]))
+
+        for (var, guard, expr, context) in guarded:
+            if var not in definitions:
+                definitions[var] = Definition(var)
+            if not definitions[var].exact:
+                definitions[var].cases.append((guard, expr, context))
+
+        late = {}
+        if layer == TRANS:
+            # variables defined by the transition, e.g., wires depending on
+            # the next state, are assigned to the current state during the step
+            remaining = []
+            for (formula, context) in constraints:
+                if (context == TRANS) and (formula.is_equals() or formula.is_iff()):
+                    for (v, e) in [(formula.arg(0), formula.arg(1)), (formula.arg(1), formula.arg(0))]:
+                        if v.is_symbol() and (v in self.index) and (v not in definitions) and (v not in late):
+                            late[v] = e
+                            break
+                    if (formula.arg(0) in late) or (formula.arg(1) in late):
+                        continue
+                remaining.append((formula, context))
+            constraints = remaining
+
+        return (definitions, constraints, late)
+
+    def _extract_aliases(self, aliases, definitions, guarded):
+        # equalities between variables are grouped in classes, and each
+        # variable is defined as the representative of its class, i.e.,
+        # a variable with a definition if any
+        parent = {}
+
+        def find(v):
+            while parent[v] != v:
+                v = parent[v]
+            return v
+
+        for (formula, context) in aliases:
+            (l, r) = (self._target(formula.arg(0)), self._target(formula.arg(1)))
+            parent.setdefault(l, l)
+            parent.setdefault(r, r)
+            (l, r) = (find(l), find(r))
+            if l != r:
+                parent[max(l, r, key=lambda v: self.index[v])] = min(l, r, key=lambda v: self.index[v])
+
+        classes = {}
+        for v in parent:
+            classes.setdefault(find(v), []).append(v)
+
+        constraints = []
+        for members in classes.values():
+            members.sort(key=lambda v: ((v not in definitions), (v not in guarded), self.index[v]))
+            root = members[0]
+            for v in members[1:]:
+                if v in definitions:
+                    constraints.append((EqualsOrIff(v, root), INVAR))
+                else:
+                    definition = Definition(v, exact=True)
+                    definition.cases.append((TRUE(), root, INVAR))
+                    definitions[v] = definition
+
+        return constraints
+
+    def _order(self, definitions, layer):
+        # Topological sort of the definitions. Cycles are broken by
+        # removing the guarded cases depending on the cycle, or the
+        # whole definition of a variable in the cycle
+        deps = dict([(v, self._deps(d.cases, layer)) for (v, d) in definitions.items()])
+        users = dict([(v, []) for v in self.vars])
+        pending = {}
+        for (v, vdeps) in deps.items():
+            pending[v] = set(vdeps)
+            for d in vdeps:
+                users[d].append(v)
+
+        demoted = []
+        order = []
+        done = set([])
+        queue = [v for v in reversed(self.vars) if not pending.get(v, None)]
+
+        while len(done) < len(self.vars):
+            if not queue:
+                v = [v for v in self.vars if v not in done][0]
+                path = []
+                while v not in path:
+                    path.append(v)
+                    v = sorted(pending[v], key=lambda u: self.index[u])[0]
+                cycle = path[path.index(v):]
+                acyclic = lambda u: [c for c in definitions[u].cases if not (self._deps([c], layer) & set(cycle))]
+                guarded = [u for u in cycle if not definitions[u].exact]
+                # preferring variables that keep some of their cases
+                guarded.sort(key=lambda u: len(acyclic(u)) == 0)
+                v = guarded[0] if guarded else v
+                definition = definitions[v]
+                if not definition.exact:
+                    definition.cases = acyclic(v)
+                if definition.exact or (len(definition.cases) == 0):
+                    Logger.log("Cyclic definition of \"%s\" in concrete simulation"%v, 2)
+                    demoted.append(definition)
+                    del(deps[v])
+                    pending[v] = set([])
+                else:
+                    deps[v] = self._deps(definition.cases, layer)
+                    pending[v] = deps[v] - done
+                if not pending[v]:
+                    queue.append(v)
+                continue
+
+            v = queue.pop()
+            done.add(v)
+            order.append(v)
+            for u in users[v]:
+                if v in pending[u]:
+                    pending[u].remove(v)
+                    if not pending[u]:
+                        queue.append(u)
+
+        return ([v for v in order if (v in deps)], [v for v in order if (v not in deps)], demoted)
+
+    def _compile_layer(self, name, layer, conjuncts, ftrans):
+        (definitions, constraints, late) = self._extract(layer, conjuncts, ftrans)
+        (ordered, sampled, demoted) = self._order(definitions, layer)
+
+        for definition in demoted:
+            if definition.exact:
+                for (guard, expr, context) in definition.cases:
+                    if layer == TRANS and context == TRANS:
+                        var = TS.get_prime(definition.var)
+                    else:
+                        var = definition.var
+                    equality = EqualsOrIff(var, expr)
+                    constraints.append((equality if guard == TRUE() else Implies(guard, equality), context))
+
+        lines = []
+        loaded = set([])
+
+        def load(v):
+            if v not in loaded:
+                lines.insert(0, "c%d = c[%d]"%(self.index[v], self.index[v]))
+                loaded.add(v)
+            return "c%d"%self.index[v]
+
+        def resolve_invar(v):
+            if TS.is_prev(v) and (layer == TRANS):
+                return load(TS.get_ref_var(v))
+            if v not in self.index:
+                Logger.error("Unexpected variable \"%s\" in concrete simulation"%v)
+            return "n%d"%self.index[v]
+
+        def resolve_trans(v):
+            if TS.is_prime(v):
+                return "n%d"%self.index[TS.get_ref_var(v)]
+            return load(v)
+
+        compilers = {INVAR: self.compiler_class(resolve_invar, lines, "a")}
+        compilers[TRANS] = self.compiler_class(resolve_trans, lines, "b") if layer == TRANS else compilers[INVAR]
+        compilers[INIT] = compilers[INVAR]
+
+        body = []
+        for v in sampled:
+            body.append("n%d = _sample(%d)"%(self.index[v], self.index[v]))
+        for v in ordered:
+            definition = definitions[v]
+            i = self.index[v]
+            if definition.keep:
+                fallback = load(v)
+            elif not definition.exact or (definition.cases[-1][0] != TRUE()):
+                fallback = "_sample(%d)"%i
+            else:
+                fallback = None
+
+            lines.append("# %s"%(v.symbol_name().replace("\n", " ")))
+            code = fallback
+            values = []
+            for (guard, expr, context) in definition.cases:
+                compiler = compilers[context]
+                values.append((compiler.compile(guard) if guard != TRUE() else None, compiler.compile(expr)))
+
+            for (guard, value) in reversed(values):
+                if guard is None:
+                    code = value
+                else:
+                    code = compilers[INVAR].ite(guard, value, code)
+
+            lines.append("n%d = %s"%(i, code))
+
+        for (v, expr) in late.items():
+            i = self.index[v]
+            lines.append("# %s"%(v.symbol_name().replace("\n", " ")))
+            lines.append("c[%d] = %s = %s"%(i, load(v), compilers[TRANS].compile(expr)))
+
+        checks = []
+        for (formula, context) in constraints:
+            checks.append(compilers[context].compile(formula))
+            lines += compilers[context].check(checks[-1])
+
+        lines += compilers[INVAR].result(["n%d"%i for i in range(len(self.vars))], checks)
+
+        args = "c, _sample" if layer == TRANS else "_sample"
+        code = "def %s(%s):\n    %s\n"%(name, args, "\n    ".join(body + lines))
+
+        Logger.log("Concrete simulation: %s layer with %d definitions, %d sampled variables and %d constraints"% \
+                   (layer, len(ordered), len(sampled), len(constraints)), 1)
+
+        return self._build(name, code)
+
+    def _namespace(self):
+        return dict(self.compiler_class.namespace)
+
+    def _build(self, name, code):
+        namespace = self._namespace()
+        exec(compile(code, "<cosa-%s>"%name, "exec"), namespace)
+        return namespace[name]
+
+    def _conjuncts(self, formula, context):
+        conjuncts = []
+        for c in conjunctive_partition(formula):
+            if c == TRUE():
+                continue
+            if c.is_implies():
+                conjuncts += [(Implies(c.arg(0), cc), context) for cc in conjunctive_partition(c.arg(1))]
+            else:
+                conjuncts.append((c, context))
+        return conjuncts
+
+    def compile(self):
+        Logger.log("Compiling model for concrete simulation", 1)
+
+        hts = self.hts
+        hts.reset_formulae()
+        init = hts.single_init()
+        invar = hts.single_invar(include_ftrans=False)
+        trans = hts.single_trans(include_ftrans=False)
+        ftrans = hts.single_ftrans()
+
+        invar_c = []
+        trans_c = []
+        # constraints are partitioned depending on the presence of next
+        # variables, e.g., transition constraints without next variables
+        # are state constraints
+        for (c, _) in self._conjuncts(invar, INVAR) + self._conjuncts(trans, TRANS):
+            if TS.has_next(c):
+                trans_c.append((c, TRANS))
+            else:
+                invar_c.append((c, INVAR))
+
+        for (var, cond_assign_list) in list(ftrans.items()):
+            if (not TS.is_prime(var)) and any([TS.has_next(c) or TS.has_next(a) for (c, a) in cond_assign_list]):
+                for (condition, value) in cond_assign_list:
+                    trans_c.append((Implies(condition, EqualsOrIff(var, value)), TRANS))
+                ftrans = dict(ftrans)
+                del(ftrans[var])
+
+        init_c = [(c, INVAR) for (c, _) in self._conjuncts(init, INIT)]
+
+        self._init_f = self._compile_layer("_init", INIT, init_c + invar_c, ftrans)
+        self._step_f = self._compile_layer("_step", TRANS, trans_c + invar_c, ftrans)
+
+    def compile_check(self, formula):
+        """Returns a function evaluating the formula on the current (and next) state"""
+
+        lines = []
+        loaded = set([])
+
+        def resolve(v):
+            if TS.is_prime(v):
+                i = self.index[TS.get_ref_var(v)]
+                if v not in loaded:
+                    lines.insert(0, "n%d = n[%d]"%(i, i))
+                    loaded.add(v)
+                return "n%d"%i
+            if v not in self.index:
+                Logger.error("Unexpected variable \"%s\" in concrete simulation"%v)
+            i = self.index[v]
+            if v not in loaded:
+                lines.insert(0, "c%d = c[%d]"%(i, i))
+                loaded.add(v)
+            return "c%d"%i
+
+        result = self.compiler_class(resolve, lines).compile(formula)
+        lines.append("return %s"%result)
+
+        return self._build("_check", "def _check(c, n=None):\n    %s\n"%("\n    ".join(lines)))
+
+    def is_supported(self, formulae=None):
+        """Checks if all the operators and types can be evaluated concretely"""
+
+        operators = set(self.compiler_class(None, []).templates.keys())
+
+        if formulae is None:
+            hts = self.hts
+            formulae = [hts.single_init(), hts.single_invar(include_ftrans=False), hts.single_trans(include_ftrans=False)]
+            for (var, cond_assign_list) in hts.single_ftrans().items():
+                formulae += [And(c, EqualsOrIff(var, a)) for (c, a) in cond_assign_list]
+
+        for v in self.vars:
+            vtype = v.symbol_type()
+            if not (vtype.is_bool_type() or vtype.is_bv_type() or vtype.is_array_type()):
+                return False
+
+        visited = set([])
+        stack = list(formulae)
+        while stack:
+            f = stack.pop()
+            if f in visited:
+                continue
+            visited.add(f)
+            if f.is_symbol() or f.is_bool_constant() or f.is_bv_constant():
+                continue
+            if f.node_type() not in operators:
+                return False
+            stack += f.args()
+
+        return True
+
+    def _coverage(self, depth, visited, deadlocks, steps, start):
+        # the throughput is the number of lane steps per second
+        elapsed = time.time() - start
+        return (depth, len(visited), deadlocks, (steps / elapsed) if elapsed > 0 else float(steps))
+
+    def run_batch(self, k, bad, lanes):
+        """Simulates a number of random lanes in lockstep up to k steps,
+        stopping on the first lane reaching a state satisfying bad.
+        Returns (t, states, coverage) with t = -1 if bad is not reached,
+        where coverage is (depth, distinct states, deadlocked lanes, throughput)"""
+
+        # the lanes are bit-sliced if the model has no arrays
+        sliced = BitSlicedSimulator(self.hts, lanes, self.random.getrandbits(32))
+        if sliced.is_supported() and sliced.is_supported([bad]):
+            Logger.log("Bit-sliced simulation of %s lanes"%(lanes), 1)
+            return sliced.run_batch(k, bad, lanes)
+
+        check = self.compile_check(bad)
+        has_next = TS.has_next(bad)
+        start = time.time()
+
+        traces = []
+        for lane in range(lanes):
+            state = self.init_state()
+            if state is not None:
+                traces.append([state])
+
+        deadlocks = lanes - len(traces)
+        visited = set([tuple(trace[0]) for trace in traces])
+        steps = len(traces)
+
+        depth = 0
+        for t in range(k+1):
+            if not traces:
+                break
+            depth = t
+
+            if not has_next:
+                for trace in traces:
+                    if check(trace[-1]):
+                        return (t, trace, self._coverage(depth, visited, deadlocks, steps, start))
+
+            if t == k:
+                break
+
+            alive = []
+            for trace in traces:
+                nstate = self.next_state(trace[-1], None, t+1)
+                if nstate is None:
+                    deadlocks += 1
+                    continue
+                steps += 1
+                if has_next and check(trace[-1], nstate):
+                    trace.append(nstate)
+                    return (t+1, trace, self._coverage(t+1, visited, deadlocks, steps, start))
+                trace.append(nstate)
+                visited.add(tuple(nstate))
+                alive.append(trace)
+            traces = alive
+
+        return (-1, [], self._coverage(depth, visited, deadlocks, steps, start))
+
+    def _sampler(self, inputs):
+        types = [v.symbol_type() for v in self.vars]
+
+        def sample(i):
+            if (inputs is not None) and (i in inputs):
+                return inputs[i]
+            return self._sample_value(types[i])
+
+        return sample
+
+    def _step_inputs(self, inputs, t):
+        if (inputs is None) or (t >= len(inputs)):
+            return None
+        return inputs[t]
+
+    def init_state(self, inputs=None):
+        if self._init_f is None:
+            self.compile()
+
+        sample = self._sampler(self._step_inputs(inputs, 0))
+        for i in range(self.retries):
+            state = self._init_f(sample)
+            if state is not None:
+                return state
+        return None
+
+    def next_state(self, state, inputs=None, t=1):
+        if self._step_f is None:
+            self.compile()
+
+        sample = self._sampler(self._step_inputs(inputs, t))
+        for i in range(self.retries):
+            nstate = self._step_f(state, sample)
+            if nstate is not None:
+                return nstate
+        return None
+
+    def run(self, k, cover=None, inputs=None):
+        """Simulates up to k steps, stopping when cover holds.
+        Returns (t, states) with t = -1 if no valid state can be found"""
+
+        check = None
+        has_next = False
+        if (cover is not None) and (cover != TRUE()):
+            check = self.compile_check(cover)
+            has_next = TS.has_next(cover)
+
+        states = []
+        state = self.init_state(inputs)
+        if state is None:
+            Logger.log("No initial state found in concrete simulation", 1)
+            return (-1, states)
+        states.append(state)
+
+        for t in range(1, k+1):
+            if (check is not None) and (not has_next) and check(state):
+                return (t-1, states)
+
+            nstate = self.next_state(state, inputs, t)
+            if nstate is None:
+                Logger.log("System deadlocked at k=%s"%(t), 2)
+                return (-1, states)
+
+            if (check is not None) and has_next and check(state, nstate):
+                states.append(nstate)
+                return (t, states)
+
+            states.append(nstate)
+            state = nstate
+            Logger.msg(".", 0, not(Logger.level(1)))
+
+        return (k, states)
+
+    def to_fnode(self, value, vtype):
+        if vtype.is_bool_type():
+            return TRUE() if value else FALSE()
+        if vtype.is_bv_type():
+            return BV(value, vtype.width)
+        if vtype.is_array_type():
+            assigned = dict([(self.to_fnode(i, vtype.index_type), self.to_fnode(v, vtype.elem_type)) for (i, v) in value.values.items()])
+            return Array(vtype.index_type, self.to_fnode(value.default, vtype.elem_type), assigned)
+
+        Logger.error("Unsupported type \"%s\" in concrete simulation"%vtype)
+
+    def to_model(self, states, relevant_vars=None):
+        model = {}
+        for (i, v) in enumerate(self.vars):
+            if (relevant_vars is not None) and (v not in relevant_vars):
+                continue
+            vtype = v.symbol_type()
+            for (t, state) in enumerate(states):
+                model[TS.get_timed(v, t)] = self.to_fnode(state[i], vtype)
+        return model
+
+    def load_inputs(self, filename):
+        """Loads the inputs file, one line per step of comma separated assignments 'var = value'"""
+
+        names = dict([(v.symbol_name(), v) for v in self.vars])
+        inputs = []
+        with open(filename, "r") as f:
+            for line in f.read().split("\n"):
+                line = line.split("#")[0].strip()
+                if not line:
+                    continue
+                step = {}
+                for assign in line.replace(";", ",").split(","):
+                    if not assign.strip():
+                        continue
+                    (name, value) = [x.strip() for x in assign.split("=")]
+                    if name not in names:
+                        Logger.error("Undefined variable \"%s\" in inputs file \"%s\""%(name, filename))
+                    step[self.index[names[name]]] = self.parse_value(value, names[name].symbol_type())
+                inputs.append(step)
+        return inputs
+
+    def parse_value(self, value, vtype):
+        if vtype.is_bool_type():
+            if value.lower() in ["true", "1", "1_1"]:
+                return True
+            if value.lower() in ["false", "0", "0_1"]:
+                return False
+        elif vtype.is_bv_type():
+            return int(value.split("_")[0], 0) & ((1 << vtype.width) - 1)
+
+        Logger.error("Unsupported value \"%s\" of type \"%s\""%(value, vtype))
+
+class BitSlicedSimulator(ConcreteSimulator):
+    """Simulates a batch of random lanes at once (see BitSlicedCompiler).
+
+    A state is a list of bit-sliced values, and each layer returns the
+    state with the mask of the lanes satisfying the constraints. The lanes
+    violating them are sampled again, while the other ones are kept.
+    """
+
+    compiler_class = BitSlicedCompiler
+    lanes = 0
+    ones = 0
+
+    def __init__(self, hts, lanes, seed=0):
+        ConcreteSimulator.__init__(self, hts, seed)
+        self.lanes = lanes
+        self.ones = (1 << lanes) - 1
+
+    def _namespace(self):
+        namespace = ConcreteSimulator._namespace(self)
+        namespace["_ones"] = self.ones
+        namespace["_lanes"] = self.lanes
+        return namespace
+
+    def _sample_value(self, vtype):
+        if vtype.is_bool_type():
+            return self.random.getrandbits(self.lanes)
+        if vtype.is_bv_type():
+            return tuple([self.random.getrandbits(self.lanes) for b in range(vtype.width)])
+
+        Logger.error("Unsupported type \"%s\" in bit-sliced simulation"%vtype)
+
+    def is_supported(self, formulae=None):
+        if any([v.symbol_type().is_array_type() for v in self.vars]):
+            return False
+        return ConcreteSimulator.is_supported(self, formulae)
+
+    def _merge(self, lanes, value, other):
+        # value on the given lanes, and other on the remaining ones
+        keep = self.ones ^ lanes
+        if isinstance(value, tuple):
+            return tuple([(x & lanes) | (y & keep) for (x, y) in zip(value, other)])
+        return (value & lanes) | (other & keep)
+
+    def _sample_lanes(self, layer, target):
+        sample = self._sampler(None)
+        (state, valid) = layer(sample)
+        valid &= target
+        for i in range(self.retries):
+            missing = target ^ valid
+            if not missing:
+                break
+            (nstate, nvalid) = layer(sample)
+            found = missing & nvalid
+            if found:
+                state = [self._merge(found, n, o) for (n, o) in zip(nstate, state)]
+                valid |= found
+        return (state, valid)
+
+    def _init_lanes(self, target):
+        return self._sample_lanes(self._init_f, target)
+
+    def _step_lanes(self, state, target):
+        # the step also assigns the current state (e.g., the wires
+        # depending on the next state), which is sampled with it
+        size = len(self.vars)
+
+        def step(sample):
+            current = list(state)
+            (nstate, valid) = self._step_f(current, sample)
+            return (current + nstate, valid)
+
+        (states, valid) = self._sample_lanes(step, target)
+        state[:] = states[:size]
+        return (states[size:], valid)
+
+    def _lane_states(self, state, lanes):
+        columns = [_unslice(value, self.lanes) for value in state]
+        return [row for (j, row) in enumerate(zip(*columns)) if (lanes >> j) & 1]
+
+    def _lane_trace(self, states, lanes):
+        lane = (lanes & -lanes).bit_length()-1
+        return [list(self._lane_states(state, 1 << lane)[0]) for state in states]
+
+    def run_batch(self, k, bad, lanes):
+        if self._init_f is None:
+            self.compile()
+
+        check = self.compile_check(bad)
+        has_next = TS.has_next(bad)
+        count = lambda mask: bin(mask).count("1")
+        start = time.time()
+
+        (state, alive) = self._init_lanes(self.ones)
+        states = [state]
+        deadlocks = lanes - count(alive)
+        visited = set(self._lane_states(state, alive))
+        steps = count(alive)
+
+        depth = 0
+        for t in range(k+1):
+            if not alive:
+                break
+            depth = t
+
+            if not has_next:
+                hit = check(state) & alive
+                if hit:
+                    return (t, self._lane_trace(states, hit), self._coverage(depth, visited, deadlocks, steps, start))
+
+            if t == k:
+                break
+
+            (nstate, valid) = self._step_lanes(state, alive)
+            deadlocks += count(alive ^ valid)
+            alive = valid
+            steps += count(alive)
+            states.append(nstate)
+
+            if has_next:
+                hit = check(state, nstate) & alive
+                if hit:
+                    return (t+1, self._lane_trace(states, hit), self._coverage(t+1, visited, deadlocks, steps, start))
+
+            visited.update(self._lane_states(nstate, alive))
+            state = nstate
+
+        return (-1, [], self._coverage(depth, visited, deadlocks, steps, start))
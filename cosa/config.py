@@ -13,7 +13,7 @@ from collections import defaultdict, namedtuple
 import configparser
 import itertools
 from pathlib import Path
-from typing import Callable, Dict, Sequence, NamedTuple
+from typing import Any, Callable, Dict, Sequence, NamedTuple
 
 from cosa.analyzers.mcsolver import VerificationStrategy
 from cosa.problem import ProblemsManager, VerificationType
@@ -45,13 +45,13 @@ class CosaArgGroup(argparse._ArgumentGroup):
         if option_name not in self._defaults:
             self._defaults[option_name] = default
         if option_name not in self._types:
-            if action == 'store_true':
+            if action in ('store_true', 'store_false'):
                 self._types[option_name] = bool
             else:
                 self._types[option_name] = type
         # always set argparse's default to None so that we can identify
         #  unset arguments
-        super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
+        return super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
 
     def add_mutually_exclusive_group(self, **kwargs):
         group = CosaMutuallyExclusiveGroup(self, self._category, **kwargs)
@@ -84,11 +84,11 @@ class CosaMutuallyExclusiveGroup(argparse._MutuallyExclusiveGroup):
         if option_name not in self._defaults:
             self._defaults[option_name] = default
         if option_name not in self._types:
-            if action == 'store_true':
+            if action in ('store_true', 'store_false'):
                 self._types[option_name] = bool
             else:
                 self._types[option_name] = type
-        super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
+        return super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
 
 
 class CosaArgParser(argparse.ArgumentParser):
@@ -107,6 +107,8 @@ class CosaArgParser(argparse.ArgumentParser):
         self._types = dict()
         self._problem_options = defaultdict(set)
         self._problem_type = None
+        # functions updating the help messages, called only when the help is printed
+        self._help_callbacks = []
         argparse.ArgumentParser.__init__(self, *args, **kwargs)
 
     def add_argument(self, *args, default=None, action=None,
@@ -122,13 +124,13 @@ class CosaArgParser(argparse.ArgumentParser):
         if option_name not in self._defaults:
             self._defaults[option_name] = default
         if option_name not in self._types:
-            if action == 'store_true':
+            if action in ('store_true', 'store_false'):
                 self._types[option_name] = bool
             else:
                 self._types[option_name] = type
         # always set argparse's default to None so that we can identify
         #   unset arguments
-        super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
+        return super().add_argument(*args, default=None, dest=dest, action=action, **kwargs)
 
     def add_argument_group(self, group_str:str, *args, **kwargs)->CosaArgGroup:
         # no specific category results in BUILTIN
@@ -172,7 +174,13 @@ class CosaArgParser(argparse.ArgumentParser):
         for k, v in kwargs.items():
             self._defaults[k] = v
 
+    def add_help_callback(self, callback:Callable)->None:
+        self._help_callbacks.append(callback)
+
     def format_help(self):
+        for callback in self._help_callbacks:
+            callback()
+
         formatter = self._get_formatter()
 
         # usage
@@ -311,6 +319,9 @@ class CosaArgParser(argparse.ArgumentParser):
             # calling with frozen=False keeps the problem mutable for now (might not to override options)
             problems_manager.add_problem(**single_problem_options, frozen=False)
 
+        return self.prepare_problems(problems_manager)
+
+    def prepare_problems(self, problems_manager:ProblemsManager)->ProblemsManager:
         # run any manual option handling
         # modifies the problems_manager in-place
         self._option_handling(problems_manager)
@@ -331,7 +342,7 @@ class CosaArgParser(argparse.ArgumentParser):
         return parser
 
     def read_problem_file(self, config_file:str,
-                          _command_line_args:Dict[str, str]=dict(),
+                          _command_line_args:Dict[str, str]=None,
                           **kwargs)->ProblemsManager:
         '''
         Reads a problem file and then overrides defaults with command line options
@@ -340,6 +351,9 @@ class CosaArgParser(argparse.ArgumentParser):
         Users should not pass _command_line_args directly, that is for internal use only.
         Instead, pass options through keyword arguments.
         '''
+        if _command_line_args is None:
+            _command_line_args = dict()
+
         config_filepath = Path(config_file)
         config_args = self.parse_config(config_filepath)
         general_options = dict(config_args[GENERAL])
@@ -495,6 +509,67 @@ class CosaArgParser(argparse.ArgumentParser):
                     raise e
         return problems_manager
 
+    def _convert_options(self, options:Dict[str, Any])->Dict[str, Any]:
+        for k, v in options.items():
+            if v is not None:
+                assert k in self._types, "Expecting to have (at least default) type info for every option"
+                try:
+                    # handle the 'False' case, note that bool('False') evaluates to True
+                    if self._types[k] == bool and isinstance(v, str):
+                        if v == 'True':
+                            options[k] = True
+                        elif v == 'False':
+                            options[k] = False
+                        else:
+                            raise RuntimeError("Expecting True or False as an option for {} but got {}".format(k, v))
+                    else:
+                        options[k] = self._types[k](v)
+                except ValueError:
+                    raise ValueError("Cannot convert '{}' to expected type {}".format(v, self._types[k]))
+        return options
+
+    def read_problem_spec(self, spec:Dict[str, Any], relative_path:Path=Path("./"))->ProblemsManager:
+        '''
+        Reads a problem specification (e.g. loaded from JSON), i.e. a dictionary with
+        the general options in "general", the problem defaults in "default" and the
+        list of problems in "problems". Relative files are resolved from relative_path.
+
+        Returns a problems manager ready to be solved.
+        '''
+
+        general_options = dict(spec.get("general", dict()))
+        unknown_gen_options = general_options.keys() - self._problem_options[GENERAL]
+        if unknown_gen_options:
+            raise RuntimeError("Expecting only general options in section"
+                               " general but got {}".format(unknown_gen_options))
+
+        for option in self._problem_options[GENERAL]:
+            if general_options.get(option) is None:
+                general_options[option] = self._defaults[option]
+
+        problem_defaults = {o:self._defaults[o] for o in self._problem_options[PROBLEM]}
+        default_options = dict(spec.get("default", dict()))
+        unknown_default_options = default_options.keys() - self._problem_options[PROBLEM]
+        if unknown_default_options:
+            raise RuntimeError("Expecting only problem options in section"
+                               " default but got {}".format(unknown_default_options))
+        problem_defaults.update(default_options)
+
+        problems_manager = ProblemsManager(relative_path,
+                                           self._convert_options(general_options),
+                                           self._convert_options(problem_defaults))
+
+        for problem_options in spec.get("problems", []):
+            problem_options = dict(problem_options)
+            unknown_problem_options = problem_options.keys() - self._problem_options[PROBLEM]
+            if unknown_problem_options:
+                raise RuntimeError("Expecting only problem options "
+                                   "in problem but got {}".format(unknown_problem_options))
+
+            problems_manager.add_problem(**self._convert_options(problem_options), frozen=False)
+
+        return self.prepare_problems(problems_manager)
+
     def _option_handling(self, problems_manager:ProblemsManager)->None:
         '''
         Do any necessary manual option handling.
@@ -533,4 +608,11 @@ class CosaArgParser(argparse.ArgumentParser):
             if problem.verification == VerificationType.PARAMETRIC:
                 problem.strategy = VerificationStrategy.BWD
 
+            ############################## concrete simulation ###############################
+            # the concrete simulator does not use a solver, hence it only supports simulation
+            if (problem.strategy == VerificationStrategy.CONC) and \
+               (problem.verification != VerificationType.SIMULATION):
+                raise RuntimeError("Strategy {} is only available for "
+                                   "simulation".format(VerificationStrategy.CONC))
+
         return problems_manager
@@ -8,6 +8,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import importlib
 import os
 import shutil
 
@@ -85,6 +86,10 @@ VERILOG_YOSYS_COREIR = VerilogEncoder.YOSYS_COREIR
 
 class ModelParsersFactory(object):
     parsers = []
+    # parsers are imported only when a file with one of their extensions is parsed
+    lazy_parsers = []
+    available = {}
+    initialized = False
     verilog_encoder = VerilogEncoder.YOSYS_BTOR
     # Other option -- to be deprecated soon
     # verilog_encoder = VerilogEncoder.INTERNAL
@@ -92,27 +97,40 @@ class ModelParsersFactory(object):
     # Additional parsers should be registered here #
     @staticmethod
     def init_parsers():
-        from cosa.encoders.btor2 import BTOR2Parser
-        from cosa.encoders.coreir import CoreIRParser
-        from cosa.encoders.explicit_transition_system import ExplicitTSParser
-        from cosa.encoders.symbolic_transition_system import SymbolicTSParser, SymbolicSimpleTSParser
-        from cosa.encoders.verilog_yosys import VerilogYosysBtorParser
-
-        ModelParsersFactory.register_parser(BTOR2Parser())
-        ModelParsersFactory.register_parser(CoreIRParser())
-        ModelParsersFactory.register_parser(ExplicitTSParser())
-        ModelParsersFactory.register_parser(SymbolicTSParser())
-        ModelParsersFactory.register_parser(SymbolicSimpleTSParser())
+        if ModelParsersFactory.initialized:
+            return
+        ModelParsersFactory.initialized = True
+
+        ModelParsersFactory.register_lazy_parser("cosa.encoders.btor2", "BTOR2Parser", ["btor2","btor"])
+        ModelParsersFactory.register_lazy_parser("cosa.encoders.coreir", "CoreIRParser", ["json"])
+        ModelParsersFactory.register_lazy_parser("cosa.encoders.explicit_transition_system", "ExplicitTSParser", ["ets"])
+        ModelParsersFactory.register_lazy_parser("cosa.encoders.symbolic_transition_system", "SymbolicTSParser", ["sts"])
+        ModelParsersFactory.register_lazy_parser("cosa.encoders.symbolic_transition_system", "SymbolicSimpleTSParser", ["ssts"])
 
         if ModelParsersFactory.verilog_encoder == VerilogEncoder.INTERNAL:
             Logger.error("Internal verilog parser support is deprecated.")
 
         if ModelParsersFactory.verilog_encoder == VerilogEncoder.YOSYS_BTOR:
-            ModelParsersFactory.register_parser(VerilogYosysBtorParser())
+            ModelParsersFactory.register_lazy_parser("cosa.encoders.verilog_yosys", "VerilogYosysBtorParser", ["v", "sv", "vlist"])
 
         if ModelParsersFactory.verilog_encoder == VerilogEncoder.YOSYS_COREIR:
             Logger.error("Not supported")
 
+    @staticmethod
+    def register_lazy_parser(module, classname, extensions):
+        ModelParsersFactory.lazy_parsers.append([module, classname, extensions, False])
+
+    @staticmethod
+    def _load_parsers(extension=None):
+        ModelParsersFactory.init_parsers()
+        for lazy_parser in ModelParsersFactory.lazy_parsers:
+            (module, classname, extensions, loaded) = lazy_parser
+            if loaded or ((extension is not None) and (extension not in extensions)):
+                continue
+            parser_class = getattr(importlib.import_module(module), classname)
+            ModelParsersFactory.register_parser(parser_class())
+            lazy_parser[3] = True
+
     @staticmethod
     def register_parser(parser):
         if parser.get_name() not in dict(ModelParsersFactory.parsers):
@@ -120,23 +138,40 @@ class ModelParsersFactory(object):
 
     @staticmethod
     def parser_by_name(name):
-        ModelParsersFactory.init_parsers()
+        ModelParsersFactory._load_parsers()
         dprint = dict(ModelParsersFactory.parsers)
         if name not in dprint:
             Logger.error("Parser \"%s\" is not registered"%name)
         return dprint[name]
 
+    @staticmethod
+    def parsers_by_extension(extension):
+        ModelParsersFactory._load_parsers(extension)
+        return [x[1] for x in ModelParsersFactory.parsers if extension in x[1].get_extensions()]
+
+    @staticmethod
+    def is_available(parser):
+        # the availability might require to run external tools
+        if parser.get_name() not in ModelParsersFactory.available:
+            ModelParsersFactory.available[parser.get_name()] = parser.is_available()
+        return ModelParsersFactory.available[parser.get_name()]
+
     @staticmethod
     def get_parsers():
-        ModelParsersFactory.init_parsers()
+        ModelParsersFactory._load_parsers()
         return [x[1] for x in ModelParsersFactory.parsers]
 
 class GeneratorsFactory(object):
     generators = []
+    initialized = False
 
     # Additional generators should be registered here #
     @staticmethod
     def init_generators():
+        if GeneratorsFactory.initialized:
+            return
+        GeneratorsFactory.initialized = True
+
         from cosa.encoders.generators import ScoreBoardGenerator, FixedScoreBoardGenerator, RandomGenerator
 
         GeneratorsFactory.register_generator(FixedScoreBoardGenerator())
@@ -166,10 +201,15 @@ class ClockBehaviorsFactory(object):
     default_clockbehavior = None
     default_multi_clockbehavior = None
     default_abstract_clockbehavior = None
+    initialized = False
 
     # Additional clockbehaviors should be registered here #
     @staticmethod
     def init_clockbehaviors():
+        if ClockBehaviorsFactory.initialized:
+            return
+        ClockBehaviorsFactory.initialized = True
+
         from cosa.encoders.clock import DeterministicClockBehavior, ConstantClockBehavior, NondeterministicClockBehavior
 
         ClockBehaviorsFactory.register_clockbehavior(DeterministicClockBehavior(), default=True)
@@ -8,10 +8,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import ChainMap
+
 from pysmt.shortcuts import TRUE, FALSE, BOOL, And, EqualsOrIff, Iff, Symbol, Implies
+from pysmt.rewritings import conjunctive_partition
 
 from cosa.representation import HTS, TS
-from cosa.encoders.coreir import SEP
+from cosa.encoders.modules import SEP
 from cosa.encoders.formulae import StringParser
 from cosa.utils.logger import Logger
 from cosa.utils.formula_mngm import substitute, get_free_variables
@@ -22,52 +25,148 @@ S2 = "sys2"+SEP
 EQS = "eq_S1_S2"
 
 class Miter(object):
+    """Miter of two systems, for equivalence checking.
+
+    The systems are renamed TS by TS with the prefixes S1 and S2. The
+    common inputs are shared, and the TSs of the second system that are
+    identical to a TS of the first one, and functionally define their
+    variables from shared ones, are merged with it instead of being
+    duplicated (e.g., the unchanged modules of a patched design).
+    """
+
+    @staticmethod
+    def _varmap(vars_, prefix):
+        varmap = {}
+        for v in vars_:
+            name = v.symbol_name()
+            for vname in [name, TS.get_prime_name(name), TS.get_prev_name(name)]:
+                varmap[vname] = TS.get_prefix_name(vname, prefix)
+        return varmap
+
+    @staticmethod
+    def _share(varmap, vars_):
+        """Maps the variables of the second system to the names of the first one"""
+
+        for v in vars_:
+            name = v.symbol_name()
+            for vname in [name, TS.get_prime_name(name), TS.get_prev_name(name)]:
+                varmap[vname] = TS.get_prefix_name(vname, S1)
+
+    @staticmethod
+    def _driven_vars(ts, symbolic_init):
+        """Variables that are functions of the other variables of the TS, None if the TS is not functional"""
+
+        conjuncts = lambda formula: [c for c in conjunctive_partition(formula) if c != TRUE()] if formula is not None else []
+        init = conjuncts(ts.init)
+        trans = conjuncts(ts.trans)
+        invar = conjuncts(ts.invar)
+        candidates = set(ts.vars)
+
+        # unconditional assignments are definitions
+        if ts.ftrans:
+            for (var, cond_assign_list) in ts.ftrans.items():
+                if (len(cond_assign_list) != 1) or (cond_assign_list[0][0] != TRUE()):
+                    return None
+                (trans if TS.is_prime(var) else invar).append(EqualsOrIff(var, cond_assign_list[0][1]))
+                candidates.add(TS.get_ref_var(var))
+
+        def definitions(conjuncts, candidates):
+            (defs, defining) = HTS.find_definitions(conjuncts, candidates)
+            return defs if len(defining) == len(set(conjuncts)) else None
+
+        driven = definitions(invar, candidates)
+        if driven is None:
+            return None
+        driven = set(driven)
+
+        if trans or init:
+            # the registers start from the same values only with a concrete initial state
+            if symbolic_init:
+                return None
+            nexts = definitions(trans, set([TS.get_prime(v) for v in candidates]))
+            if nexts is None:
+                return None
+            states = set([TS.get_ref_var(v) for v in nexts])
+            inits = definitions(init, states)
+            if (inits is None) or (set(inits) != states):
+                return None
+            driven |= states
+
+        return driven
+
+    @staticmethod
+    def _rename_systems(hts, hts2, symbolic_init, share_inputs):
+        map1 = Miter._varmap(hts.vars, S1)
+        map2 = Miter._varmap(hts2.vars, S2)
+        if share_inputs:
+            Miter._share(map2, hts.input_vars & hts2.input_vars)
+
+        key = lambda ts: (ts.init, ts.trans, ts.invar, \
+                          frozenset([(var, tuple(cond_assign_list)) for (var, cond_assign_list) in (ts.ftrans or {}).items()]))
+        tss1 = [ts.remap(map1) for ts in hts.tss]
+        index1 = set([key(ts) for ts in tss1])
+
+        # indexes the TSs of the second system by the variables they read
+        tss2 = list(hts2.tss)
+        users = {}
+        for ts in tss2:
+            formulae = [f for f in [ts.init, ts.trans, ts.invar] if f is not None]
+            for (var, cond_assign_list) in (ts.ftrans or {}).items():
+                formulae += [var] + [f for cond_assign in cond_assign_list for f in cond_assign]
+            read_vars = set([])
+            for formula in formulae:
+                read_vars |= set([TS.get_ref_var(v) for v in get_free_variables(formula)])
+            for v in read_vars:
+                users.setdefault(v, []).append(ts)
+
+        driven = dict([(ts, Miter._driven_vars(ts, symbolic_init)) for ts in tss2])
+        merged = set([])
+        queue = [ts for ts in tss2 if driven[ts]]
+        while queue:
+            ts = queue.pop()
+            if ts in merged:
+                continue
+
+            shared = {}
+            Miter._share(shared, driven[ts])
+            if key(ts.remap(ChainMap(shared, map2))) not in index1:
+                continue
+
+            # the variables driven by the TS are equal in the two systems
+            merged.add(ts)
+            map2.update(shared)
+            for v in driven[ts]:
+                queue += [user for user in users.get(v, []) if driven[user] and (user not in merged)]
+
+        tss2 = [ts.remap(map2) for ts in tss2 if ts not in merged]
+        if merged:
+            Logger.log("Miter: %s TSs shared out of %s"%(len(merged), len(hts2.tss)), 1)
+
+        if symbolic_init:
+            for ts in tss1 + tss2:
+                ts.init = TRUE()
+
+        return (tss1, tss2, map1, map2)
 
     @staticmethod
     def combine_systems(hts, hts2, k, symbolic_init, eqprop=None, inc=True, non_deterministic=False):
         htseq = HTS("eq")
 
-        hts1_varnames = [v.symbol_name() for v in hts.vars]
-        hts2_varnames = [v.symbol_name() for v in hts2.vars]
-        
-        map1 = dict([(v, TS.get_prefix_name(v, S1)) for v in hts1_varnames]+\
-                    [(TS.get_prime_name(v), TS.get_prefix_name(TS.get_prime_name(v), S1)) for v in hts1_varnames])
-        map2 = dict([(v, TS.get_prefix_name(v, S2)) for v in hts2_varnames]+\
-                    [(TS.get_prime_name(v), TS.get_prefix_name(TS.get_prime_name(v), S2)) for v in hts2_varnames])
-
-        ts1_init = TRUE()
-        ts2_init = TRUE()
-
-        if not symbolic_init:
-            ts1_init = substitute(hts.single_init(), map1)
-            ts2_init = substitute(hts2.single_init(), map2)
-
-        ts1 = TS()
-        ts1.vars = set([TS.get_prefix(v, S1) for v in hts.vars])
-        ts1.set_behavior(ts1_init,\
-                         substitute(hts.single_trans(), map1),\
-                         substitute(hts.single_invar(), map1))
-        ts1.state_vars = set([TS.get_prefix(v, S1) for v in hts.state_vars])
-
-        ts2 = TS()
-        ts2.vars = set([TS.get_prefix(v, S2) for v in hts2.vars])
-        ts2.set_behavior(ts2_init,\
-                         substitute(hts2.single_trans(), map2),\
-                         substitute(hts2.single_invar(), map2))
-        ts2.state_vars = set([TS.get_prefix(v, S2) for v in hts2.state_vars])
-
-        htseq.add_ts(ts1)
-        htseq.add_ts(ts2)
+        # the common inputs are the same variables, when they are constrained to be equal
+        (tss1, tss2, map1, map2) = Miter._rename_systems(hts, hts2, symbolic_init, eqprop is None)
+
+        for ts in tss1 + tss2:
+            htseq.add_ts(ts)
+
+        rename1 = lambda f: substitute(f, map1)
+        rename2 = lambda f: substitute(f, map2)
+
+        htseq.eliminated = dict([(rename1(v), rename1(e)) for (v, e) in hts.eliminated.items()] + \
+                                [(rename2(v), rename2(e)) for (v, e) in hts2.eliminated.items()])
 
         assumptions = []
         lemmas = []
 
-        def sets_intersect(set1, set2):
-            for el in set1:
-                if not el in set2:
-                    return False
-            return True
-        
         if hts.assumptions is not None:
             for assumption in hts.assumptions:
                 assumptions.append(assumption)
@@ -83,56 +182,50 @@ class Miter(object):
         if hts2.lemmas is not None:
             for lemma in hts2.lemmas:
                 lemmas.append(lemma)
-                
-        for assumption in assumptions:
-            fv_assumption = get_free_variables(assumption)
-            c_assumption = TRUE()
-            
-            if sets_intersect(fv_assumption, hts.vars):
-                c_assumption = And(c_assumption, substitute(assumption, map1))
-            if sets_intersect(fv_assumption, hts2.vars):
-                c_assumption = And(c_assumption, substitute(assumption, map2))
 
+        vars1 = frozenset(hts.vars)
+        vars2 = frozenset(hts2.vars)
+
+        def combine(formula):
+            fv_formula = get_free_variables(formula)
+            c_formula = TRUE()
+
+            if fv_formula <= vars1:
+                c_formula = And(c_formula, rename1(formula))
+            if fv_formula <= vars2:
+                c_formula = And(c_formula, rename2(formula))
+
+            return c_formula
+
+        for assumption in assumptions:
+            c_assumption = combine(assumption)
             if c_assumption != TRUE():
                 htseq.add_assumption(c_assumption)
 
         for lemma in lemmas:
-            fv_lemma = get_free_variables(lemma)
-            c_lemma = TRUE()
-            
-            if sets_intersect(fv_lemma, hts.vars):
-                c_lemma = And(c_lemma, substitute(lemma, map1))
-            if sets_intersect(fv_lemma, hts2.vars):
-                c_lemma = And(c_lemma, substitute(lemma, map2))
-
+            c_lemma = combine(lemma)
             if c_lemma != TRUE():
                 htseq.add_lemma(c_lemma)
-                
+
         miter_out = Symbol(EQS, BOOL)
 
         inputs = hts.input_vars.intersection(hts2.input_vars)
         outputs = hts.output_vars.intersection(hts2.output_vars)
 
-        htseq.input_vars = set([TS.get_prefix(v, S1) for v in hts.input_vars]).union(set([TS.get_prefix(v, S2) for v in hts2.input_vars]))
-        htseq.output_vars = set([TS.get_prefix(v, S1) for v in hts.output_vars]).union(set([TS.get_prefix(v, S2) for v in hts2.output_vars]))
+        htseq.input_vars = set([rename1(v) for v in hts.input_vars]).union(set([rename2(v) for v in hts2.input_vars]))
+        htseq.output_vars = set([rename1(v) for v in hts.output_vars]).union(set([rename2(v) for v in hts2.output_vars]))
 
         if symbolic_init or (not non_deterministic):
             states = hts.state_vars.intersection(hts2.state_vars)
         else:
             states = []
 
-        eqinputs = TRUE()
-        eqoutputs = TRUE()
-        eqstates = TRUE()
-
-        for inp in inputs:
-            eqinputs = And(eqinputs, EqualsOrIff(TS.get_prefix(inp, S1), TS.get_prefix(inp, S2)))
-
-        for out in outputs:
-            eqoutputs = And(eqoutputs, EqualsOrIff(TS.get_prefix(out, S1), TS.get_prefix(out, S2)))
+        # the shared variables are trivially equal
+        equal = lambda vars_: And([EqualsOrIff(rename1(v), rename2(v)) for v in vars_ if rename1(v) != rename2(v)])
 
-        for svar in states:
-            eqstates = And(eqstates, EqualsOrIff(TS.get_prefix(svar, S1), TS.get_prefix(svar, S2)))
+        eqinputs = equal(inputs)
+        eqoutputs = equal(outputs)
+        eqstates = equal(states)
 
         if eqprop is None:
             if symbolic_init or (not non_deterministic):
@@ -19,6 +19,9 @@ import pysmt.environment
 import pysmt.formula
 
 from cosa.encoders.formulae import StringParser
+from cosa.modifiers.passes import ModelPasses
+from cosa.utils.cardinality import Cardinality
+from cosa.utils.formula_mngm import reset_structural_hash
 from cosa.utils.logger import Logger
 
 from pysmt.operators import new_node_type
@@ -241,9 +244,15 @@ def push_env(env=None):
     return pysmt_push_env(env=env)
 
 def reset_env():
-    """Overload reset_env to use the new push_env()."""
+    """Overload reset_env to use the new push_env().
+
+    The caches of formulae are cleared, as they refer to the nodes of the old environment.
+    """
     pop_env()
     push_env()
+    ModelPasses.reset()
+    Cardinality.reset()
+    reset_structural_hash()
     return get_env()
 
 
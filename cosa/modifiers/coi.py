@@ -149,6 +149,7 @@ class ConeOfInfluence(object):
 
         new_hts = HTS("COI")
         new_hts.add_ts(coits)
+        new_hts.eliminated = dict(hts.eliminated)
 
         if self.save_model:
             printer = HTSPrintersFactory.printer_by_name("STS")
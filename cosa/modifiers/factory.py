@@ -52,3 +52,44 @@ class ModelModifiersFactory(object):
             Logger.error("Modifier \"%s\" is not registered"%name)
         return dmodifier[name]
     
+
+class ModelPassesFactory(object):
+    passes = []
+    initialized = False
+
+    # Additional passes should be registered here #
+    @staticmethod
+    def init_passes():
+        if ModelPassesFactory.initialized:
+            return
+        ModelPassesFactory.initialized = True
+
+        from cosa.modifiers.passes import ConstantPropagation, EqualitySubstitution, StructuralHashing, UnusedVariables
+
+        ModelPassesFactory.register_pass(ConstantPropagation())
+        ModelPassesFactory.register_pass(EqualitySubstitution())
+        ModelPassesFactory.register_pass(StructuralHashing())
+        ModelPassesFactory.register_pass(UnusedVariables())
+
+    @staticmethod
+    def register_pass(mpass):
+        if mpass.get_name() not in dict(ModelPassesFactory.passes):
+            ModelPassesFactory.passes.append((mpass.get_name(), mpass))
+
+    @staticmethod
+    def pass_names():
+        ModelPassesFactory.init_passes()
+        return [x[0] for x in ModelPassesFactory.passes]
+
+    @staticmethod
+    def get_passes():
+        ModelPassesFactory.init_passes()
+        return [x[1] for x in ModelPassesFactory.passes]
+
+    @staticmethod
+    def pass_by_name(name):
+        ModelPassesFactory.init_passes()
+        dpass = dict(ModelPassesFactory.passes)
+        if name not in dpass:
+            Logger.error("Pass \"%s\" is not registered"%name)
+        return dpass[name]
@@ -0,0 +1,358 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.rewritings import conjunctive_partition
+from pysmt.shortcuts import And, Or, Ite, Implies, EqualsOrIff, BV, BVExtract, TRUE, Symbol
+from pysmt.walkers.identitydag import IdentityDagWalker
+
+from cosa.representation import TS, HTS, L_BV, L_ABV, INIT, INVAR, TRANS
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.utils.logger import Logger
+
+MEMORIES_SP = ","
+MEMORY_SP = "="
+
+ARRAYS = "arrays"
+BLAST = "blast"
+LEMMAS = "lemmas"
+ABSTRACT = "abstract"
+AUTO = "auto"
+
+# from the most to the least precise encoding
+MODES = [ARRAYS, BLAST, LEMMAS, ABSTRACT]
+
+LOCATION = "%s_%s"
+READ = "%s.read_%s"
+
+def mux(locations, address, bit=None):
+    """Balanced selection of the locations by the bits of the address"""
+
+    if bit is None:
+        bit = address.get_type().width-1
+    if len(locations) == 1:
+        return locations[0]
+    half = len(locations)//2
+    select = EqualsOrIff(BVExtract(address, bit, bit), BV(1, 1))
+    return Ite(select, mux(locations[half:], address, bit-1), mux(locations[:half], address, bit-1))
+
+class MemoryEncoder(IdentityDagWalker):
+    """Replaces the memories by their tracked locations.
+
+    The reads of a blasted memory select one of all its locations, while
+    the reads of an abstract memory at the addresses that are not
+    tracked return a fresh (unconstrained) value.
+    """
+
+    def __init__(self, memories, locations, blasted):
+        IdentityDagWalker.__init__(self)
+        # memory and its next are mapped to the reference memory
+        self.memories = dict([(m, m) for m in memories] + [(TS.get_prime(m), m) for m in memories])
+        self.locations = locations
+        self.blasted = blasted
+        self.reads = []
+        self.location_vars = {}
+        self.part = None
+
+    def location(self, memory, address):
+        ref = self.memories[memory]
+        key = (ref, address)
+        if key not in self.location_vars:
+            name = LOCATION%(ref.symbol_name(), address.constant_value())
+            self.location_vars[key] = Symbol(name, ref.symbol_type().elem_type)
+        var = self.location_vars[key]
+        return TS.get_prime(var) if TS.is_prime(memory) else var
+
+    def _walked(self, formula):
+        return self.memoization[formula]
+
+    def element(self, term, address):
+        """Value of the array term at the tracked address"""
+
+        if term in self.memories:
+            return self.location(term, address)
+        if term.is_store():
+            (array, index, value) = term.args()
+            return Ite(EqualsOrIff(self._walked(index), address), self._walked(value), self.element(array, address))
+        if term.is_ite():
+            (condition, left, right) = term.args()
+            return Ite(self._walked(condition), self.element(left, address), self.element(right, address))
+        if term.is_array_value():
+            return self._walked(term.array_value_get(address))
+        Logger.error("Unsupported array term \"%s\""%term)
+
+    def read(self, term, address):
+        """Value of the array term at the (encoded) address"""
+
+        if term in self.memories:
+            ref = self.memories[term]
+            if address.is_constant() and (address in self.locations[ref]):
+                return self.location(term, address)
+            locations = [self.location(term, a) for a in self.locations[ref]]
+            if self.blasted[ref]:
+                return mux(locations, address)
+            value = Symbol(READ%(ref.symbol_name(), len(self.reads)), ref.symbol_type().elem_type)
+            self.reads.append((term, address, value, self.part))
+            for (location, tracked) in reversed(list(zip(locations, self.locations[ref]))):
+                value = Ite(EqualsOrIff(address, tracked), location, value)
+            return value
+        if term.is_store():
+            (array, index, value) = term.args()
+            index = self._walked(index)
+            return Ite(EqualsOrIff(address, index), self._walked(value), self.read(array, address))
+        if term.is_ite():
+            (condition, left, right) = term.args()
+            return Ite(self._walked(condition), self.read(left, address), self.read(right, address))
+        if term.is_array_value():
+            value = self._walked(term.array_value_default())
+            for (index, assigned) in term.array_value_assigned_values_map().items():
+                value = Ite(EqualsOrIff(address, self._walked(index)), self._walked(assigned), value)
+            return value
+        Logger.error("Unsupported array term \"%s\""%term)
+
+    def walk_array_select(self, formula, args, **kwargs):
+        if not any([v in self.memories for v in get_free_variables(formula.arg(0))]):
+            return self.mgr.Select(*args)
+        return self.read(formula.arg(0), args[1])
+
+    def walk_equals(self, formula, args, **kwargs):
+        (left, right) = formula.args()
+        if not left.get_type().is_array_type():
+            return self.mgr.Equals(*args)
+        refs = [self.memories[v] for v in get_free_variables(formula) if v in self.memories]
+        if not refs:
+            return self.mgr.Equals(*args)
+        return And([EqualsOrIff(self.element(left, a), self.element(right, a)) for a in self.locations[refs[0]]])
+
+    def encode(self, formula, part):
+        self.part = part
+        return self.walk(formula)
+
+class MemoryAbstraction(object):
+    """Encodings of the memories (i.e., array variables) of the flattened model.
+
+    Each memory is kept as an array, blasted into one variable for each
+    location, or abstracted by tracking only the constant addresses that
+    are read. The reads of an abstract memory at the other addresses are
+    unconstrained, and the lemmas mode constrains them to be consistent
+    within a state and with the writes of the previous transition. The
+    memories compared or combined with each other share the encoding.
+    """
+
+    @staticmethod
+    def modes(spec):
+        """Encoding by memory name, and the default one"""
+
+        modes = {}
+        for entry in spec.split(MEMORIES_SP):
+            entry = entry.strip()
+            if not entry:
+                continue
+            (name, mode) = entry.rsplit(MEMORY_SP, 1) if MEMORY_SP in entry else (None, entry)
+            mode = mode.strip()
+            if mode not in MODES+[AUTO]:
+                Logger.error("Memory encoding \"%s\" not supported, choose among %s"%(mode, ", ".join(MODES+[AUTO])))
+            modes[name.strip() if name is not None else None] = mode
+        return modes
+
+    @staticmethod
+    def _array_nodes(formulae):
+        stack = list(formulae)
+        visited = set([])
+        while stack:
+            formula = stack.pop()
+            if formula in visited:
+                continue
+            visited.add(formula)
+            if formula.is_select() or (formula.is_equals() and formula.arg(0).get_type().is_array_type()):
+                yield formula
+            stack += formula.args()
+
+    @staticmethod
+    def _groups(memories, formulae):
+        """Memories compared or combined with each other, and the constant addresses that are read"""
+
+        groups = dict([(m, set([m])) for m in memories])
+        addresses = dict([(m, set([])) for m in memories])
+        for node in MemoryAbstraction._array_nodes(formulae):
+            term = node.arg(0) if node.is_select() else node
+            group = set([])
+            for var in get_free_variables(term):
+                if TS.get_ref_var(var) in groups:
+                    group |= groups[TS.get_ref_var(var)]
+            for m in group:
+                groups[m] = group
+            if node.is_select() and node.arg(1).is_constant():
+                for m in group:
+                    addresses[m].add(node.arg(1))
+
+        result = []
+        for group in set([frozenset(g) for g in groups.values()]):
+            tracked = set([])
+            for m in group:
+                tracked |= addresses[m]
+            result.append((group, tracked))
+        return sorted(result, key=lambda g: sorted([m.symbol_name() for m in g[0]]))
+
+    @staticmethod
+    def _mode(memory, modes, blast_size):
+        mode = modes.get(memory.symbol_name(), modes.get(None, ARRAYS))
+        array_type = memory.symbol_type()
+        if not (array_type.index_type.is_bv_type() and \
+                (array_type.elem_type.is_bv_type() or array_type.elem_type.is_bool_type())):
+            return ARRAYS
+        if mode == AUTO:
+            return BLAST if 2**array_type.index_type.width <= blast_size else ABSTRACT
+        return mode
+
+    @staticmethod
+    def _lemmas(encoder, trans, memories):
+        """Consistency of the unconstrained reads within a state, and with the previous writes"""
+
+        reads = [(m, a, r, part) for (m, a, r, part) in encoder.reads if TS.get_ref_var(m) in memories]
+        invar_reads = [(m, a, r) for (m, a, r, part) in reads if part == INVAR]
+        trans_reads = [(m, a, r) for (m, a, r, part) in reads if part == TRANS]
+        same = lambda read1, read2: Implies(EqualsOrIff(read1[1], read2[1]), EqualsOrIff(read1[2], read2[2]))
+        next_read = lambda read: (TS.get_prime(read[0]), TS.to_next(read[1]), TS.get_prime(read[2]))
+
+        invar_lemmas = []
+        for (i, read1) in enumerate(invar_reads):
+            invar_lemmas += [same(read1, read2) for read2 in invar_reads[i+1:] if read1[0] == read2[0]]
+
+        # the reads of the transitions refer to the current or to the next memory
+        trans_lemmas = []
+        for read1 in trans_reads:
+            for read2 in invar_reads:
+                if read1[0] == read2[0]:
+                    trans_lemmas.append(same(read1, read2))
+                elif read1[0] == TS.get_prime(read2[0]):
+                    trans_lemmas.append(same(read1, next_read(read2)))
+
+        # the reads in the next state, after the writes of the transition
+        current = invar_reads + [read for read in trans_reads if not TS.is_prime(read[0])]
+        for conjunct in conjunctive_partition(trans):
+            (condition, update) = (conjunct.arg(0), conjunct.arg(1)) if conjunct.is_implies() else (TRUE(), conjunct)
+            if not (update.is_equals() and update.arg(0).is_symbol() and TS.is_prime(update.arg(0)) and \
+                    (TS.get_ref_var(update.arg(0)) in memories)):
+                continue
+            (memory, value) = (TS.get_ref_var(update.arg(0)), update.arg(1))
+            for (m, address, read) in invar_reads:
+                if m != memory:
+                    continue
+                resolved = MemoryAbstraction._resolve(encoder, memory, value, TS.to_next(address), current)
+                if resolved is not None:
+                    (defined, result) = resolved
+                    trans_lemmas.append(Implies(And(encoder.walk(condition), defined), \
+                                                EqualsOrIff(TS.get_prime(read), result)))
+
+        return (invar_lemmas, trans_lemmas)
+
+    @staticmethod
+    def _resolve(encoder, memory, term, address, reads):
+        """Condition under which the read of the array term is known, and its value"""
+
+        if term == memory:
+            known = [(EqualsOrIff(address, a), encoder.location(memory, a)) for a in encoder.locations[memory]]
+            known += [(EqualsOrIff(address, a), r) for (m, a, r) in reads if m == memory]
+            if not known:
+                return None
+            value = known[-1][1]
+            for (condition, location) in reversed(known[:-1]):
+                value = Ite(condition, location, value)
+            return (Or([condition for (condition, _) in known]), value)
+        if term.is_store():
+            (array, index, value) = term.args()
+            resolved = MemoryAbstraction._resolve(encoder, memory, array, address, reads)
+            written = EqualsOrIff(address, encoder.walk(index))
+            if resolved is None:
+                return (written, encoder.walk(value))
+            return (Or(written, resolved[0]), Ite(written, encoder.walk(value), resolved[1]))
+        if term.is_ite():
+            (condition, left, right) = term.args()
+            (resolved_l, resolved_r) = [MemoryAbstraction._resolve(encoder, memory, t, address, reads) for t in [left, right]]
+            if (resolved_l is None) or (resolved_r is None):
+                return None
+            condition = encoder.walk(condition)
+            return (Ite(condition, resolved_l[0], resolved_r[0]), Ite(condition, resolved_l[1], resolved_r[1]))
+        return None
+
+    @staticmethod
+    def run(hts, spec, blast_size, observed):
+        modes = MemoryAbstraction.modes(spec)
+
+        init = hts.single_init()
+        invar = hts.single_invar()
+        trans = hts.single_trans()
+
+        memories = set([v for v in hts.vars if v.symbol_type().is_array_type()])
+        if not memories:
+            return hts
+
+        locations = {}
+        blasted = {}
+        with_lemmas = set([])
+        for (group, tracked) in MemoryAbstraction._groups(memories, [init, invar, trans]):
+            group_modes = [ARRAYS if m in observed else MemoryAbstraction._mode(m, modes, blast_size) for m in group]
+            mode = min(group_modes, key=MODES.index)
+            Logger.log("Memories %s: %s"%(", ".join(sorted([m.symbol_name() for m in group])), mode), 1)
+            if mode == ARRAYS:
+                continue
+            for m in group:
+                width = m.symbol_type().index_type.width
+                if mode == BLAST:
+                    locations[m] = [BV(i, width) for i in range(2**width)]
+                else:
+                    locations[m] = sorted(tracked, key=lambda a: a.constant_value())
+                blasted[m] = (mode == BLAST)
+            if mode == LEMMAS:
+                with_lemmas |= group
+
+        if not locations:
+            return hts
+
+        encoder = MemoryEncoder(set(locations), locations, blasted)
+        e_invar = encoder.encode(invar, INVAR)
+        e_init = encoder.encode(init, INIT)
+        e_trans = encoder.encode(trans, TRANS)
+
+        if with_lemmas:
+            (l_invar, l_trans) = MemoryAbstraction._lemmas(encoder, trans, with_lemmas)
+            e_invar = And([e_invar] + l_invar)
+            e_trans = And([e_trans] + l_trans)
+
+        eliminated = dict([(var, encoder.encode(expr, None)) for (var, expr) in hts.eliminated.items()])
+
+        location_vars = set([TS.get_ref_var(v) for v in encoder.location_vars.values()])
+        read_vars = set([r for (_, _, r, _) in encoder.reads])
+        encoded = set(locations)
+
+        ts = TS("Memories encoding")
+        ts.vars = (hts.vars - encoded) | location_vars | read_vars
+        ts.state_vars = hts.state_vars - encoded
+        ts.input_vars = (hts.input_vars - encoded) | read_vars
+        ts.output_vars = hts.output_vars - encoded
+        for ((memory, _), var) in encoder.location_vars.items():
+            if memory in hts.input_vars:
+                ts.input_vars.add(var)
+            else:
+                ts.state_vars.add(var)
+        ts.set_behavior(e_init, e_trans, e_invar)
+        ts.logic = L_ABV if any([v.symbol_type().is_array_type() for v in ts.vars]) else L_BV
+
+        new_hts = HTS(hts.name)
+        new_hts.params = hts.params
+        new_hts.add_ts(ts)
+        new_hts.logic = ts.logic
+        new_hts.eliminated = eliminated
+
+        # the counterexamples of the abstract memories are checked on the concrete ones
+        if not all([blasted[m] for m in locations]):
+            new_hts.concrete = hts
+
+        return new_hts
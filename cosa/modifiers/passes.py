@@ -0,0 +1,339 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+
+from pysmt.rewritings import conjunctive_partition
+from pysmt.shortcuts import And, TRUE, FALSE, simplify
+from pysmt.walkers.identitydag import IdentityDagWalker
+
+from cosa.representation import TS, HTS
+from cosa.utils.formula_mngm import get_free_variables, structural_hash
+from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
+
+PASSES_SP = ","
+
+class PassModel(object):
+    """Flattened model transformed by the passes.
+
+    The protected variables (e.g., inputs, outputs and states) are never
+    removed, and the removed variables are kept with their definitions.
+    """
+
+    init = None
+    invar = None
+    trans = None
+    ftrans = None
+
+    vars = None
+    state_vars = None
+    input_vars = None
+    output_vars = None
+    protected = None
+    eliminated = None
+
+    @staticmethod
+    def from_hts(hts, protected):
+        model = PassModel()
+        model.init = list(conjunctive_partition(hts.single_init()))
+        model.invar = list(conjunctive_partition(hts.single_invar(include_ftrans=False)))
+        model.trans = list(conjunctive_partition(hts.single_trans(include_ftrans=False)))
+        model.ftrans = dict(hts.single_ftrans())
+        model.vars = set(hts.vars)
+        model.state_vars = set(hts.state_vars)
+        model.input_vars = set(hts.input_vars)
+        model.output_vars = set(hts.output_vars)
+        # the variables assigned by ftrans are not removed
+        model.protected = set(protected) | set([TS.get_ref_var(v) for v in model.ftrans])
+        model.eliminated = dict(hts.eliminated)
+        return model
+
+    def to_hts(self, hts):
+        ts = TS("Model passes")
+        ts.vars = set(self.vars)
+        ts.state_vars = set(self.state_vars)
+        ts.input_vars = set(self.input_vars)
+        ts.output_vars = set(self.output_vars)
+        ts.init = And(self.init)
+        ts.invar = And(self.invar)
+        ts.trans = And(self.trans)
+        ts.ftrans = dict(self.ftrans) if self.ftrans else None
+        ts.logic = hts.logic
+
+        new_hts = HTS(hts.name)
+        new_hts.params = hts.params
+        new_hts.add_ts(ts)
+        new_hts.eliminated = dict(self.eliminated)
+        return new_hts
+
+    def copy(self):
+        model = PassModel()
+        model.__dict__.update(self.__dict__)
+        return model
+
+    def formulae(self):
+        ftrans = []
+        for cond_assign_list in self.ftrans.values():
+            for (condition, value) in cond_assign_list:
+                ftrans += [condition, value]
+        return self.init + self.invar + self.trans + ftrans
+
+    def used_vars(self):
+        used = set([TS.get_ref_var(v) for v in self.ftrans])
+        for formula in self.formulae():
+            used |= set([TS.get_ref_var(v) for v in get_free_variables(formula)])
+        return used
+
+    def statistics(self):
+        nodes = set([])
+        stack = self.formulae()
+        while stack:
+            formula = stack.pop()
+            if formula not in nodes:
+                nodes.add(formula)
+                stack += formula.args()
+        conjuncts = len(self.init) + len(self.invar) + len(self.trans)
+        # the eliminated variables are kept only to print the traces
+        variables = len([v for v in self.vars if v not in self.eliminated])
+        return (variables, conjuncts, len(nodes))
+
+    def fingerprint(self):
+        digest = hashlib.sha1()
+        for part in [self.init, self.invar, self.trans]:
+            digest.update(",".join(sorted([structural_hash(f) for f in part])).encode())
+            digest.update(b";")
+        for var in sorted(self.ftrans, key=str):
+            digest.update(("%s:%s"%(var, ",".join(["%s,%s"%(structural_hash(c), structural_hash(a)) \
+                                                   for (c, a) in self.ftrans[var]]))).encode())
+        for varset in [self.vars, self.state_vars, self.input_vars, self.output_vars, self.protected]:
+            digest.update((",".join(sorted([v.symbol_name() for v in varset]))+";").encode())
+        for var in sorted(self.eliminated, key=str):
+            digest.update(("%s:%s"%(var, structural_hash(self.eliminated[var]))).encode())
+        return digest.hexdigest()
+
+    def rewrite(self, function):
+        """Applies the function to the conjunction of each part"""
+
+        model = self.copy()
+        part = lambda conjuncts: [c for c in conjunctive_partition(function(And(conjuncts))) if c != TRUE()]
+        model.init = part(self.init)
+        model.invar = part(self.invar)
+        model.trans = part(self.trans)
+        model.ftrans = dict([(var, [(function(c), function(a)) for (c, a) in cond_assign_list]) \
+                             for (var, cond_assign_list) in self.ftrans.items()])
+        return model
+
+    def eliminate(self, definitions, defining):
+        """Removes the defining conjuncts, and substitutes the defined variables everywhere"""
+
+        substitute = lambda f: f.substitute(HTS.definition_map(definitions, f))
+
+        model = self.copy()
+        model.invar = [c for c in self.invar if c not in defining]
+        model = model.rewrite(substitute)
+        model.eliminated = dict([(var, substitute(expr)) for (var, expr) in self.eliminated.items()])
+        model.eliminated.update(definitions)
+        return model
+
+class ModelPass(object):
+    name = "PASS"
+    description = "MISSING DESCRIPTION!"
+
+    def __init__(self):
+        pass
+
+    def run(self, model):
+        Logger.error("Pass is not implemented")
+
+    def get_name(self):
+        return self.name
+
+    def get_desc(self):
+        return self.description
+
+class ConstantPropagation(ModelPass):
+    name = "constants"
+    description = "propagates the constant values and the literals implied by the invariants"
+
+    def _constant(self, conjunct):
+        if conjunct.is_symbol():
+            return (conjunct, TRUE())
+        if conjunct.is_not() and conjunct.arg(0).is_symbol():
+            return (conjunct.arg(0), FALSE())
+        if conjunct.is_equals() or conjunct.is_iff():
+            (left, right) = conjunct.args()
+            if left.is_symbol() and right.is_constant():
+                return (left, right)
+            if right.is_symbol() and left.is_constant():
+                return (right, left)
+        return None
+
+    def run(self, model):
+        propagated = set([])
+        while True:
+            constants = {}
+            kept = set([])
+            defining = set([])
+            for conjunct in model.invar:
+                constant = self._constant(conjunct)
+                if (constant is None) or (constant[0] in constants) or (constant[0] in propagated) or \
+                   TS.is_prime(constant[0]) or TS.is_prev(constant[0]):
+                    continue
+                constants[constant[0]] = constant[1]
+                # the protected variables keep their constraint
+                if constant[0] in model.protected:
+                    kept.add(conjunct)
+                else:
+                    defining.add(conjunct)
+
+            if not constants:
+                break
+
+            propagated |= set(constants)
+            removed = dict([(var, value) for (var, value) in constants.items() if var not in model.protected])
+
+            substitute = lambda f: simplify(f.substitute(HTS.definition_map(constants, f)))
+            invar = model.invar
+            model = model.copy()
+            model.invar = [c for c in invar if (c not in kept) and (c not in defining)]
+            model = model.rewrite(substitute)
+            model.invar += list(kept)
+            model.eliminated = dict([(var, substitute(expr)) for (var, expr) in model.eliminated.items()])
+            model.eliminated.update(removed)
+
+        # the invariants also hold in the next state, hence are redundant in trans
+        invar = set(model.invar)
+        is_next = lambda c: all([TS.is_prime(v) for v in get_free_variables(c)])
+        model = model.copy()
+        model.trans = [c for c in model.trans if (c not in invar) and not (is_next(c) and (TS.to_prev(c) in invar))]
+
+        if FALSE() in model.invar + model.trans + model.init:
+            Logger.warning("The model has no behaviors")
+
+        return model
+
+class EqualitySubstitution(ModelPass):
+    name = "aliases"
+    description = "removes the wires defined by an equality in the invariants"
+
+    def run(self, model):
+        candidates = model.vars - model.protected
+        (definitions, defining) = HTS.find_definitions(model.invar, candidates)
+
+        if not definitions:
+            return model
+
+        return model.eliminate(definitions, defining)
+
+class CommutativeHashing(IdentityDagWalker):
+
+    def _sorted(self, args):
+        return sorted(args, key=structural_hash)
+
+    def walk_and(self, formula, args, **kwargs):
+        return self.mgr.And(self._sorted(set(args)))
+
+    def walk_or(self, formula, args, **kwargs):
+        return self.mgr.Or(self._sorted(set(args)))
+
+    def walk_iff(self, formula, args, **kwargs):
+        return self.mgr.Iff(*self._sorted(args))
+
+    def walk_equals(self, formula, args, **kwargs):
+        return self.mgr.Equals(*self._sorted(args))
+
+    def walk_bv_and(self, formula, args, **kwargs):
+        return self.mgr.BVAnd(*self._sorted(args))
+
+    def walk_bv_or(self, formula, args, **kwargs):
+        return self.mgr.BVOr(*self._sorted(args))
+
+    def walk_bv_xor(self, formula, args, **kwargs):
+        return self.mgr.BVXor(*self._sorted(args))
+
+    def walk_bv_add(self, formula, args, **kwargs):
+        return self.mgr.BVAdd(*self._sorted(args))
+
+    def walk_bv_mul(self, formula, args, **kwargs):
+        return self.mgr.BVMul(*self._sorted(args))
+
+class StructuralHashing(ModelPass):
+    name = "strash"
+    description = "shares the structurally equivalent terms, up to the order of the commutative operators"
+
+    def run(self, model):
+        walker = CommutativeHashing()
+        model = model.rewrite(walker.walk)
+
+        # equivalent conjuncts are now the same node
+        model.init = list(dict.fromkeys(model.init))
+        model.invar = list(dict.fromkeys(model.invar))
+        model.trans = list(dict.fromkeys(model.trans))
+        return model
+
+class UnusedVariables(ModelPass):
+    name = "unused"
+    description = "removes the variables that do not occur in the model"
+
+    def run(self, model):
+        used = model.used_vars() | model.protected | set(model.eliminated)
+
+        model = model.copy()
+        model.vars = set([v for v in model.vars if v in used])
+        model.state_vars = set([v for v in model.state_vars if v in used])
+        model.input_vars = set([v for v in model.input_vars if v in used])
+        model.output_vars = set([v for v in model.output_vars if v in used])
+        return model
+
+class ModelPasses(object):
+    """Pipeline of registered passes over the flattened model.
+
+    The result of each pass is cached by the fingerprint of its input,
+    hence models solved again (e.g., in server and watch modes) are not
+    processed twice.
+    """
+
+    cache = {}
+
+    @staticmethod
+    def reset():
+        ModelPasses.cache = {}
+
+    @staticmethod
+    def run(hts, names, protected):
+        from cosa.modifiers.factory import ModelPassesFactory
+
+        passes = [ModelPassesFactory.pass_by_name(name.strip()) for name in names.split(PASSES_SP) if name.strip()]
+        if not passes:
+            return hts
+
+        model = PassModel.from_hts(hts, protected)
+        statistics = Logger.level(1)
+        after = model.statistics() if statistics else None
+        for mpass in passes:
+            before = after
+            key = (mpass.get_name(), model.fingerprint())
+            cached = key in ModelPasses.cache
+            with Profiler.span("pass", type=mpass.get_name()):
+                if cached:
+                    model = ModelPasses.cache[key]
+                else:
+                    model = mpass.run(model)
+                    ModelPasses.cache[key] = model
+
+            if statistics:
+                after = model.statistics()
+                Logger.log("Pass \"%s\"%s:"%(mpass.get_name(), " (cached)" if cached else ""), 1)
+                Logger.log("  Vars:      %s -> %s"%(before[0], after[0]), 1)
+                Logger.log("  Conjuncts: %s -> %s"%(before[1], after[1]), 1)
+                Logger.log("  Nodes:     %s -> %s"%(before[2], after[2]), 1)
+
+        return model.to_hts(hts)
@@ -0,0 +1,180 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.rewritings import conjunctive_partition
+from pysmt.shortcuts import And, Implies, EqualsOrIff, BV, TRUE, FALSE, simplify, is_valid
+
+from cosa.representation import TS, HTS
+from cosa.utils.formula_mngm import get_free_variables
+from cosa.utils.logger import Logger
+
+class PhaseAbstraction(object):
+    """Folds the two phases of the clock into a single transition.
+
+    When all the registers are triggered on the same edge of a single
+    clock, the phase that brings the clock back to its initial value
+    does not change the state. The clock and its aliases are then
+    replaced by the values of the triggering edge, as in the abstract
+    clock encoding, and the traces are mapped back to the two phases
+    through the abstract clock list.
+    """
+
+    @staticmethod
+    def _values(clock):
+        if clock.symbol_type().is_bool_type():
+            return (FALSE(), TRUE())
+        if clock.symbol_type().is_bv_type() and (clock.symbol_type().width == 1):
+            return (BV(0, 1), BV(1, 1))
+        return None
+
+    @staticmethod
+    def _aliases(invar, clock):
+        """Wires connected to the clock, and the conjuncts connecting them"""
+
+        is_alias = lambda c: (c.is_equals() or c.is_iff()) and c.arg(0).is_symbol() and c.arg(1).is_symbol()
+        equalities = [c for c in conjunctive_partition(invar) if is_alias(c)]
+
+        aliases = set([clock])
+        connecting = set([])
+        changed = True
+        while changed:
+            changed = False
+            for conjunct in equalities:
+                (left, right) = conjunct.args()
+                if (left in aliases) != (right in aliases):
+                    aliases |= set([left, right])
+                    changed = True
+                if (left in aliases) and (right in aliases):
+                    connecting.add(conjunct)
+
+        return (aliases, connecting)
+
+    @staticmethod
+    def _edge_map(aliases, before, after):
+        submap = dict([(a, before) for a in aliases])
+        submap.update([(TS.get_prime(a), after) for a in aliases])
+        return submap
+
+    @staticmethod
+    def _clock_copies(trans, aliases):
+        """State variables that only store the value of the clock (e.g., the previous clock)"""
+
+        copies = set([])
+        for conjunct in conjunctive_partition(trans):
+            if not (conjunct.is_equals() or conjunct.is_iff()):
+                continue
+            (left, right) = conjunct.args()
+            for (var, value) in [(left, right), (right, left)]:
+                if var.is_symbol() and TS.is_prime(var) and (value in aliases):
+                    copies.add(TS.get_ref_var(var))
+        return copies
+
+    @staticmethod
+    def edge(hts, clock, observed):
+        """Values (before, after) of the clock on the triggering edge, None if the phases cannot be folded"""
+
+        values = PhaseAbstraction._values(clock)
+        if (values is None) or (clock in hts.state_vars):
+            return None
+
+        init = hts.single_init()
+        invar = hts.single_invar()
+        trans = hts.single_trans()
+
+        (aliases, connecting) = PhaseAbstraction._aliases(invar, clock)
+        timed_aliases = aliases | set([TS.get_prime(a) for a in aliases]) | set([TS.get_prev(a) for a in aliases])
+
+        # the clock is only observed by the registers
+        if aliases & observed:
+            return None
+        constraints = [init] + [c for c in conjunctive_partition(invar) if c not in connecting]
+        if any([get_free_variables(c) & timed_aliases for c in constraints]):
+            return None
+        if any([TS.get_prev(a) in get_free_variables(trans) for a in aliases]):
+            return None
+
+        # the variables with a next value, besides the inputs and the copies of the clock
+        stable = hts.state_vars | set([TS.get_ref_var(v) for v in get_free_variables(trans) if TS.is_prime(v)])
+        stable -= hts.input_vars | aliases | PhaseAbstraction._clock_copies(trans, aliases)
+        unchanged = And([EqualsOrIff(TS.get_prime(v), v) for v in stable])
+        step = And(invar, TS.to_next(invar), trans)
+
+        for (before, after) in [values, (values[1], values[0])]:
+            # the phase back to the initial value of the clock does not change the state
+            back = step.substitute(PhaseAbstraction._edge_map(aliases, after, before))
+            if is_valid(Implies(back, unchanged)):
+                return (before, after)
+
+        return None
+
+    @staticmethod
+    def fold(hts, clock, before, after):
+        """System where each transition is a triggering edge of the clock"""
+
+        (aliases, _) = PhaseAbstraction._aliases(hts.single_invar(), clock)
+        wires = dict([(a, clock) for a in aliases if a != clock])
+        edge = PhaseAbstraction._edge_map(aliases, before, after)
+
+        apply = lambda f, submap: None if f is None else simplify(f.substitute(submap))
+
+        new_hts = HTS(hts.name)
+        new_hts.params = hts.params
+        for ts in hts.tss:
+            new_ts = ts.remap({})
+            new_ts.init = apply(ts.init, wires)
+            new_ts.invar = apply(ts.invar, wires)
+            new_ts.trans = apply(ts.trans, edge)
+            if ts.ftrans is not None:
+                new_ts.ftrans = dict([(var, [(apply(c, edge), apply(a, edge)) for (c, a) in cond_assign_list]) \
+                                      for (var, cond_assign_list) in ts.ftrans.items()])
+            new_hts.add_ts(new_ts, add_vars=False)
+
+        # the interface is declared on the hierarchical system
+        new_hts.vars = set(hts.vars)
+        new_hts.state_vars = set(hts.state_vars)
+        new_hts.input_vars = set(hts.input_vars)
+        new_hts.output_vars = set(hts.output_vars)
+        for assumption in (hts.assumptions or []):
+            new_hts.add_assumption(assumption)
+        for lemma in (hts.lemmas or []):
+            new_hts.add_lemma(lemma)
+
+        # the clock wires are still part of the traces
+        new_hts.eliminated = dict(hts.eliminated)
+        new_hts.eliminated.update(wires)
+        return (new_hts, aliases)
+
+    @staticmethod
+    def abstract(systems, clocks, observed):
+        """Folds the phases of all the systems, returns None if any of them cannot be folded"""
+
+        if len(clocks) != 1:
+            Logger.log("Phase abstraction requires a single clock", 1)
+            return None
+
+        clock = clocks[0]
+        edges = set([PhaseAbstraction.edge(hts, clock, observed) for hts in systems])
+        if (len(edges) != 1) or (None in edges):
+            Logger.log("Phase abstraction not applicable to clock \"%s\""%clock, 1)
+            return None
+
+        (before, after) = edges.pop()
+        Logger.log("Phase abstraction on clock \"%s\" (%s -> %s)"%(clock, before, after), 1)
+
+        folded = []
+        aliases = set([])
+        for hts in systems:
+            (new_hts, hts_aliases) = PhaseAbstraction.fold(hts, clock, before, after)
+            folded.append(new_hts)
+            aliases |= hts_aliases
+
+        # all the clock wires are revised in the traces
+        abstract_clock_list = [(a, (before, after)) for a in sorted(aliases, key=lambda a: a.symbol_name())]
+        return (folded, abstract_clock_list)
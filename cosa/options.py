@@ -19,7 +19,7 @@ from typing import Dict
 from cosa.analyzers.mcsolver import get_verification_strategies
 from cosa.config import CosaArgParser
 from cosa.encoders.factory import ModelParsersFactory, GeneratorsFactory, ClockBehaviorsFactory, SyntacticSugarFactory
-from cosa.modifiers.factory import ModelModifiersFactory
+from cosa.modifiers.factory import ModelModifiersFactory, ModelPassesFactory
 from cosa.problem import VerificationType
 from cosa.printers.template import HTSPrinterType, TraceValuesBase
 from cosa.printers.factory import HTSPrintersFactory
@@ -145,6 +145,13 @@ for x in ModelModifiersFactory.get_modifiers():
 
 extra_info.append('\nModel modifiers:\n%s'%("\n".join(modifiers)))
 
+model_passes = []
+for x in ModelPassesFactory.get_passes():
+    wrapper.subsequent_indent = " "*(len(" - \"\": "+x.get_name()))
+    model_passes.append("\n".join(wrapper.wrap("\"%s\": %s"%(x.get_name(), x.get_desc()))))
+
+extra_info.append('\nModel passes:\n%s'%("\n".join(model_passes)))
+
 PROBLEM_FILE_INFO="""
 ========================================== Problem File Info ==========================================
 CoSA supports problem files (text files describing problem configurations). You can pass a problem file
@@ -197,17 +204,25 @@ cosa_option_manager = CosaArgParser(description=bold_text('CoSA: CoreIR Symbolic
 
 in_options = cosa_option_manager.add_general_group('input options')
 
-av_input_types = [" - \"%s\": %s"%(x.name, ", ".join(["*.%s"%e for e in x.extensions])) \
-                  for x in ModelParsersFactory.get_parsers() if x.is_available()]
+in_options.set_defaults(model_files=None)
+model_files_option = in_options.add_argument('-i', '--model_files', metavar='<model files>', type=str, required=False,
+                                             help='comma separated list of input files.')
+
+def model_files_help():
+    # loading all the parsers is only needed to print the help
+    parsers = ModelParsersFactory.get_parsers()
 
-ua_input_types = [" - \"%s\": %s"%(x.name, ", ".join(["*.%s"%e for e in x.extensions])) \
-                  for x in ModelParsersFactory.get_parsers() if not x.is_available()]
+    av_input_types = [" - \"%s\": %s"%(x.name, ", ".join(["*.%s"%e for e in x.extensions])) \
+                      for x in parsers if ModelParsersFactory.is_available(x)]
 
-in_options.set_defaults(model_files=None)
-in_options.add_argument('-i', '--model_files', metavar='<model files>', type=str, required=False,
-                        help='comma separated list of input files.\nSupported types:\n%s%s'%\
-                        ("\n".join(av_input_types), "\nNot enabled:\n%s"%("\n".join(ua_input_types)) \
-                         if len(ua_input_types) > 0 else ""))
+    ua_input_types = [" - \"%s\": %s"%(x.name, ", ".join(["*.%s"%e for e in x.extensions])) \
+                      for x in parsers if not ModelParsersFactory.is_available(x)]
+
+    model_files_option.help = 'comma separated list of input files.\nSupported types:\n%s%s'%\
+                              ("\n".join(av_input_types), "\nNot enabled:\n%s"%("\n".join(ua_input_types)) \
+                               if len(ua_input_types) > 0 else "")
+
+cosa_option_manager.add_help_callback(model_files_help)
 
 in_options.set_defaults(problems=None)
 in_options.add_argument('--problems', metavar='<problems file>', type=str, required=False,
@@ -220,6 +235,10 @@ general_solving_options.set_defaults(assume_if_true=False)
 general_solving_options.add_argument('--assume-if-true', dest='assume_if_true', action='store_true',
                         help="add true properties as assumptions. (Default is \"%s\")"%False)
 
+general_solving_options.set_defaults(cache_results=False)
+general_solving_options.add_argument('--cache-results', dest='cache_results', action='store_true',
+                        help="stores the results, and reuses them for problems with the same cone of influence. (Default is \"%s\")"%False)
+
 general_solving_options.set_defaults(skip_embedded=False)
 general_solving_options.add_argument('--skip-embedded', dest='skip_embedded', action='store_true',
                         help="don't solve embedded assertions. (Default is \"%s\")"%False)
@@ -261,6 +280,18 @@ general_encoding_options.add_argument('--init', type=Path,
                                       'See scripts/vcd2init.py for a convenient .vcd to .init converter\n'
                                       'Note: for Verilog input, this only works if running with --abstract-clock or --synchronize. See manual for more details')
 
+general_encoding_options.set_defaults(memories=None)
+general_encoding_options.add_argument('--memories', metavar='<memory encodings>', type=str, required=False,
+                                      help='comma separated list of encodings of the memories, either for all of them or as\n'
+                                      '<memory>=<encoding>, with encodings "arrays", "blast" (a variable for each location),\n'
+                                      '"abstract" (tracks the constant addresses that are read), "lemmas" (abstract, with\n'
+                                      'consistent reads), and "auto" (blasts the small memories and abstracts the others).\n'
+                                      '(Default is \"%s\")'%None)
+
+general_encoding_options.set_defaults(memory_blast_size=256)
+general_encoding_options.add_argument('--memory-blast-size', metavar='<locations>', type=int, required=False,
+                                      help='maximum number of locations of the memories blasted by the "auto" encoding. (Default is \"%s\")'%256)
+
 general_encoding_options.set_defaults(model_extension=None)
 general_encoding_options.add_argument('--model-extension', metavar='model_extension', type=str, nargs='?',
                         help='select the model modifier. (Default is \"%s\")'%(None))
@@ -274,6 +305,17 @@ general_encoding_options.set_defaults(opt_circuit=False)
 general_encoding_options.add_argument('--opt-circuit', action='store_true',
                         help='Use Yosys to optimize the circuit -- can remove signals.')
 
+general_encoding_options.set_defaults(phase_abstraction=False)
+general_encoding_options.add_argument('--phase-abstraction', dest='phase_abstraction', action='store_true',
+                                      help='folds the two phases of the clock when all the registers are triggered\n'
+                                      'on the same edge, and the problems have no next, prev or temporal operators.\n'
+                                      'The BMC length counts clock cycles instead of phases. (Default is \"%s\")'%False)
+
+general_encoding_options.set_defaults(passes=None)
+general_encoding_options.add_argument('--passes', metavar='<pass list>', type=str, required=False,
+                                      help='comma separated list of passes simplifying the flattened model,\n'
+                                      'e.g., "constants,aliases,strash,unused". (Default is \"%s\")'%None)
+
 general_encoding_options.set_defaults(run_coreir_passes=True)
 general_encoding_options.add_argument('--no-run-coreir-passes', dest='run_coreir_passes', action='store_false',
                                       help='does not run CoreIR passes. (Default is \"%s\")'%True)
@@ -308,11 +350,27 @@ general_results_options.set_defaults(force_expected=False)
 general_results_options.add_argument('--force-expected', action='store_true',
                                      help='Force the result to be the provided expected value')
 
+# General server options
+general_server_options = cosa_option_manager.add_general_group('server')
+
+general_server_options.set_defaults(server=None)
+general_server_options.add_argument('--server', metavar='<socket file or port>', type=str, required=False,
+                                    help='keeps the models in memory and solves the problems received on a Unix socket,\n'
+                                    'or on an HTTP port on localhost. (Default is \"%s\")'%None)
+general_server_options.set_defaults(watch=False)
+general_server_options.add_argument('--watch', action='store_true',
+                                    help='solves the problems again whenever the model or problem files change,\n'
+                                    'reusing the results of the problems whose cone of influence did not change. (Default is \"%s\")'%False)
+
 # Problem-specific processing options
 problem_processing_options = cosa_option_manager.add_problem_group('problem processing')
 problem_processing_options.set_defaults(simplify=False)
 problem_processing_options.add_argument('--simplify', action='store_true',
                                         help='simplify formulae with pysmt. (Default is \"%s\")'%False)
+problem_processing_options.set_defaults(functional_ftrans=False)
+problem_processing_options.add_argument('--functional-ftrans', action='store_true',
+                                        help='encodes the functional assignments as next-state functions, and substitutes the\n'
+                                        'combinational wires by their definitions. (Default is \"%s\")'%False)
 
 # Verification Options
 
@@ -379,19 +437,63 @@ ver_params.set_defaults(cardinality=5)
 ver_params.add_argument('--cardinality', dest='cardinality', type=int, required=False,
                         help="bounds number of active parameters. -1 is unbounded. (Default is \"%s\")"%5)
 
+ver_params.set_defaults(parametric_parallel=False)
+ver_params.add_argument('--parametric-parallel', dest='parametric_parallel', action='store_true',
+                        help="explores the parameter space of parametric problems in cubes using -j processes. (Default is \"%s\")"%False)
+
 ver_params.set_defaults(equal_to=None)
 ver_params.add_argument('--equal-to', required=False, type=str,
                         help='Model to check equivalence with (assumes common interface)')
 
+ver_params.set_defaults(sweeping=False)
+ver_params.add_argument('--sweeping', dest='sweeping', action='store_true',
+                        help="proves the equivalent signals of the two models by induction, and merges them before the equivalence check. (Default is \"%s\")"%False)
+
+ver_params.set_defaults(sweeping_sim=16)
+ver_params.add_argument('--sweeping-sim', metavar='<integer>', type=int, required=False,
+                        help="number of random simulation lanes finding the candidate equivalences, 0 to match them by name and structure. (Default is \"%s\")"%16)
+
 strategies = [" - \"%s\": %s"%(x[0], x[1]) for x in get_verification_strategies()]
 defstrategy = get_verification_strategies()[0][0]
 ver_params.set_defaults(strategy=defstrategy)
 ver_params.add_argument('--strategy', metavar='strategy', type=str, nargs='?',
                     help='select the BMC strategy between (Default is \"%s\"):\n%s'%(defstrategy, "\n".join(strategies)))
 
+ver_params.set_defaults(sim_inputs=None)
+ver_params.add_argument('--sim-inputs', metavar='<inputs file>', type=str, required=False,
+                        help='inputs for the concrete simulation, one line per step of comma separated assignments.')
+
+ver_params.set_defaults(sim_seed=0)
+ver_params.add_argument('--sim-seed', metavar='<integer>', type=int, required=False,
+                        help="seed of the random values in the concrete simulation. (Default is \"%s\")"%0)
+
+ver_params.set_defaults(replay=None)
+ver_params.add_argument('--replay', metavar='<trace file>', type=str, required=False,
+                        help='replays a counterexample (.txt or .vcd) on the model instead of solving the safety problem.')
+
+ver_params.set_defaults(validate_traces=False)
+ver_params.add_argument('--validate-traces', dest='validate_traces', action='store_true',
+                        help="replays the counterexamples found by the solver on the model, which are reported as unknown if not confirmed. (Default is \"%s\")"%False)
+
+ver_params.set_defaults(random_sim=0)
+ver_params.add_argument('--random-sim', metavar='<integer>', type=int, required=False,
+                        help="number of random simulation lanes run before the safety check, 0 to disable. (Default is \"%s\")"%0)
+
 ver_params.set_defaults(processes=int(multiprocessing.cpu_count()/2))
 ver_params.add_argument('-j', dest='processes', metavar="<integer level>", type=int,
-                        help="number of multi-processes for MULTI strategy. (Default is \"%s\")"%int(multiprocessing.cpu_count()/2))
+                        help="number of multi-processes for MULTI strategy and parallel parametric analysis. (Default is \"%s\")"%int(multiprocessing.cpu_count()/2))
+
+ver_params.set_defaults(time_limit=None)
+ver_params.add_argument('--time-limit', metavar='<seconds>', type=float, required=False,
+                        help="wall-clock budget of each problem, reported as unknown when exhausted. (Default is \"%s\")"%None)
+
+ver_params.set_defaults(solver_time_limit=None)
+ver_params.add_argument('--solver-time-limit', metavar='<seconds>', type=float, required=False,
+                        help="budget of time spent in the solver for each problem. (Default is \"%s\")"%None)
+
+ver_params.set_defaults(memory_limit=None)
+ver_params.add_argument('--memory-limit', metavar='<MB>', type=float, required=False,
+                        help="memory budget of each problem. (Default is \"%s\")"%None)
 
 ver_params.set_defaults(incremental=True)
 ver_params.add_argument('--incremental', action='store_true',
@@ -458,6 +560,15 @@ deb_params.set_defaults(time=False)
 deb_params.add_argument('--time', dest='time', action='store_true',
                         help="prints time for every verification. (Default is \"%s\")"%False)
 
+deb_params.set_defaults(profile=None)
+deb_params.add_argument('--profile', metavar='<prefix>', type=str, required=False,
+                        help="writes the time spent in each phase and the solver calls for every verification,\n"
+                        "in files with the given prefix. (Default is \"%s\")"%None)
+
+deb_params.set_defaults(profile_format="json")
+deb_params.add_argument('--profile-format', metavar='<format>', type=str, choices=["json", "chrome"],
+                        help="format of the profiling files, \"json\" or \"chrome\" trace events. (Default is \"%s\")"%"json")
+
 deb_params.set_defaults(devel=False)
 deb_params.add_argument('--devel', dest='devel', action='store_true',
                         help="enables developer mode. (Default is \"%s\")"%False)
@@ -480,6 +591,11 @@ devel_params.add_argument('--smt2-tracing', metavar='<smt-lib2 file>', type=str,
                           help='generates the smtlib2 tracing file for '
                           'each solver call.' if not devel else argparse.SUPPRESS)
 
+devel_params.set_defaults(smt2_tracing_async=False)
+devel_params.add_argument('--smt2-tracing-async', action='store_true',
+                          help='writes the smtlib2 tracing files from a separate thread. '
+                          '(Default is \"%s\")'%False if not devel else argparse.SUPPRESS)
+
 def solver_options_to_dict(solver_options:str)->Dict[str, str]:
     '''
     Takes a space-delimited list of key value pairs (delimited by ":") and turns it into a dictionary
@@ -20,7 +20,6 @@ from pysmt.shortcuts import And, Array, BOOL, FALSE, simplify, Symbol, Store, TR
 from pysmt.rewritings import conjunctive_partition
 
 from cosa.representation import TS
-from cosa.encoders.coreir import SEP
 from cosa.utils.generic import dec_to_bin, dec_to_hex
 from cosa.encoders.ltl import has_ltl_operators
 from cosa.environment import ExtHRPrinter
@@ -12,16 +12,18 @@ import datetime
 
 from six.moves import cStringIO
 
-from pysmt.shortcuts import BOOL
 
-from cosa.representation import TS
-from cosa.encoders.coreir import SEP
-from cosa.utils.generic import dec_to_bin, dec_to_hex, sort_system_variables
+from cosa.representation import TS, AT, ATP
+from cosa.utils.logger import Logger
+from cosa.encoders.modules import SEP
+from cosa.utils.generic import dec_to_bin, sort_system_variables
 from cosa.printers.template import TracePrinter, TraceValuesBase
 from cosa.problem import Trace
 
 NL = "\n"
 VCD_SEP = "-"
+VCD_FIRST_CHAR = 33
+VCD_CHARS = 94
 
 PRE_TRACE = "---> "
 POS_TRACE = " <---"
@@ -57,6 +59,23 @@ def revise_abstract_clock(model, abstract_clock_list):
 
     return (newmodel, length)
 
+def columnar_model(model, length):
+    """Returns a dictionary from variable name to the list of its values over time"""
+
+    columns = {}
+    for (var, value) in model.items():
+        name = var.symbol_name()
+        if (AT not in name) or (ATP in name):
+            continue
+        (name, t) = name.rsplit(AT, 1)
+        t = int(t)
+        if t > length:
+            continue
+        if name not in columns:
+            columns[name] = [None]*(length+1)
+        columns[name][t] = value
+    return columns
+
 class TextTracePrinter(TracePrinter):
 
     def __init__(self):
@@ -68,16 +87,31 @@ class TextTracePrinter(TracePrinter):
     def get_file_ext(self):
         return "txt"
 
+    def _formatter(self, var):
+        vtype = var.symbol_type()
+        if vtype.is_bv_type():
+            width = vtype.width
+            if self.values_base == TraceValuesBase.HEX:
+                (prefix, digits) = ("%d'h"%width, int(width/4))
+                return lambda value: prefix + ("%X"%value.constant_value()).zfill(digits)
+            if self.values_base == TraceValuesBase.BIN:
+                prefix = "%d'b"%width
+                return lambda value: prefix + ("{0:b}".format(value.constant_value())).zfill(width)
+        return str
+
     def print_trace(self, hts, model, length, map_function=None, find_loop=False, abstract_clock_list=None):
         abstract_clock = (abstract_clock_list is not None) and (len(abstract_clock_list) > 0)
         if abstract_clock:
             (model, length) = revise_abstract_clock(model, abstract_clock_list)
 
-        trace = []
-        prevass = []
+        trace = Trace(None, length)
+        trace.writer = lambda stream: self.write_trace(stream, hts, model, length, map_function, find_loop)
+        trace.human_readable = True
+        return trace
 
-        # Initial state printing
-        trace.append("%sINIT%s"%(PRE_TRACE, POS_TRACE))
+    def write_trace(self, stream, hts, model, length, map_function=None, find_loop=False):
+        if map_function is None:
+            map_function = lambda x: x
 
         if self.all_vars:
             varlist = list(hts.vars)
@@ -86,59 +120,88 @@ class TextTracePrinter(TracePrinter):
             if self.prop_vars is not None:
                 varlist = list(set(varlist).union(set(self.prop_vars)))
 
-        strvarlist = [(map_function(var[0]), var[1]) for var in sort_system_variables(varlist, True) if not self.is_hidden(var[0])]
+        columns = columnar_model(model, length)
+        empty = [None]*(length+1)
 
-        for var in strvarlist:
-            var_0 = TS.get_timed(var[1], 0)
-            if var_0 not in model:
-                prevass.append((var[0], None))
-                continue
-            varass = (var[0], model[var_0])
-            if (self.values_base == TraceValuesBase.HEX) and (var[1].symbol_type().is_bv_type()):
-                varass = (varass[0], "%d'h%s"%(var[1].symbol_type().width, dec_to_hex(varass[1].constant_value(), int(var[1].symbol_type().width/4))))
-            if (self.values_base == TraceValuesBase.BIN) and (var[1].symbol_type().is_bv_type()):
-                varass = (varass[0], "%d'b%s"%(var[1].symbol_type().width, dec_to_bin(varass[1].constant_value(), int(var[1].symbol_type().width))))
-            if self.diff_only: prevass.append(varass)
-            trace.append("  I: %s = %s"%(varass[0], varass[1]))
+        # (printed name, values over time, formatter) for each variable
+        signals = [(map_function(name), columns.get(name, empty), self._formatter(var)) \
+                   for (name, var) in sort_system_variables(varlist, True) if not self.is_hidden(name)]
 
-        if self.diff_only: prevass = dict(prevass)
+        # Initial state printing
+        stream.write("%sINIT%s"%(PRE_TRACE, POS_TRACE))
+        for (name, values, formatter) in signals:
+            if values[0] is not None:
+                stream.write("\n  I: %s = %s"%(name, formatter(values[0])))
 
         # Success state printing
-
-        for t in range(length):
-            trace.append("\n%s%s %d%s"%(PRE_TRACE, STATE, t+1, POS_TRACE))
-
-            for var in strvarlist:
-                var_t = TS.get_timed(var[1], t+1)
-                if var_t not in model:
+        previous = [values[0] for (_, values, _) in signals]
+        for t in range(1, length+1):
+            stream.write("\n\n%s%s %d%s"%(PRE_TRACE, STATE, t, POS_TRACE))
+            for (i, (name, values, formatter)) in enumerate(signals):
+                value = values[t]
+                if value is None:
                     continue
-                varass = (var[0], model[var_t])
-                if (self.values_base == TraceValuesBase.HEX) and (var[1].symbol_type().is_bv_type()):
-                    varass = (varass[0], "%d'h%s"%(var[1].symbol_type().width, dec_to_hex(varass[1].constant_value(), int(var[1].symbol_type().width/4))))
-                if (self.values_base == TraceValuesBase.BIN) and (var[1].symbol_type().is_bv_type()):
-                    varass = (varass[0], "%d'b%s"%(var[1].symbol_type().width, dec_to_bin(varass[1].constant_value(), int(var[1].symbol_type().width))))
-                if (not self.diff_only) or (prevass[varass[0]] != varass[1]):
-                    trace.append("  S%s: %s = %s"%(t+1, varass[0], varass[1]))
-                    if self.diff_only: prevass[varass[0]] = varass[1]
+                if self.diff_only:
+                    if value == previous[i]:
+                        continue
+                    previous[i] = value
+                stream.write("\n  S%d: %s = %s"%(t, name, formatter(value)))
 
         if find_loop:
-            last_state = [(var[0], model[TS.get_timed(var[1], length)]) for var in strvarlist]
-            last_state.sort()
-            loop_id = -1
-            for i in range(length):
-                state_i = [(var[0], model[TS.get_timed(var[1], i)]) for var in strvarlist]
-                state_i.sort()
-                if state_i == last_state:
-                    loop_id = i
-                    break
+            # the loop starts from the first state equal to the last one,
+            # comparing all the variables of the model, including the state
+            states = [columns[name] for name in sorted(columns)]
+            first_seen = {}
+            for t in range(length-1, -1, -1):
+                first_seen[tuple([values[t] for values in states])] = t
+            loop_id = first_seen.get(tuple([values[length] for values in states]), -1)
             if loop_id >= 0:
                 end = ("STATE %s"%loop_id) if loop_id > 0 else "INIT"
-                trace.append("\n---> %s (Loop) <---"%(end))
+                stream.write("\n\n---> %s (Loop) <---"%(end))
+
+def _vcd_code(idvar):
+    # identifiers are the shortest strings over the printable ASCII characters
+    code = []
+    idvar += 1
+    while idvar > 0:
+        idvar -= 1
+        code.append(chr(VCD_FIRST_CHAR + (idvar % VCD_CHARS)))
+        idvar = idvar // VCD_CHARS
+    return "".join(code)
+
+def _recover_array(array_model):
+    # arrays are represented as a tuple of FNodes with
+    # (previous, key, value, key, value, ...)
+    # where previous can itself be another array
+    args = array_model.args()
+    # populate a stack of values to process
+    stack = []
+    while len(args) > 1:
+        assert len(args)%2 == 1
+        stack.append(args[1:])
+        if not args[0].is_constant():
+            args = args[0].args()
+        else:
+            args = [args[0]]
+            break
 
-        strtrace = NL.join(trace)
-        trace = Trace(strtrace, length)
-        trace.human_readable = True
-        return trace
+    symbolic_default = args[0]
+    if symbolic_default.get_type().is_array_type():
+        symbolic_default = symbolic_default.array_value_default()
+        if symbolic_default.get_type().is_array_type():
+            Logger.error("Nested arrays are not supported in VCD output yet")
+
+    assert symbolic_default.is_constant()
+    default_val = symbolic_default.constant_value()
+
+    assignments = dict()
+    while stack:
+        args = stack.pop()
+        for a, v in zip([a.constant_value() for a in args[0::2]],
+                        [v.constant_value() for v in args[1::2]]):
+            assignments[a] = v
+
+    return (default_val, assignments)
 
 class VCDTracePrinter(TracePrinter):
 
@@ -151,160 +214,113 @@ class VCDTracePrinter(TracePrinter):
         return "vcd"
 
     def print_trace(self, hts, model, length, map_function=None, abstract_clock_list=None):
+        trace = Trace(None, length)
+        trace.writer = lambda stream: self.write_trace(stream, hts, model, length, map_function, abstract_clock_list)
+        return trace
+
+    def write_trace(self, stream, hts, model, length, map_function=None, abstract_clock_list=None):
         abstract_clock = (abstract_clock_list is not None) and (len(abstract_clock_list) > 0)
 
         if abstract_clock:
             (model, length) = revise_abstract_clock(model, abstract_clock_list)
 
-        ret = []
-
-        ret.append("$date")
-        ret.append(datetime.datetime.now().strftime('%A %Y/%m/%d %H:%M:%S'))
-        ret.append("$end")
-        ret.append("$version")
-        ret.append("CoSA")
-        ret.append("$end")
-        ret.append("$timescale")
-        ret.append("1 ns")
-        ret.append("$end")
-
-        def _recover_array(array_model):
-            # arrays are represented as a tuple of FNodes with
-            # (previous, key, value, key, value, ...)
-            # where previous can itself be another array
-            args = array_model.args()
-            # populate a stack of values to process
-            stack = []
-            while len(args) > 1:
-                assert len(args)%2 == 1
-                stack.append(args[1:])
-                if not args[0].is_constant():
-                    args = args[0].args()
-                else:
-                    args = [args[0]]
-                    break
-
-            symbolic_default = args[0]
-            if symbolic_default.get_type().is_array_type():
-                symbolic_default = symbolic_default.array_value_default()
-                if symbolic_default.get_type().is_array_type():
-                    Logger.error("Nested arrays are not supported in VCD output yet")
-
-            assert symbolic_default.is_constant()
-            default_val = symbolic_default.constant_value()
-
-            assignments = dict()
-            while stack:
-                args = stack.pop()
-                for a, v in zip([a.constant_value() for a in args[0::2]],
-                                [v.constant_value() for v in args[1::2]]):
-                    assignments[a] = v
-
-            if self.all_vars:
-                assignments[ALLIDX] = default_val
-            return assignments
-
-        model = dict([(v.symbol_name(), model[v].constant_value()
-                          if not v.symbol_type().is_array_type()
-                          else _recover_array(model[v])) for v in model])
-
-        # These are the pysmt array vars
-        arr_vars = list(filter(lambda v: v.symbol_type().is_array_type(), hts.vars))
-
-        # Figure out which indices are used over all time
-        arr_used_indices = {}
-        for av in arr_vars:
-            name = av.symbol_name()
-            indices = set()
-            for t in range(length+1):
-                tname = TS.get_timed_name(map_function(name), t)
-                if tname in model:
-                    indices |= set((k for k in model[tname] if k != ALLIDX))
-            arr_used_indices[name] = indices
-
-        # These are the vcd vars (Arrays get blown out)
-        varlist = []
-        arr_varlist = []
-        idvar = 0
-        var2id = {}
+        if map_function is None:
+            map_function = lambda x: x
+
+        def value_at(var, t):
+            value = model.get(TS.get_timed(var, t), None)
+            if value is None:
+                return None
+            if var.symbol_type().is_array_type():
+                return _recover_array(value)
+            return value.constant_value()
+
+        # signals are (name, width, var, index), where index is None for
+        # scalars, an array index, or ALLIDX for the default of the array
+        signals = []
         for v in sort_system_variables(hts.vars):
-            n = map_function(v.symbol_name())
             if self.is_hidden(v.symbol_name()):
                 continue
-            if v.symbol_type() == BOOL:
-                varlist.append((n, 1))
-                var2id[n] = idvar
-                idvar += 1
-            elif v.symbol_type().is_bv_type():
-                varlist.append((n, v.symbol_type().width))
-                var2id[n] = idvar
-                idvar += 1
-            elif v.symbol_type().is_array_type():
-                idxtype = v.symbol_type().index_type
-                elemtype = v.symbol_type().elem_type
-                if self.all_vars and idxtype.is_bv_type():
-                    idxrange = range(2**idxtype.width)
-                else:
-                    idxrange = arr_used_indices[n]
-                for idx in idxrange:
-                    indexed_name = n + "[%i]"%idx
-                    arr_varlist.append((indexed_name, elemtype.width))
-                    var2id[indexed_name] = idvar
-                    idvar += 1
+            n = map_function(v.symbol_name())
+            vtype = v.symbol_type()
+            if vtype.is_bool_type():
+                signals.append((n, 1, v, None))
+            elif vtype.is_bv_type():
+                signals.append((n, vtype.width, v, None))
+            elif vtype.is_array_type():
+                # only the indices used in the trace are printed
+                indices = set([])
+                for t in range(length+1):
+                    value = value_at(v, t)
+                    if value is not None:
+                        indices |= set(value[1].keys())
+                width = vtype.elem_type.width
+                if self.all_vars:
+                    signals.append((n + "[%s]"%ALLIDX, width, v, ALLIDX))
+                for idx in sorted(indices):
+                    signals.append((n + "[%i]"%idx, width, v, idx))
             else:
                 Logger.error("Unhandled type in VCD printer")
 
-        ret.append("$scope module top $end")
-        for el in varlist + arr_varlist:
-            (varname, width) = el
-            idvar = var2id[varname]
+        stream.write("$date\n%s\n$end\n"%(datetime.datetime.now().strftime('%A %Y/%m/%d %H:%M:%S')))
+        stream.write("$version\nCoSA\n$end\n")
+        stream.write("$timescale\n1 ns\n$end\n")
 
+        # declarations are grouped by scope
+        declarations = []
+        for (idvar, (name, width, _, _)) in enumerate(signals):
             if self.hierarchical:
-                varname = varname.split(SEP)
-                for scope in varname[:-1]:
-                    ret.append("$scope module %s $end"%scope)
-
-                ret.append("$var reg %d v%s %s[%d:0] $end"%(width, idvar, varname[-1], width-1))
-
-                for scope in range(len(varname)-1):
-                    ret.append("$upscope $end")
+                path = name.split(SEP)
+                declarations.append((path[:-1], path[-1], width, _vcd_code(idvar)))
             else:
-                varname = varname.replace(SEP, VCD_SEP)
-                ret.append("$var reg %d v%s %s[%d:0] $end"%(width, idvar, varname, width-1))
-
-
-        ret.append("$upscope $end")
-        ret.append("$enddefinitions $end")
-
+                declarations.append(([], name.replace(SEP, VCD_SEP), width, _vcd_code(idvar)))
+        declarations.sort(key=lambda d: d[0])
+
+        stream.write("$scope module top $end\n")
+        scopes = []
+        for (path, name, width, code) in declarations:
+            common = 0
+            while (common < min(len(scopes), len(path))) and (scopes[common] == path[common]):
+                common += 1
+            for scope in scopes[common:]:
+                stream.write("$upscope $end\n")
+            for scope in path[common:]:
+                stream.write("$scope module %s $end\n"%scope)
+            scopes = path
+            stream.write("$var reg %d %s %s[%d:0] $end\n"%(width, code, name, width-1))
+        for scope in scopes:
+            stream.write("$upscope $end\n")
+        stream.write("$upscope $end\n")
+        stream.write("$enddefinitions $end\n")
+
+        # only the changes are printed after the first timestep
+        previous = [None]*len(signals)
+        codes = [_vcd_code(idvar) for idvar in range(len(signals))]
         for t in range(length+1):
-            ret.append("#%d"%t)
-            for el in varlist:
-                (varname, width) = el
-                tname = TS.get_timed_name(varname, t)
-                val = model[tname] if tname in model else 0
-                ret.append("b%s v%s"%(dec_to_bin(val, width), var2id[varname]))
-
-            for a in arr_vars:
-                name = a.symbol_name()
-                width = a.symbol_type().elem_type.width
-                tname = TS.get_timed_name(name, t)
-                if self.all_vars:
-                    m = model[tname]
-                    for i in set(range(2**a.symbol_type().index_type.width)) - m.keys():
-                        vcdname = name + "[%i]"%i
-                        ret.append("b%s v%s"%(dec_to_bin(m[ALLIDX],width),var2id[vcdname]))
-                    del m[ALLIDX]
-                    for i, v in m.items():
-                        vcdname = name + "[%i]"%i
-                        ret.append("b%s v%s"%(dec_to_bin(v,width),var2id[vcdname]))
-                elif tname in model:
-                    for i, v in model[tname].items():
-                        vcdname = name + "[%i]"%i
-                        ret.append("b%s v%s"%(dec_to_bin(v,width),var2id[vcdname]))
+            stream.write("#%d\n"%t)
+            values = {}
+            for (idvar, (_, width, var, index)) in enumerate(signals):
+                if var not in values:
+                    values[var] = value_at(var, t)
+                value = values[var]
+                if index is not None:
+                    if value is not None:
+                        (default, assignments) = value
+                        value = default if index == ALLIDX else assignments.get(index, default)
+                    elif previous[idvar] is not None:
+                        continue
+                if value is None:
+                    value = 0
+                value = int(value)
+                if value == previous[idvar]:
+                    continue
+                previous[idvar] = value
+                if width == 1:
+                    stream.write("%d%s\n"%(value, codes[idvar]))
+                else:
+                    stream.write("b%s %s\n"%(dec_to_bin(value, width), codes[idvar]))
 
         # make the last time step visible
         # also important for correctness, gtkwave sometimes doesn't read the
         # last timestep's values correctly without this change
-        ret.append("#%d"%(t+1))
-
-        return Trace(NL.join(ret), length)
+        stream.write("#%d\n"%(length+1))
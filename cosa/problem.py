@@ -13,6 +13,7 @@ import configparser
 import copy
 from itertools import count
 from pathlib import Path
+from six.moves import cStringIO
 from typing import Any, Dict, List, NamedTuple, Optional, Set, Sequence, Union
 
 # for type hints
@@ -107,6 +108,10 @@ class ProblemsManager:
         self._problems_time         = dict()
         # region for parametric model checking
         self._problems_region       = dict()
+        # deepest k explored by unknown problems
+        self._problems_depth        = dict()
+        # exhausted budget of the problems stopped early
+        self._problems_exhausted    = dict()
 
         # The main Hierarchical Transition System that all problems are run on
         self._hts                   = None
@@ -264,6 +269,18 @@ class ProblemsManager:
     def get_problem_region(self, problem:NamedTuple)->Optional[List[FNode]]:
         return self._problems_region[problem.idx]
 
+    def set_problem_depth(self, problem:NamedTuple, k:Optional[int])->None:
+        self._problems_depth[problem.idx] = k
+
+    def get_problem_depth(self, problem:NamedTuple)->Optional[int]:
+        return self._problems_depth.get(problem.idx, problem.bmc_length)
+
+    def set_problem_exhausted(self, problem:NamedTuple, budget:str)->None:
+        self._problems_exhausted[problem.idx] = budget
+
+    def get_problem_exhausted(self, problem:NamedTuple)->Optional[str]:
+        return self._problems_exhausted.get(problem.idx)
+
     def add_second_model(self, problem:NamedTuple, hts:HTS):
         self._problems_second_model[problem.idx] = hts
 
@@ -309,13 +326,24 @@ class Trace(object):
     infinite = False
     human_readable = False
     prop_vars = None
+    writer = None
 
     def __init__(self, strtrace=None, length=None):
         self.strtrace = strtrace
         self.length = length
 
+    def write(self, stream):
+        if self.writer is not None:
+            self.writer(stream)
+        else:
+            stream.write(str(self.strtrace))
+
     def __repr__(self):
-        return str(self.strtrace)
+        return self.__str__()
 
     def __str__(self):
+        if self.writer is not None:
+            stream = cStringIO()
+            self.writer(stream)
+            return stream.getvalue()
         return str(self.strtrace)
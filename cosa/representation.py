@@ -9,9 +9,11 @@
 # limitations under the License.
 
 from pysmt.shortcuts import Symbol, And, Or, TRUE, simplify, EqualsOrIff, get_env, get_type, Implies, Not, Ite
+from pysmt.rewritings import conjunctive_partition
 
 from cosa.utils.formula_mngm import get_free_variables, substitute
 from cosa.utils.logger import Logger
+from cosa.utils.profiler import Profiler
 
 NEXT = "__N"
 PREV = "__P"
@@ -25,6 +27,14 @@ L_BV = "QF_BV"
 FLATTEN = "FLATTEN"
 LINKS = FLATTEN+"_LINKS"
 
+INIT = "init"
+TRANS = "trans"
+INVAR = "invar"
+FTRANS = "ftrans"
+ASSUMPTIONS = "assumptions"
+FORMULA_PARTS = [INIT, TRANS, INVAR, FTRANS, ASSUMPTIONS]
+DEFINITIONS = "definitions"
+
 apply_prefix = lambda name, prefix: ".".join(name.split(".")[:-1]+[prefix+name.split(".")[-1]]) if prefix not in name else name
 
 class HTS(object):
@@ -49,8 +59,18 @@ class HTS(object):
     _s_ftrans = None
     _s_invar = None
 
+    _a_source = None
+    _a_invar = None
+    _a_trans = None
+    _versions = None
+    _composed = None
+
+    eliminated = None
+    concrete = None
+
     logic = None
     en_simplify = False
+    functional = False
     is_flatten = False
 
     def __init__(self, name=""):
@@ -73,8 +93,23 @@ class HTS(object):
         self._s_ftrans_i = None
         self._s_invar = None
 
+        # assumptions partitioned into invariants and transitions
+        self._a_source = None
+        self._a_invar = []
+        self._a_trans = []
+
+        # the single formulae are rebuilt only if the version of their parts changed
+        self._versions = dict([(part, 0) for part in FORMULA_PARTS])
+        self._composed = {}
+
         self.logic = L_BV
         self.en_simplify = False
+        self.functional = False
+
+        # variables removed by the model passes, with their definitions
+        self.eliminated = {}
+        # system with the concrete memories, when they are abstracted
+        self.concrete = None
 
         self._pysmt_formula_mngr = get_env().formula_manager
 
@@ -100,13 +135,6 @@ class HTS(object):
         self.output_vars = set([])
         self.hidden_vars = set([])
 
-        self._s_init = None
-        self._s_trans = None
-        self._s_ftrans_t = None
-        self._s_ftrans_i = None
-        self._s_ftrans = None
-        self._s_invar = None
-
         self.assumptions = p_assumptions
         self.lemmas = p_lemmas
         self.params = p_params
@@ -148,6 +176,10 @@ class HTS(object):
             self.logic = L_ABV
 
     def add_ts(self, ts, add_vars=True, reset=True):
+        # systems added after the model passes refer to the removed variables by their definitions
+        if self.eliminated:
+            self._apply_eliminated(ts)
+
         if self.en_simplify:
             ts.init = simplify(ts.init)
             ts.invar = simplify(ts.invar)
@@ -190,6 +222,23 @@ class HTS(object):
 
             self.reset_formulae(init=init, invar=invar, trans=trans, ftrans=ftrans)
 
+    def _apply_eliminated(self, ts):
+        apply = lambda f: None if f is None else f.substitute(HTS.definition_map(self.eliminated, f))
+        ts.init = apply(ts.init)
+        ts.trans = apply(ts.trans)
+        ts.invar = apply(ts.invar)
+        if ts.ftrans is not None:
+            ts.ftrans = dict([(var, [(apply(c), apply(a)) for (c, a) in cond_assign_list]) \
+                              for (var, cond_assign_list) in ts.ftrans.items()])
+
+    def eliminated_ts(self):
+        """System defining the variables removed by the model passes"""
+
+        ts = TS("Eliminated variables")
+        ts.vars = set(self.eliminated)
+        ts.invar = And([EqualsOrIff(var, expr) for (var, expr) in self.eliminated.items()])
+        return ts
+
     def remove_ts(self, name):
         self.tss = set([ts for ts in self.tss if name not in ts.comment])
 
@@ -199,8 +248,34 @@ class HTS(object):
         if self.assumptions is None:
             self.assumptions = set([])
 
+        if assumption in self.assumptions:
+            return
+
         self.assumptions.add(assumption)
 
+        if self._a_source is self.assumptions:
+            self._partition_assumption(assumption)
+            self._versions[ASSUMPTIONS] += 1
+
+    def _partition_assumption(self, assumption):
+        if TS.has_next(assumption):
+            self._a_trans.append(assumption)
+        else:
+            self._a_invar.append(assumption)
+
+    def _assumption_partitions(self):
+        # assumptions replaced or cleared from outside are partitioned again
+        if self._a_source is not self.assumptions:
+            self._a_source = self.assumptions
+            self._a_invar = []
+            self._a_trans = []
+            if self.assumptions is not None:
+                for assumption in self.assumptions:
+                    self._partition_assumption(assumption)
+            self._versions[ASSUMPTIONS] += 1
+
+        return (self._a_invar, self._a_trans)
+
     def add_lemma(self, lemma):
         if self.lemmas is None:
             self.lemmas = set([])
@@ -214,38 +289,235 @@ class HTS(object):
         for ts in self.tss:
             ts.remove_invar()
 
-    def single_init(self, rebuild=False):
-        if (self._s_init is None) or rebuild:
-            self._s_init = TRUE()
+    def _flat_and(self, formulae):
+        conjuncts = []
+        for formula in formulae:
+            if formula.is_and():
+                conjuncts += formula.args()
+            elif formula != TRUE():
+                conjuncts.append(formula)
+
+        return And(list(dict.fromkeys(conjuncts)))
+
+    def _compose(self, key, parts, build):
+        stamp = tuple([self._versions[part] for part in parts])
+        if (key not in self._composed) or (self._composed[key][0] != stamp):
+            self._composed[key] = (stamp, build())
+
+        return self._composed[key][1]
+
+    def _compile_ftrans(self):
+        # ftrans is compiled once for both invar and trans
+        if self._s_ftrans_i is None:
+            self._s_ftrans_i = []
+            self._s_ftrans_t = []
             for ts in self.tss:
-                init = ts.init
-                if init is not None:
-                    self._s_init = And(self._s_init, init)
+                ftrans = ts.compile_ftrans(self.functional)
+                if ftrans is not None:
+                    self._s_ftrans_i.append(ftrans[0])
+                    self._s_ftrans_t.append(ftrans[1])
 
+        return (self._s_ftrans_i, self._s_ftrans_t)
+
+    def _init_parts(self):
+        if self._s_init is None:
+            self._s_init = [ts.init for ts in self.tss if ts.init is not None]
         return self._s_init
 
+    def _trans_parts(self):
+        if self._s_trans is None:
+            self._s_trans = [ts.trans for ts in self.tss if ts.trans is not None]
+        return self._s_trans
+
+    def _invar_parts(self):
+        if self._s_invar is None:
+            self._s_invar = [ts.invar for ts in self.tss if ts.invar is not None]
+        return self._s_invar
+
+    def set_functional(self, functional):
+        """Encodes ftrans as next-state functions, and substitutes the combinational wires by their definitions"""
+
+        if self.functional != functional:
+            self.functional = functional
+            self._invalidate(ftrans=True)
+
+    @staticmethod
+    def _definition(conjunct, candidates, defs):
+        if not (conjunct.is_equals() or conjunct.is_iff()):
+            return None
+
+        (left, right) = conjunct.args()
+        for (var, expr) in [(left, right), (right, left)]:
+            if (var not in candidates) or (var in defs):
+                continue
+            expr_vars = get_free_variables(expr)
+            if (var in expr_vars) or any([TS.is_prime(v) or TS.is_prev(v) for v in expr_vars]):
+                continue
+            return (var, expr)
+
+        return None
+
+    @staticmethod
+    def find_definitions(conjuncts, candidates):
+        """Finds the candidates defined by equalities in the conjuncts.
+
+        Returns the definitions in terms of the variables that are not
+        defined, and the defining conjuncts. The definitions closing a cycle
+        are kept as constraints.
+        """
+
+        defs = {}
+        for conjunct in conjuncts:
+            definition = HTS._definition(conjunct, candidates, defs)
+            if definition is not None:
+                defs[definition[0]] = (definition[1], conjunct)
+
+        deps = dict([(var, [v for v in get_free_variables(expr) if v in defs]) for (var, (expr, _)) in defs.items()])
+
+        order = []
+        cut = set([])
+        visited = set([])
+        for root in defs:
+            if root in visited:
+                continue
+            visited.add(root)
+            stack = [(root, iter(deps[root]))]
+            while stack:
+                (var, children) = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    order.append(var)
+                elif child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(deps[child])))
+                elif child not in order:
+                    cut.add(child)
+
+        # definitions are substituted in dependency order, sharing the subterms
+        wires = {}
+        defining = set([])
+        for var in order:
+            if var in cut:
+                continue
+            (expr, conjunct) = defs[var]
+            wires[var] = expr.substitute(wires) if deps[var] else expr
+            defining.add(conjunct)
+
+        return (wires, defining)
+
+    @staticmethod
+    def definition_map(definitions, formula):
+        """Substitution of the defined variables, including their next and previous values in the formula"""
+
+        subs = {}
+        for var in get_free_variables(formula):
+            ref_var = TS.get_ref_var(var)
+            if ref_var not in definitions:
+                continue
+            if TS.is_prime(var):
+                subs[var] = TS.to_next(definitions[ref_var])
+            elif TS.is_prev(var):
+                subs[var] = TS.to_prev(definitions[ref_var])
+            else:
+                subs[var] = definitions[ref_var]
+
+        return subs
+
+    def _build_definitions(self):
+        with Profiler.span("definitions"):
+            (ftrans_i, ftrans_t) = self._compile_ftrans()
+
+            # combinational wires defined by the invariants
+            conjuncts = conjunctive_partition(self._flat_and(self._invar_parts() + ftrans_i))
+            (wires, defining) = HTS.find_definitions(conjuncts, self.vars - self.state_vars - self.input_vars)
+
+            # next-state functions of the functional assignments
+            nexts = {}
+            for conjunct in conjunctive_partition(self._flat_and(ftrans_t)):
+                if not conjunct.is_equals() and not conjunct.is_iff():
+                    continue
+                (var, expr) = conjunct.args()
+                if var.is_symbol() and TS.is_prime(var) and (var not in nexts) and (not TS.has_next(expr)):
+                    nexts[var] = (expr.substitute(wires), conjunct)
+
+        return (wires, nexts, defining)
+
+    def _definitions(self):
+        return self._compose(DEFINITIONS, [INVAR, FTRANS], self._build_definitions)
+
+    def definitions(self):
+        """Variables removed by the model passes and by the functional encoding, with their definitions"""
+
+        if not self.functional:
+            return dict(self.eliminated)
+
+        wires = self._definitions()[0]
+        if not self.eliminated:
+            return wires
+
+        definitions = dict(wires)
+        definitions.update([(var, expr.substitute(wires)) for (var, expr) in self.eliminated.items()])
+        return definitions
+
+    def apply_definitions(self, formula, next_functions=False):
+        """Substitutes the removed variables, and optionally the next-state variables, by their definitions"""
+
+        if self.eliminated:
+            formula = formula.substitute(HTS.definition_map(self.eliminated, formula))
+
+        if not self.functional:
+            return formula
+
+        (wires, nexts, defining) = self._definitions()
+
+        subs = HTS.definition_map(wires, formula)
+        subs_next = subs
+        if next_functions:
+            subs_next = dict(subs)
+            subs_next.update([(var, expr) for (var, (expr, _)) in nexts.items()])
+        functions = set([conjunct for (_, conjunct) in nexts.values()])
+
+        conjuncts = []
+        for conjunct in conjunctive_partition(formula):
+            if conjunct in defining:
+                continue
+            # the next-state functions still define the next value of the registers
+            conjuncts.append(conjunct.substitute(subs if conjunct in functions else subs_next))
+
+        return And(conjuncts)
+
+    def single_init(self, rebuild=False):
+        if rebuild:
+            self._invalidate(init=True)
+
+        s_init = self._init_parts()
+
+        if self.functional:
+            return self._compose((INIT, True), FORMULA_PARTS, \
+                                 lambda: self.apply_definitions(self._flat_and(s_init)))
+
+        return self._compose(INIT, [INIT], lambda: self._flat_and(s_init))
+
     def single_trans(self, rebuild=False, include_ftrans=True):
-        if (self._s_trans is None) or (rebuild):
-            self._s_trans = TRUE()
-            self._s_ftrans_t = TRUE()
-            for ts in self.tss:
-                ftrans = ts.compile_ftrans()
-                if ftrans is not None:
-                    self._s_ftrans_t = And(self._s_ftrans_t, ftrans[1])
-                trans = ts.trans
-                if trans is not None:
-                    self._s_trans = And(self._s_trans, trans)
+        if rebuild:
+            self._invalidate(trans=True, ftrans=True)
 
-        atrans = TRUE()
-        ftrans = TRUE()
+        s_trans = self._trans_parts()
+        a_trans = self._assumption_partitions()[1]
 
-        if self.assumptions is not None:
-            atrans = And([a for a in self.assumptions if TS.has_next(a)])
+        if not include_ftrans:
+            build = lambda: self._flat_and(s_trans + a_trans)
+            parts = [TRANS, ASSUMPTIONS]
+        else:
+            build = lambda: self._flat_and(s_trans + self._compile_ftrans()[1] + a_trans)
+            parts = [TRANS, FTRANS, ASSUMPTIONS]
 
-        if include_ftrans and (self._s_ftrans_t is not None):
-            ftrans = self._s_ftrans_t
+        if self.functional:
+            return self._compose((TRANS, include_ftrans, True), FORMULA_PARTS, \
+                                 lambda: self.apply_definitions(build(), next_functions=True))
 
-        return And(self._s_trans, ftrans, atrans)
+        return self._compose((TRANS, include_ftrans), parts, build)
 
     def single_ftrans(self, rebuild=False):
         if (self._s_ftrans is None) or (rebuild):
@@ -258,49 +530,49 @@ class HTS(object):
         return self._s_ftrans
 
     def single_invar(self, rebuild=False, include_ftrans=True):
-        if (self._s_invar is None) or (rebuild):
-            self._s_invar = TRUE()
-            self._s_ftrans_i = TRUE()
-            for ts in self.tss:
-                finvar = ts.compile_ftrans()
-                if finvar is not None:
-                    self._s_ftrans_i = And(self._s_ftrans_i, finvar[0])
-                invar = ts.invar
-                if invar is not None:
-                    self._s_invar = And(self._s_invar, invar)
+        if rebuild:
+            self._invalidate(invar=True, ftrans=True)
 
-        ainvar = TRUE()
-        ftrans = TRUE()
+        s_invar = self._invar_parts()
+        a_invar = self._assumption_partitions()[0]
 
-        if self.assumptions is not None:
-            ainvar = And([a for a in self.assumptions if not TS.has_next(a)])
+        if not include_ftrans:
+            build = lambda: self._flat_and(s_invar + a_invar)
+            parts = [INVAR, ASSUMPTIONS]
+        else:
+            build = lambda: self._flat_and(s_invar + self._compile_ftrans()[0] + a_invar)
+            parts = [INVAR, FTRANS, ASSUMPTIONS]
 
-        if include_ftrans and (self._s_ftrans_i is not None):
-            ftrans = self._s_ftrans_i
+        if self.functional:
+            return self._compose((INVAR, include_ftrans, True), FORMULA_PARTS, \
+                                 lambda: self.apply_definitions(build()))
 
-        return And(self._s_invar, ftrans, ainvar)
+        return self._compose((INVAR, include_ftrans), parts, build)
 
-    def reset_formulae(self, init=True, invar=True, trans=True, ftrans=True):
+    def _invalidate(self, init=False, invar=False, trans=False, ftrans=False):
         if init:
             self._s_init = None
+            self._versions[INIT] += 1
         if trans:
             self._s_trans = None
+            self._versions[TRANS] += 1
         if ftrans:
             self._s_ftrans_t = None
             self._s_ftrans_i = None
             self._s_ftrans = None
+            self._versions[FTRANS] += 1
         if invar:
             self._s_invar = None
+            self._versions[INVAR] += 1
+
+    def reset_formulae(self, init=True, invar=True, trans=True, ftrans=True):
+        self._invalidate(init, invar, trans, ftrans)
 
         for sub in self.subs:
             sub[2].reset_formulae(init, invar, trans, ftrans)
 
     def reset_flatten(self):
         self.is_flatten = False
-        self._s_init = None
-        self._s_invar = None
-        self._s_trans = None
-        self._s_ftrans = None
 
         self.remove_ts(FLATTEN)
 
@@ -327,6 +599,8 @@ class HTS(object):
         for v in other_hts.vars:
             self.add_var(v)
 
+        self.eliminated.update(other_hts.eliminated)
+
         if other_hts.assumptions is not None:
             for assumption in other_hts.assumptions:
                 self.add_assumption(assumption)
@@ -361,7 +635,8 @@ class HTS(object):
             tmp_input_vars = set([v for v in self.input_vars])
             tmp_output_vars = set([v for v in self.output_vars])
         vardic = dict([(v.symbol_name(), v) for v in self.vars])
-        output_vars = self._flatten_rec(vardic)[3]
+        with Profiler.span("flatten"):
+            output_vars = self._flatten_rec(vardic)[3]
         if cleanup:
             self.input_vars = tmp_input_vars
             self.output_vars = tmp_output_vars
@@ -484,6 +759,10 @@ class HTS(object):
         new_hts.__dict__.update(self.__dict__)
         new_hts.tss = set(new_hts.tss)
         new_hts.subs = list(new_hts.subs)
+        new_hts._a_invar = list(new_hts._a_invar)
+        new_hts._a_trans = list(new_hts._a_trans)
+        new_hts._versions = dict(new_hts._versions)
+        new_hts._composed = dict(new_hts._composed)
         return new_hts
 
     def __repr__(self):
@@ -609,6 +888,28 @@ class TS(object):
 
         return self
 
+    def remap(self, varmap, comment=None):
+        """Copy of the system with the variables renamed by the map of names"""
+
+        rename = lambda f: substitute(f, varmap)
+
+        ts = TS(self.comment if comment is None else comment)
+        ts.vars = set([rename(v) for v in self.vars])
+        ts.state_vars = set([rename(v) for v in self.state_vars])
+        ts.input_vars = set([rename(v) for v in self.input_vars])
+        ts.output_vars = set([rename(v) for v in self.output_vars])
+        ts.hidden_vars = set([rename(v) for v in self.hidden_vars])
+        ts.init = None if self.init is None else rename(self.init)
+        ts.trans = None if self.trans is None else rename(self.trans)
+        ts.invar = None if self.invar is None else rename(self.invar)
+        ts.logic = self.logic
+
+        if self.ftrans is not None:
+            ts.ftrans = dict([(rename(var), [(rename(c), rename(a)) for (c, a) in cond_assign_list]) \
+                              for (var, cond_assign_list) in self.ftrans.items()])
+
+        return ts
+
     def set_behavior(self, init, trans, invar):
         self.init = init
         self.trans = trans
@@ -645,16 +946,16 @@ class TS(object):
 
         self._s_ftrans = None
 
-    def compile_ftrans(self):
+    def compile_ftrans(self, functional=False):
+        """Encodes ftrans as implications and frame conditions, or as one ite chain per variable if functional"""
+
         if self.ftrans is None:
             return None
 
         ret_trans = TRUE()
         ret_invar = TRUE()
 
-        use_ites = False
-
-        if use_ites:
+        if functional:
             for var, cond_assign_list in self.ftrans.items():
                 if TS.has_next(var):
                     ite_list = TS.to_prev(var)
@@ -666,7 +967,7 @@ class TS(object):
                     else:
                         ite_list = Ite(condition, value, ite_list)
 
-                if TS.has_next(ite_list):
+                if TS.has_next(var) or TS.has_next(ite_list):
                     ret_trans = And(ret_trans, EqualsOrIff(var, ite_list))
                 else:
                     ret_invar = And(ret_invar, EqualsOrIff(var, ite_list))
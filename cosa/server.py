@@ -0,0 +1,168 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import socketserver
+import stat
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+
+from pysmt.shortcuts import TRUE, FALSE
+
+from cosa.analyzers.dispatcher import ProblemSolver
+from cosa.options import cosa_option_manager
+from cosa.problem import VerificationStatus, VerificationType
+from cosa.utils.logger import Logger
+
+LOCALHOST = "127.0.0.1"
+
+class CoSAServer(object):
+    """Solves the requested problems keeping the parsed models in memory.
+
+    A request is either the path of a problem file, a JSON object with the
+    path of a problem file in "problems" (and command line "options"), or a
+    JSON problem specification (see CosaArgParser.read_problem_spec). The
+    results are sent back as one JSON object per problem, as soon as the
+    problem is solved, followed by the global status.
+    """
+
+    solver = None
+
+    def __init__(self):
+        self.solver = ProblemSolver(keep_models=True)
+
+    def load(self, request):
+        request = request.strip()
+
+        if not request.startswith("{"):
+            problems_config = cosa_option_manager.read_problem_file(request)
+            return cosa_option_manager.prepare_problems(problems_config)
+
+        request = json.loads(request)
+        if isinstance(request.get("problems"), str):
+            problems_config = cosa_option_manager.read_problem_file(request["problems"], **request.get("options", dict()))
+            return cosa_option_manager.prepare_problems(problems_config)
+
+        return cosa_option_manager.read_problem_spec(request, Path(request.get("relative_path", "./")))
+
+    def result(self, problem, problems_config):
+        status = problems_config.get_problem_status(problem)
+        result = {"problem": problem.name, "status": status}
+
+        if status == VerificationStatus.UNK:
+            result["bmc_length"] = problems_config.get_problem_depth(problem)
+            exhausted = problems_config.get_problem_exhausted(problem)
+            if exhausted is not None:
+                result["exhausted"] = exhausted
+
+        if problem.expected is not None:
+            expected = VerificationStatus.convert(problem.expected)
+            result["expected"] = expected
+            result["correct"] = VerificationStatus.compare(expected, status)
+
+        if problem.verification == VerificationType.PARAMETRIC:
+            region = problems_config.get_problem_region(problem)
+            if region in [TRUE(),FALSE(),None]:
+                result["region"] = str(region)
+            else:
+                result["region"] = [x.serialize() for x in region]
+
+        if problems_config.general_config.time:
+            result["time"] = problems_config.get_problem_time(problem)
+
+        if problems_config.has_problem_trace(problem):
+            result["traces"] = [{"extension": trace.extension, \
+                                 "length": trace.length, \
+                                 "trace": str(trace)} for trace in problems_config.get_problem_traces(problem)]
+
+        return result
+
+    def run(self, request, emit):
+        verbosity = Logger.verbosity
+        global_status = 0
+
+        try:
+            problems_config = self.load(request)
+            Logger.verbosity = problems_config.general_config.verbosity
+
+            def solved(problem):
+                nonlocal global_status
+                result = self.result(problem, problems_config)
+                if result.get("correct") == False:
+                    global_status = 1
+                emit(result)
+
+            self.solver.solve_problems(problems_config, solved)
+            emit({"status": global_status})
+        except (Exception, SystemExit) as e:
+            emit({"error": str(e)})
+        finally:
+            Logger.verbosity = verbosity
+
+class UnixRequestHandler(socketserver.StreamRequestHandler):
+    """Handles one request per line"""
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode()
+            if line.strip():
+                self.server.cosa.run(line, self.emit)
+
+    def emit(self, message):
+        self.wfile.write((json.dumps(message)+"\n").encode())
+        self.wfile.flush()
+
+class HTTPRequestHandler(BaseHTTPRequestHandler):
+    """Handles one request per POST, streaming the results in the response body"""
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = self.rfile.read(length).decode()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+
+        self.server.cosa.run(request, self.emit)
+
+    def emit(self, message):
+        self.wfile.write((json.dumps(message)+"\n").encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        Logger.log(format%args, 1)
+
+def serve(address):
+    """Serves on a localhost HTTP port if address is a number, otherwise on a Unix socket"""
+
+    if address.isdigit():
+        server = HTTPServer((LOCALHOST, int(address)), HTTPRequestHandler)
+        Logger.log("Listening on http://%s:%s"%(LOCALHOST, address), 0)
+    else:
+        # remove stale sockets from previous runs
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.remove(address)
+        server = socketserver.UnixStreamServer(address, UnixRequestHandler)
+        Logger.log("Listening on \"%s\""%(address), 0)
+
+    server.cosa = CoSAServer()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not address.isdigit():
+            os.remove(address)
+
+    return 0
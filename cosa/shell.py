@@ -10,7 +10,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from copy import copy
 import sys
+import time
+from pathlib import Path
 from typing import List, NamedTuple, Union
 
 from pysmt.shortcuts import TRUE, FALSE
@@ -21,9 +24,11 @@ from cosa.environment import reset_env
 from cosa.options import cosa_option_manager
 from cosa.printers.factory import HTSPrintersFactory
 from cosa.problem import ProblemsManager, Trace, VerificationStatus, VerificationType
+from cosa.server import serve
 from cosa.utils.logger import Logger
 
 TRACE_PREFIX = "trace"
+WATCH_INTERVAL = 1
 
 def traces_printed(msg, trace_files):
     traces = ", and\n - ".join(["\"%s\""%f for f in trace_files])
@@ -46,7 +51,7 @@ def print_traces(msg, traces, index, prefix, tracecount):
             i+=1
             trace_files.append(trace_file)
             with open(trace_file, "w") as f:
-                f.write(str(trace))
+                trace.write(f)
 
             if tracecount < 0:
                 continue
@@ -87,6 +92,13 @@ def translate(hts, config, formulae=None):
             assert isinstance(f, FNode), "Expecting parsed properties"
             props.append(f)
 
+    # the variables removed by the model passes are written with their definitions
+    if hts.eliminated:
+        ts = hts.eliminated_ts()
+        hts = copy(hts)
+        hts.eliminated = {}
+        hts.add_ts(ts)
+
     with open(config.translate, "w") as f:
         f.write(printer.print_hts(hts, props))
 
@@ -104,7 +116,12 @@ def print_problem_result(pbm:NamedTuple,
         return (0, [])
     ret_status = 0
 
-    unk_k = "" if status != VerificationStatus.UNK else "\nBMC depth: %s"%pbm.bmc_length
+    unk_k = ""
+    if status == VerificationStatus.UNK:
+        unk_k = "\nBMC depth: %s"%problems_config.get_problem_depth(pbm)
+        exhausted = problems_config.get_problem_exhausted(pbm)
+        if exhausted is not None:
+            unk_k += " (%s budget exhausted)"%exhausted
     Logger.log("\n** Problem %s **"%(pbm.name), 0)
     if pbm.description is not None:
         Logger.log("Description: %s"%(pbm.description), 0)
@@ -162,9 +179,51 @@ def run_problems(problems_config:ProblemsManager):
     Logger.verbosity = general_config.verbosity
     Logger.time = general_config.time
 
+    if general_config.server is not None:
+        return serve(general_config.server)
+
+    if general_config.watch:
+        return watch_problems(problems_config)
+
     psol = ProblemSolver()
     psol.solve_problems(problems_config)
 
+    return report_problems(problems_config, psol)
+
+def watched_files(problems_config:ProblemsManager, psol:ProblemSolver):
+    general_config = problems_config.general_config
+    relative_path = problems_config.relative_path
+
+    model_files = [general_config.model_files]
+    model_files += [pbm.equal_to for pbm in problems_config.problems if pbm.equal_to is not None]
+    files = [filepath for mf in model_files for (filepath, _) in psol.get_file_paths(mf, relative_path)]
+    files += [Path(f) for f in [general_config.problems, general_config.init] if f is not None]
+
+    return dict([(f, f.stat().st_mtime if f.is_file() else None) for f in files])
+
+def watch_problems(problems_config:ProblemsManager):
+    psol = ProblemSolver(keep_models=True)
+    global_status = 0
+
+    try:
+        while True:
+            psol.solve_problems(problems_config)
+            global_status = report_problems(problems_config, psol)
+
+            stamps = watched_files(problems_config, psol)
+            Logger.log("\nWatching for changes...", 0)
+            while watched_files(problems_config, psol) == stamps:
+                time.sleep(WATCH_INTERVAL)
+
+            # the problems are read again, as the problem file might have changed
+            problems_config = cosa_option_manager.parse_args()
+    except KeyboardInterrupt:
+        pass
+
+    return global_status
+
+def report_problems(problems_config:ProblemsManager, psol:ProblemSolver):
+    general_config = problems_config.general_config
     global_status = 0
     traces = []
 
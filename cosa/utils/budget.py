@@ -0,0 +1,121 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import resource
+import time
+
+WALL_TIME = "time"
+SOLVER_TIME = "solver time"
+MEMORY = "memory"
+
+MB = 1024*1024
+
+def memory_usage():
+    """Resident memory of the process in MB"""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1])*resource.getpagesize()/MB
+    except (IOError, OSError, ValueError, IndexError):
+        # peak memory, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+class BudgetExhausted(Exception):
+    budget = None
+    k = None
+
+    def __init__(self, budget, k):
+        Exception.__init__(self, "%s budget exhausted at k=%s"%(budget, k))
+        self.budget = budget
+        self.k = k
+
+class Budget(object):
+    """Wall-clock, solver time and memory limits of a problem.
+
+    Limits are in seconds and MB, and None means unlimited. The engines
+    record the depth being explored (k), and check the budget between the
+    iterations and after each solver call, raising BudgetExhausted with the
+    deepest k that was completely explored.
+    """
+
+    time_limit = None
+    solver_time_limit = None
+    memory_limit = None
+    start = None
+    solver_time = 0.0
+    k = 0
+    stopped = None
+
+    def __init__(self, time_limit=None, solver_time_limit=None, memory_limit=None):
+        self.time_limit = time_limit
+        self.solver_time_limit = solver_time_limit
+        self.memory_limit = memory_limit
+        self.start = time.time()
+        self.solver_time = 0.0
+        self.k = 0
+        self.stopped = None
+
+    @staticmethod
+    def from_problem(problem):
+        if (problem.time_limit is None) and (problem.solver_time_limit is None) and (problem.memory_limit is None):
+            return None
+        return Budget(problem.time_limit, problem.solver_time_limit, problem.memory_limit)
+
+    def remaining_time(self):
+        remaining = []
+        if self.time_limit is not None:
+            remaining.append(self.time_limit - (time.time() - self.start))
+        if self.solver_time_limit is not None:
+            remaining.append(self.solver_time_limit - self.solver_time)
+        if not remaining:
+            return None
+        return max(min(remaining), 0)
+
+    def add_solver_time(self, seconds):
+        self.solver_time += seconds
+
+    def exhausted(self):
+        if (self.time_limit is not None) and (time.time() - self.start >= self.time_limit):
+            return WALL_TIME
+        if (self.solver_time_limit is not None) and (self.solver_time >= self.solver_time_limit):
+            return SOLVER_TIME
+        if (self.memory_limit is not None) and (memory_usage() >= self.memory_limit):
+            return MEMORY
+        return None
+
+    def depth(self):
+        """Deepest k completely explored, None if not even k=0"""
+        return self.k-1 if self.k > 0 else None
+
+    def stop(self, budget, k):
+        """Records a forked process stopped by the budget, the shallowest k is kept"""
+        if (self.stopped is None) or (k is None) or ((self.stopped[1] is not None) and (k < self.stopped[1])):
+            self.stopped = (budget, k)
+
+    def check(self):
+        budget = self.exhausted()
+        if budget is not None:
+            raise BudgetExhausted(budget, self.depth())
+
+    def _set_limit(self, kind, limit):
+        hard = resource.getrlimit(kind)[1]
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(kind, (limit, hard))
+
+    def limit_process(self):
+        """Limits the resources of the current (forked) process to the remaining budget"""
+
+        if self.memory_limit is not None:
+            self._set_limit(resource.RLIMIT_AS, int(self.memory_limit*MB))
+
+        remaining = self.remaining_time()
+        if remaining is not None:
+            self._set_limit(resource.RLIMIT_CPU, int(resource.getrusage(resource.RUSAGE_SELF).ru_utime + remaining) + 1)
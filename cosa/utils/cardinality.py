@@ -0,0 +1,122 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from pysmt.shortcuts import And, Or
+
+from cosa.utils.formula_mngm import SortingNetwork
+from cosa.utils.logger import Logger
+
+SEQUENTIAL = "sequential"
+TOTALIZER = "totalizer"
+SORTING = "sorting"
+
+ENCODINGS = [SEQUENTIAL, TOTALIZER, SORTING]
+
+class Cardinality(object):
+    """Unary counters of the Boolean inputs that are true.
+
+    The i-th output (starting from 0) holds iff at least i+1 inputs are
+    true, as for the outputs of SortingNetwork. Only the first bound
+    outputs are built, and the counters are memoized per list of inputs.
+    """
+
+    cache = {}
+
+    @staticmethod
+    def reset():
+        Cardinality.cache = {}
+
+    @staticmethod
+    def encoding(size, bound):
+        """Encoding with the smallest network for the given inputs size and bound"""
+
+        # O(size*bound) for small bounds, O(size*log^2(bound)) when the
+        # bound is close to the size, O(size*bound) with a logarithmic
+        # depth otherwise
+        if bound <= 2:
+            return SEQUENTIAL
+        if (2*bound) >= size:
+            return SORTING
+        return TOTALIZER
+
+    @staticmethod
+    def at_least(inputs, bound, encoding=None):
+        """First bound outputs of the unary counter of the inputs"""
+
+        inputs = list(inputs)
+        bound = min(bound, len(inputs))
+        if bound <= 0:
+            return []
+
+        if encoding is None:
+            encoding = Cardinality.encoding(len(inputs), bound)
+
+        if encoding not in ENCODINGS:
+            Logger.error("Unknown cardinality encoding \"%s\""%encoding)
+
+        key = (tuple(inputs), encoding)
+        if (key in Cardinality.cache) and (len(Cardinality.cache[key]) >= bound):
+            return Cardinality.cache[key][:bound]
+
+        Logger.log("Cardinality %s encoding of %d inputs bounded to %d"%(encoding, len(inputs), bound), 2)
+
+        if encoding == SEQUENTIAL:
+            outputs = Cardinality._sequential(inputs, bound)
+        elif encoding == TOTALIZER:
+            outputs = Cardinality._totalizer(inputs, 0, len(inputs), bound)
+        else:
+            outputs = Cardinality._sorting(inputs, 0, len(inputs), bound)
+
+        Cardinality.cache[key] = outputs
+        return outputs
+
+    @staticmethod
+    def _sequential(inputs, bound):
+        outputs = []
+        for el in inputs:
+            # at least i+1 true, either without el or with el and i others
+            carry = [el] + [And(el, o) for o in outputs[:bound-1]]
+            outputs = [Or(o, c) for (o, c) in zip(outputs, carry)] + carry[len(outputs):]
+        return outputs
+
+    @staticmethod
+    def _totalizer(inputs, begin, end, bound):
+        if (end - begin) == 1:
+            return [inputs[begin]]
+
+        pivot = int((begin + end) / 2)
+        left = Cardinality._totalizer(inputs, begin, pivot, bound)
+        right = Cardinality._totalizer(inputs, pivot, end, bound)
+
+        outputs = []
+        for i in range(min(bound, len(left)+len(right))):
+            # at least i+1 true, with j of them on the left
+            terms = []
+            for j in range(max(0, i+1-len(right)), min(i+1, len(left))+1):
+                if j == 0:
+                    terms.append(right[i])
+                elif j == (i+1):
+                    terms.append(left[i])
+                else:
+                    terms.append(And(left[j-1], right[i-j]))
+            outputs.append(Or(terms))
+        return outputs
+
+    @staticmethod
+    def _sorting(inputs, begin, end, bound):
+        if (end - begin) <= 2:
+            return SortingNetwork.sorting_network(inputs[begin:end])[:bound]
+
+        pivot = int((begin + end) / 2)
+        left = Cardinality._sorting(inputs, begin, pivot, bound)
+        right = Cardinality._sorting(inputs, pivot, end, bound)
+
+        # the first outputs only depend on the first outputs of the halves
+        return SortingNetwork.merge(left, right)[:bound]
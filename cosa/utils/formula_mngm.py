@@ -8,9 +8,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import itertools
 import re
 
+from pysmt.operators import op_to_str
 from pysmt.walkers.identitydag import IdentityDagWalker
 from pysmt.parsing import parse
 from pysmt.shortcuts import Ite, EqualsOrIff, BV, get_type, simplify, And, Or
@@ -86,6 +88,38 @@ def get_free_variables(formula):
     free_variables_dic[formula] = ret
     return ret
 
+structural_hash_dic = {}
+
+def structural_hash(formula):
+    '''
+    Hash of a formula only depending on its operators, symbols and constants,
+    hence stable across different runs
+    '''
+    stack = [formula]
+    while stack:
+        f = stack[-1]
+        if f in structural_hash_dic:
+            stack.pop()
+            continue
+
+        args = [a for a in f.args() if a not in structural_hash_dic]
+        if args:
+            stack += args
+            continue
+
+        stack.pop()
+        # the payload contains names and types of symbols, values of constants,
+        # and the parameters of the indexed operators (e.g., extract)
+        h = hashlib.sha1(("%s:%s"%(op_to_str(f.node_type()), f._content.payload)).encode())
+        for a in f.args():
+            h.update(structural_hash_dic[a].encode())
+        structural_hash_dic[f] = h.hexdigest()
+
+    return structural_hash_dic[formula]
+
+def reset_structural_hash():
+    structural_hash_dic.clear()
+
 ############### Values and Helper Functions for quote_names #################
 # don't treat these as variables in quote_names
 KEYWORDS = ["not","xor",\
@@ -0,0 +1,155 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+JSON = "json"
+CHROME = "chrome"
+
+class Span(object):
+    name = None
+    args = None
+    start = None
+    end = None
+    step = False
+    counters = None
+    children = None
+
+    def __init__(self, name, args, step=False):
+        self.name = name
+        self.args = args
+        self.step = step
+        self.counters = {}
+        self.children = []
+        self.start = time.time()
+
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_dict(self):
+        ret = {"name": self.name, "start": self.start, "duration": self.duration()}
+        if self.args:
+            ret["args"] = self.args
+        if self.counters:
+            ret["counters"] = self.counters
+        if self.children:
+            ret["children"] = [c.to_dict() for c in self.children]
+        return ret
+
+class NoSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class OpenSpan(object):
+    def __init__(self, span):
+        self.span = span
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        Profiler._close(self.span)
+        return False
+
+NO_SPAN = NoSpan()
+
+class Profiler(object):
+    """Records nested spans of time and counters.
+
+    Spans are opened with "with Profiler.span(name):", while a step (e.g.,
+    the iterations of an engine) lasts until the next step or until the end
+    of the enclosing span. Counters are added to the innermost span. When
+    not enabled, all the calls are no-ops.
+    """
+
+    enabled = False
+    root = None
+    stack = None
+
+    @staticmethod
+    def reset(name):
+        Profiler.root = Span(name, {})
+        Profiler.stack = [Profiler.root]
+
+    @staticmethod
+    def span(name, **args):
+        if not Profiler.enabled:
+            return NO_SPAN
+
+        span = Span(name, args)
+        Profiler.stack[-1].children.append(span)
+        Profiler.stack.append(span)
+        return OpenSpan(span)
+
+    @staticmethod
+    def step(name, **args):
+        if not Profiler.enabled:
+            return
+
+        if Profiler.stack[-1].step:
+            Profiler._close(Profiler.stack[-1])
+
+        span = Span(name, args, step=True)
+        Profiler.stack[-1].children.append(span)
+        Profiler.stack.append(span)
+
+    @staticmethod
+    def count(name, value=1):
+        if not Profiler.enabled:
+            return
+
+        counters = Profiler.stack[-1].counters
+        counters[name] = counters.get(name, 0) + value
+
+    @staticmethod
+    def _close(span):
+        # steps opened in the span end with it
+        while Profiler.stack[-1] is not span:
+            Profiler.stack.pop().end = time.time()
+        Profiler.stack.pop().end = time.time()
+
+    @staticmethod
+    def _totals(span, totals):
+        for (name, value) in span.counters.items():
+            totals[name] = totals.get(name, 0) + value
+        for child in span.children:
+            Profiler._totals(child, totals)
+        return totals
+
+    @staticmethod
+    def _events(span, events):
+        args = dict(span.args)
+        args.update(span.counters)
+        events.append({"name": span.name, "ph": "X", "pid": 0, "tid": 0, \
+                       "ts": span.start*1e6, "dur": span.duration()*1e6, "args": args})
+        for child in span.children:
+            Profiler._events(child, events)
+        return events
+
+    @staticmethod
+    def write(filename, output_format=JSON):
+        if Profiler.root is None:
+            return
+
+        root = Profiler.root
+        root.end = time.time()
+
+        if output_format == CHROME:
+            output = {"traceEvents": Profiler._events(root, []), "displayTimeUnit": "ms"}
+        else:
+            output = root.to_dict()
+            output["totals"] = Profiler._totals(root, {})
+
+        with open(filename, "w") as f:
+            json.dump(output, f, indent=1)
@@ -0,0 +1,269 @@
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import threading
+import weakref
+import zlib
+
+from six.moves import cStringIO, queue
+
+from pysmt.shortcuts import BOOL
+from pysmt.smtlib.printers import SmtDagPrinter, quote
+
+from cosa.utils.logger import Logger
+from cosa.utils.formula_mngm import get_free_variables
+
+GZ_EXT = ".gz"
+DEF_TEMPLATE = "_cosa_def%d"
+
+# tracers alive in this process, synchronized before forking
+_tracers = weakref.WeakSet()
+# forked processes (e.g., the workers) write the traces on their own files
+_main_pid = os.getpid()
+
+def _write_lines(stream, lines):
+    while True:
+        line = lines.get()
+        if line is not None:
+            stream.write(line)
+        lines.task_done()
+        if line is None:
+            break
+    stream.close()
+
+def _finish(stream, lines, thread):
+    if thread is not None:
+        lines.put(None)
+        thread.join()
+    else:
+        stream.close()
+
+def _sync_tracers():
+    for tracer in list(_tracers):
+        tracer.sync()
+
+def close_tracers():
+    """Closes the traces written by the current process (e.g., before a worker exits)"""
+    for tracer in list(_tracers):
+        tracer.close()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_sync_tracers)
+
+class DefinePrinter(SmtDagPrinter):
+    """DAG printer sharing the subterms across formulae through define-fun.
+
+    Each compound subterm is printed once as a definition on the output
+    stream, and later occurrences (also in other formulae) refer to its name.
+    """
+
+    def __init__(self, write_definition):
+        SmtDagPrinter.__init__(self, cStringIO(), template=DEF_TEMPLATE)
+        self.invalidate_memoization = False
+        self.write_definition = write_definition
+        self.names = set([])
+        self.added = None
+
+    def _compute_node_result(self, formula, **kwargs):
+        self.stream = cStringIO()
+        self.write = self.stream.write
+        SmtDagPrinter._compute_node_result(self, formula, **kwargs)
+
+        definition = self.stream.getvalue()
+        if not definition:
+            return
+
+        # the DAG printer introduces each subterm as "(let ((name body))) "
+        name = self.memoization[formula]
+        body = definition[len("(let ((%s "%name):-len(")) ")]
+        self.openings -= 1
+        self.write_definition("(define-fun %s () %s %s)"%(name, formula.get_type().as_smtlib(False), body))
+        if self.added is not None:
+            self.added.append(formula)
+
+    def to_smt2(self, formula):
+        return self.walk(formula)
+
+    def forget(self, formulae):
+        for formula in formulae:
+            del(self.memoization[formula])
+
+class SMT2Tracer(object):
+    """Buffered SMT-LIB2 trace of the commands sent to a solver.
+
+    The stream is kept open (and compressed if the file ends with .gz),
+    symbols are declared once per scope, and common subterms are shared
+    through define-fun. If threaded, the writes to the file are performed
+    by a separate thread.
+    """
+
+    filename = None
+    logic = None
+    threaded = False
+
+    def __init__(self, filename, logic, threaded=False):
+        self.filename = filename
+        self.basefile = filename
+        self.logic = logic
+        self.threaded = threaded
+        self.stream = None
+        self.pid = None
+        self.queue = None
+        self.thread = None
+        self.finalizer = None
+        self.written = 0
+        self.inherited = []
+        self._reset_index()
+        _tracers.add(self)
+
+    def _reset_index(self):
+        self.declared = set([])
+        self.scopes = []
+        self.printer = DefinePrinter(self.write)
+
+    def _open(self, mode):
+        if self.filename.endswith(GZ_EXT):
+            return gzip.open(self.filename, mode+"t")
+        return open(self.filename, mode)
+
+    def _process_filename(self):
+        if os.getpid() == _main_pid:
+            return self.basefile
+        # e.g., trace.smt2 -> trace.<pid>.smt2
+        compressed = self.basefile.endswith(GZ_EXT)
+        basefile = self.basefile[:-len(GZ_EXT)] if compressed else self.basefile
+        (name, ext) = os.path.splitext(basefile)
+        return "%s.%d%s%s"%(name, os.getpid(), ext, GZ_EXT if compressed else "")
+
+    def _start(self, mode):
+        self.pid = os.getpid()
+        self.filename = self._process_filename()
+        # a file is written by one tracer at a time
+        for tracer in list(_tracers):
+            if (tracer is not self) and (tracer.filename == self.filename):
+                tracer.close()
+        self.stream = self._open(mode)
+        self.written = 0
+        if self.threaded:
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=_write_lines, args=(self.stream, self.queue))
+            self.thread.daemon = True
+            self.thread.start()
+        # the stream is closed when the tracer is discarded, or at exit
+        self.finalizer = weakref.finalize(self, _finish, self.stream, self.queue, self.thread)
+
+    def _read(self, count):
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        if self.filename.endswith(GZ_EXT):
+            # the stream of the parent is still open, hence not terminated
+            data = zlib.decompressobj(16+zlib.MAX_WBITS).decompress(data)
+        return data.decode()[:count]
+
+    def _fork(self):
+        # a forked process continues the trace on its own file, which
+        # starts with a copy of the commands written before the fork
+        prefix = self._read(self.written)
+
+        # the stream of the parent is neither written nor closed
+        if self.stream is not None:
+            self.finalizer.detach()
+            self.inherited.append(self.stream)
+            if self.filename.endswith(GZ_EXT):
+                self.stream.buffer.fileobj = None
+
+        self._start("w")
+        self._emit(prefix)
+
+    def _emit(self, text):
+        if (self.pid is not None) and (self.pid != os.getpid()):
+            self._fork()
+        elif self.stream is None:
+            self._start("a")
+
+        self.written += len(text)
+        if self.threaded:
+            self.queue.put(text)
+        else:
+            self.stream.write(text)
+
+    def close(self):
+        if (self.stream is None) or (self.pid != os.getpid()):
+            return
+        self.finalizer()
+        self.stream = None
+
+    def sync(self):
+        """Writes the pending commands to the file"""
+        if (self.stream is None) or (self.pid != os.getpid()):
+            return
+        if self.threaded:
+            self.queue.join()
+        self.stream.flush()
+
+    def flush(self):
+        if (self.stream is not None) and (not self.threaded):
+            self.stream.flush()
+
+    def reset(self):
+        self.close()
+        self._reset_index()
+        self._start("w")
+        self._emit("(set-logic %s)\n"%self.logic)
+
+    def write(self, line):
+        # don't include any escape characters in smt2 output
+        # they can't be quoted away with "|" and should only
+        # be a part of a name, because auto-generated names don't
+        # use escape characters
+        self._emit(line.replace("\\", "")+"\n")
+
+    def comment(self, line):
+        self.write(";; %s"%line)
+
+    def declare(self, formula):
+        for v in get_free_variables(formula):
+            if v in self.declared:
+                continue
+
+            symbol_name = quote(v.symbol_name())
+            vtype = v.symbol_type()
+            if vtype == BOOL:
+                self.write("(declare-fun %s () Bool)"%(symbol_name))
+            elif vtype.is_array_type():
+                assert vtype.index_type.is_bv_type(), "Expecting BV indices"
+                assert vtype.elem_type.is_bv_type(), "Expecting BV elements"
+                self.write("(declare-fun %s () (Array (_ BitVec %s) (_ BitVec %s)))"%(symbol_name, vtype.index_type.width, vtype.elem_type.width))
+            elif vtype.is_bv_type():
+                self.write("(declare-fun %s () (_ BitVec %s))"%(symbol_name, vtype.width))
+            else:
+                Logger.error("Unhandled type in smt2 translation")
+
+            self.declared.add(v)
+            if self.scopes:
+                self.scopes[-1][0].append(v)
+
+    def assert_formula(self, formula):
+        self.write("(assert %s)"%self.printer.to_smt2(formula))
+
+    def push(self):
+        self.scopes.append(([], []))
+        self.printer.added = self.scopes[-1][1]
+        self.write("(push 1)")
+
+    def pop(self):
+        # declarations and definitions are removed by the pop
+        (symbols, definitions) = self.scopes.pop()
+        self.declared.difference_update(symbols)
+        self.printer.forget(definitions)
+        self.printer.added = self.scopes[-1][1] if self.scopes else None
+        self.write("(pop 1)")
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the test and example designs, and generated families of designs of
+# growing size, recording the time spent parsing, encoding and solving, the
+# peak memory and the number of solver calls. The results can be stored as a
+# baseline, and compared with a previous baseline to detect regressions.
+
+import argparse
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COSA = os.path.join(ROOT, "CoSA.py")
+DESIGN_DIRS = ["tests", "examples"]
+COSADIR = ".CoSA"
+
+PARSE_SPANS = set(["parse"])
+ENCODE_SPANS = set(["flatten", "coi", "simplify", "unroll"])
+SOLVE_SPANS = set(["solve"])
+
+RESULT_RE = re.compile(r"\*\* Problem (.+) \*\*\n(?:.*\n)*?Result: (\w+)")
+
+COUNTER = """\
+STATE
+out: BV(%(width)s);
+
+INIT
+out = 0_%(width)s;
+
+TRANS
+(out < %(bound)s_%(width)s) -> (next(out) = (out + 1_%(width)s));
+(out >= %(bound)s_%(width)s) -> (next(out) = 0_%(width)s);
+"""
+
+COUNTER_PROBLEM = """\
+[GENERAL]
+model_files: %(model)s
+
+[DEFAULT]
+bmc_length: %(length)s
+verification: safety
+prove: True
+
+[bound]
+properties: out <= %(bound)s_%(width)s
+
+[reach]
+properties: out != %(bound)s_%(width)s
+"""
+
+FIFO = """\
+INPUT
+input: BV(8);
+
+OUTPUT
+output: BV(8);
+
+STATE
+clk: BV(1);
+%(cells)s
+
+INIT
+clk = 0_1;
+
+INVAR
+output = cell_%(last)s;
+
+TRANS
+(clk = 0_1) <-> (next(clk) = 1_1);
+posedge(clk) -> %(shift)s;
+!(posedge(clk)) -> %(keep)s;
+"""
+
+FIFO_PROBLEM = """\
+[GENERAL]
+model_files: %(model)s
+
+[DEFAULT]
+bmc_length: %(length)s
+verification: safety
+prove: True
+
+[correctness]
+properties: sb.end -> (sb.packet = output)
+generators: sb=FixedScoreboard(input, %(depth)s, posedge(clk))
+"""
+
+# the STS format has no multiplication
+MULTIPLIER = """\
+1 sort bitvec %(width)s
+2 input 1 a
+3 input 1 b
+4 state 1 ab
+5 state 1 ba
+6 mul 1 2 3
+7 mul 1 3 2
+8 next 1 4 6
+9 next 1 5 7
+"""
+
+MULTIPLIER_PROBLEM = """\
+[GENERAL]
+model_files: %(model)s
+
+[DEFAULT]
+bmc_length: 2
+verification: safety
+prove: True
+
+[commutativity]
+properties: next(ab = ba)
+"""
+
+def counter(size):
+    width = size
+    # the comparisons of the STS format are signed
+    bound = 2**(size-1)-1
+    values = {"width": width, "bound": bound, "length": bound+2}
+    return (COUNTER%values, COUNTER_PROBLEM, values, "sts")
+
+def fifo(size):
+    cells = ["cell_%d"%i for i in range(size)]
+    shift = ["(next(cell_0) = input)"] + ["(next(%s) = %s)"%(cells[i], cells[i-1]) for i in range(1, size)]
+    values = {"cells": "\n".join(["%s: BV(8);"%c for c in cells]), \
+              "last": size-1, \
+              "shift": " & ".join(shift), \
+              "keep": " & ".join(["nochange(%s)"%c for c in cells]), \
+              "depth": size, \
+              "length": 4*size+8}
+    return (FIFO%values, FIFO_PROBLEM, values, "sts")
+
+def multiplier(size):
+    values = {"width": size}
+    return (MULTIPLIER%values, MULTIPLIER_PROBLEM, values, "btor2")
+
+FAMILIES = {"counter": (counter, [4, 6, 8]), \
+            "fifo": (fifo, [3, 6, 12]), \
+            "multiplier": (multiplier, [4, 8, 12])}
+
+def design_problems():
+    problems = []
+    for design_dir in DESIGN_DIRS:
+        for problem in glob.glob(os.path.join(ROOT, design_dir, "**", "problem*.txt"), recursive=True):
+            if COSADIR not in problem:
+                problems.append(os.path.relpath(problem, ROOT))
+    return sorted(problems)
+
+def generate_problems(workdir, families):
+    problems = []
+    for family in families:
+        (generator, sizes) = FAMILIES[family]
+        for size in sizes:
+            name = "%s-%s"%(family, size)
+            (model, problem, values, extension) = generator(size)
+            values["model"] = "%s.%s"%(name, extension)
+
+            with open(os.path.join(workdir, values["model"]), "w") as f:
+                f.write(model)
+            problem_file = os.path.join(workdir, "problem-%s.txt"%name)
+            with open(problem_file, "w") as f:
+                f.write(problem%values)
+
+            problems.append((name, problem_file))
+    return problems
+
+def span_time(span, names):
+    # nested spans with the same names are included in the outer one
+    if span["name"] in names:
+        return span["duration"]
+    return sum([span_time(c, names) for c in span.get("children", [])])
+
+def read_profiles(prefix):
+    ret = {"parse": 0.0, "encode": 0.0, "solve": 0.0, "solver calls": 0, "assertions": 0}
+    for profile in glob.glob("%s-*.json"%prefix):
+        with open(profile) as f:
+            root = json.load(f)
+        ret["parse"] += span_time(root, PARSE_SPANS)
+        ret["encode"] += span_time(root, ENCODE_SPANS)
+        ret["solve"] += span_time(root, SOLVE_SPANS)
+        ret["solver calls"] += root["totals"].get("solver calls", 0)
+        ret["assertions"] += root["totals"].get("assertions", 0)
+    return ret
+
+def run(problem_file, strategy, solver, profile, timeout):
+    command = [sys.executable, COSA, "--problems", problem_file, "--solver-name", solver, \
+               "--profile", profile, "--profile-format", "json"]
+    if strategy is not None:
+        command += ["--strategy", strategy]
+
+    start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, \
+                               cwd=ROOT, universal_newlines=True)
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    output = process.stdout.read()
+    # wait4 returns the resources used by this run only
+    (_, status, rusage) = os.wait4(process.pid, 0)
+    timer.cancel()
+    process.stdout.close()
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    wall = time.time()-start
+
+    if os.WIFSIGNALED(status):
+        result = "timeout" if wall >= timeout else "error"
+    else:
+        result = "ok" if os.WEXITSTATUS(status) == 0 else "error"
+
+    ret = read_profiles(profile)
+    ret["result"] = result
+    ret["wall"] = wall
+    ret["peak rss"] = rusage.ru_maxrss/1024.0
+    ret["status"] = dict(RESULT_RE.findall(output))
+    return ret
+
+def compare(name, current, baseline, tolerance, min_delta):
+    regressions = []
+    if current["result"] != baseline["result"]:
+        regressions.append("result %s -> %s"%(baseline["result"], current["result"]))
+    if current["status"] != baseline["status"]:
+        regressions.append("status %s -> %s"%(baseline["status"], current["status"]))
+    for metric in ["wall", "parse", "encode", "solve"]:
+        (old, new) = (baseline[metric], current[metric])
+        if (new-old > min_delta) and (new > old*(1+tolerance)):
+            regressions.append("%s %.3fs -> %.3fs"%(metric, old, new))
+    if current["peak rss"] > baseline["peak rss"]*(1+tolerance):
+        regressions.append("peak rss %.1fMB -> %.1fMB"%(baseline["peak rss"], current["peak rss"]))
+    if current["solver calls"] > baseline["solver calls"]:
+        regressions.append("solver calls %s -> %s"%(baseline["solver calls"], current["solver calls"]))
+    return ["%s: %s"%(name, r) for r in regressions]
+
+def main():
+    parser = argparse.ArgumentParser(description="CoSA benchmark and regression harness")
+    parser.add_argument("--solvers", type=str, default="msat", help="comma separated solvers (Default is \"%s\")"%"msat")
+    parser.add_argument("--strategies", type=str, default="FWD", help="comma separated strategies for the generated designs (Default is \"%s\")"%"FWD")
+    parser.add_argument("--families", type=str, default=",".join(sorted(FAMILIES)), \
+                        help="comma separated generated families, empty for none (Default is \"%s\")"%",".join(sorted(FAMILIES)))
+    parser.add_argument("--no-designs", action="store_true", help="skips the test and example designs (Default is \"%s\")"%False)
+    parser.add_argument("--filter", type=str, default=None, help="runs only the benchmarks matching the regex (Default is \"%s\")"%None)
+    parser.add_argument("--timeout", type=float, default=600, help="timeout in seconds for each run (Default is \"%s\")"%600)
+    parser.add_argument("--workdir", type=str, default=None, help="directory for the generated designs and profiles (Default is a temporary directory)")
+    parser.add_argument("--save", type=str, default=None, help="stores the results in a JSON baseline file (Default is \"%s\")"%None)
+    parser.add_argument("--baseline", type=str, default=None, help="compares the results with a JSON baseline file (Default is \"%s\")"%None)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative increase reported as a regression (Default is \"%s\")"%0.2)
+    parser.add_argument("--min-delta", type=float, default=0.1, help="time increase in seconds below which a regression is ignored (Default is \"%s\")"%0.1)
+    args = parser.parse_args()
+
+    solvers = args.solvers.split(",")
+    strategies = args.strategies.split(",")
+    families = [f for f in args.families.split(",") if f]
+    for family in families:
+        if family not in FAMILIES:
+            parser.error("unknown family \"%s\", available: %s"%(family, ", ".join(sorted(FAMILIES))))
+
+    workdir = args.workdir if args.workdir is not None else tempfile.mkdtemp(prefix="cosa-benchmark-")
+    os.makedirs(os.path.join(workdir, "profiles"), exist_ok=True)
+
+    # the designs use the strategies of their problem files
+    benchmarks = []
+    if not args.no_designs:
+        for problem_file in design_problems():
+            for solver in solvers:
+                benchmarks.append(("%s:%s"%(problem_file, solver), os.path.join(ROOT, problem_file), None, solver))
+    for (name, problem_file) in generate_problems(workdir, families):
+        for strategy in strategies:
+            for solver in solvers:
+                benchmarks.append(("%s:%s:%s"%(name, strategy, solver), problem_file, strategy, solver))
+
+    if args.filter is not None:
+        benchmarks = [b for b in benchmarks if re.search(args.filter, b[0])]
+
+    results = {}
+    print("%-50s %8s %10s %10s %10s %10s %10s %6s"%("Benchmark", "Result", "Wall (s)", "Parse (s)", \
+                                               "Encode (s)", "Solve (s)", "RSS (MB)", "Calls"))
+    for (i, (name, problem_file, strategy, solver)) in enumerate(benchmarks):
+        profile = os.path.join(workdir, "profiles", "%d"%i)
+        result = run(problem_file, strategy, solver, profile, args.timeout)
+        results[name] = result
+        print("%-50s %8s %10.3f %10.3f %10.3f %10.3f %10.1f %6s"%(name, result["result"], result["wall"], result["parse"], \
+                                                            result["encode"], result["solve"], result["peak rss"], \
+                                                            result["solver calls"]))
+        sys.stdout.flush()
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name in sorted(results):
+        if name in baseline:
+            regressions += compare(name, results[name], baseline[name], args.tolerance, args.min_delta)
+
+    if regressions:
+        print("\nRegressions:\n%s"%("\n".join(regressions)))
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
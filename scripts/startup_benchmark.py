@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Copyright 2018 Cristian Mattarei
+#
+# Licensed under the modified BSD (3-clause BSD) License.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the startup time of CoSA, i.e., the time spent before solving
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COSA = os.path.join(ROOT, "CoSA.py")
+BTOR2_MODEL = os.path.join(ROOT, "tests", "rast-btor2", "rast.btor2")
+
+def run(command, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+        times.append(time.time()-start)
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description="CoSA startup benchmark")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="number of runs per command (Default is \"%s\")"%5)
+    parser.add_argument("--solver-name", type=str, default="msat", help="solver used for the BTOR2 check (Default is \"%s\")"%"msat")
+    args = parser.parse_args()
+
+    commands = [("import dispatcher", [sys.executable, "-c", "import cosa.analyzers.dispatcher"]), \
+                ("CoSA.py --help", [sys.executable, COSA, "--help"]), \
+                ("BTOR2 check", [sys.executable, COSA, "-i", BTOR2_MODEL, "--verification", "safety", \
+                                 "--properties", "True", "-k", "1", "--skip-embedded", "--solver-name", args.solver_name])]
+
+    print("%-20s %10s %10s"%("Command", "Min (s)", "Avg (s)"))
+    for (name, command) in commands:
+        times = run(command, args.repeat)
+        print("%-20s %10.3f %10.3f"%(name, min(times), sum(times)/len(times)))
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@
 # limitations under the License.
 
 import os
+import shutil
 
 from cosa.environment import reset_env
 from cosa.options import cosa_option_manager
@@ -29,6 +30,10 @@ problem_files.reverse()
 
 def runtest(problem_file):
     reset_env()
+    # the model and results caches are removed after the test
+    cosadir = "%s/%s"%(os.path.dirname(problem_file), COSADIR)
+    clean_cosadir = not os.path.exists(cosadir)
+
     translate_file = 'file.ssts'
     problems_manager = cosa_option_manager.read_problem_file(problem_file,
                                                              verbosity=2,
@@ -43,7 +48,12 @@ def runtest(problem_file):
     cosa_option_manager._option_handling(problems_manager)
     problems_manager.freeze()
 
-    status = run_problems(problems_manager)
+    try:
+        status = run_problems(problems_manager)
+    finally:
+        if clean_cosadir:
+            shutil.rmtree(cosadir, ignore_errors=True)
+
     with open(translate_file, "r") as f:
         print(f.read())
 
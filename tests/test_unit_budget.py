@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import os
+
+from cosa.environment import reset_env
+from cosa.options import cosa_option_manager
+from cosa.analyzers.dispatcher import ProblemSolver
+from cosa.problem import VerificationStatus
+from cosa.utils.budget import SOLVER_TIME
+
+path = os.path.dirname(os.path.abspath(__file__))
+
+def solve_problem_file(problem_file, solver_name="msat"):
+    reset_env()
+    problems_manager = cosa_option_manager.read_problem_file(problem_file, solver_name=solver_name)
+    cosa_option_manager._option_handling(problems_manager)
+    problems_manager.freeze()
+    ProblemSolver().solve_problems(problems_manager)
+    return dict([(problem.name.split("_")[0], problem) for problem in problems_manager.problems]), problems_manager
+
+def test_parallel_parametric_budget():
+    problems, problems_manager = solve_problem_file("%s/parametric-sts/problem-budget.txt"%path)
+
+    # the workers are stopped by the solver time, and the depth is the one explored
+    stopped = problems["PARAMETRIC-TIME"]
+    assert problems_manager.get_problem_status(stopped) == VerificationStatus.UNK
+    assert problems_manager.get_problem_exhausted(stopped) == SOLVER_TIME
+    assert problems_manager.get_problem_depth(stopped) in [None] + list(range(stopped.bmc_length))
+
+    # within the budget the enumeration is complete
+    completed = problems["PARAMETRIC-MEMORY"]
+    assert problems_manager.get_problem_exhausted(completed) is None
+    assert problems_manager.get_problem_depth(completed) == completed.bmc_length
+    assert len(problems_manager.get_problem_region(completed)) == 3
+
+
+if __name__ == "__main__":
+    test_parallel_parametric_budget()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import itertools
+
+from cosa.environment import reset_env
+from cosa.utils.cardinality import Cardinality, ENCODINGS
+from pysmt.shortcuts import Symbol, TRUE, FALSE
+from pysmt.typing import BOOL
+
+def check_encoding(encoding):
+    for size in range(1, 6):
+        inputs = [Symbol("p%d"%i, BOOL) for i in range(size)]
+        for bound in range(1, size+2):
+            outputs = Cardinality.at_least(inputs, bound, encoding)
+            assert len(outputs) == min(bound, size)
+            for values in itertools.product([False, True], repeat=size):
+                submap = dict([(p, TRUE() if v else FALSE()) for (p, v) in zip(inputs, values)])
+                for (i, output) in enumerate(outputs):
+                    assert output.substitute(submap).simplify().is_true() == (sum(values) > i)
+
+def test_encodings():
+    reset_env()
+    Cardinality.reset()
+    for encoding in ENCODINGS:
+        check_encoding(encoding)
+
+def test_cache():
+    reset_env()
+    Cardinality.reset()
+    inputs = [Symbol("p%d"%i, BOOL) for i in range(8)]
+    outputs = Cardinality.at_least(inputs, 4)
+    assert Cardinality.at_least(inputs, 2, Cardinality.encoding(8, 4)) == outputs[:2]
+
+def test_cache_reset():
+    reset_env()
+    inputs = [Symbol("p%d"%i, BOOL) for i in range(4)]
+    Cardinality.at_least(inputs, 2)
+    assert Cardinality.cache
+
+    reset_env()
+    assert not Cardinality.cache
+
+
+if __name__ == "__main__":
+    test_encodings()
+    test_cache()
+    test_cache_reset()
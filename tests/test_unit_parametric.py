@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import os
+
+from pysmt.rewritings import conjunctive_partition
+
+from cosa.environment import reset_env
+from cosa.options import cosa_option_manager
+from cosa.analyzers.dispatcher import ProblemSolver
+
+path = os.path.dirname(os.path.abspath(__file__))
+
+def solve_problem_file(problem_file, solver_name="msat"):
+    reset_env()
+    problems_manager = cosa_option_manager.read_problem_file(problem_file, solver_name=solver_name)
+    cosa_option_manager._option_handling(problems_manager)
+    problems_manager.freeze()
+    ProblemSolver().solve_problems(problems_manager)
+    return dict([(problem.name.split("_")[0], problem) for problem in problems_manager.problems]), problems_manager
+
+def region_terms(region):
+    return set([frozenset([lit.serialize() for lit in conjunctive_partition(term)]) for term in region])
+
+def test_parallel_region():
+    problems, problems_manager = solve_problem_file("%s/parametric-sts/problem-parallel.txt"%path)
+
+    # each single fault of the pipeline leads to a non-zero output
+    expected = set([frozenset(["r%d$FAILURE$"%i]) for i in [1, 2, 3]])
+    assert region_terms(problems_manager.get_problem_region(problems["PARAMETRIC"])) == expected
+
+    # the parallel enumeration finds the same region, also with more cubes than processes
+    for name in ["PARAMETRIC-PARALLEL", "PARAMETRIC-POOL"]:
+        assert region_terms(problems_manager.get_problem_region(problems[name])) == expected
+
+
+if __name__ == "__main__":
+    test_parallel_region()
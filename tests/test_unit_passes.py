@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+from cosa.environment import reset_env
+from cosa.modifiers.passes import ModelPasses
+from cosa.representation import TS, HTS
+from cosa.utils.formula_mngm import get_free_variables, structural_hash_dic
+from pysmt.shortcuts import Symbol, BV, BVAdd, And, EqualsOrIff, Implies
+from pysmt.typing import BVType
+
+def test_passes():
+    reset_env()
+    ModelPasses.reset()
+    [en, mode] = [Symbol(name, BVType(1)) for name in ["en", "mode"]]
+    [cnt, one, step, dbg] = [Symbol(name, BVType(4)) for name in ["cnt", "one", "step", "dbg"]]
+
+    ts = TS("counter")
+    ts.vars = set([en, mode, cnt, one, step, dbg])
+    ts.state_vars = set([cnt])
+    ts.input_vars = set([en])
+    ts.init = EqualsOrIff(cnt, BV(0, 4))
+    ts.invar = And([EqualsOrIff(one, BV(1, 4)), EqualsOrIff(step, one), EqualsOrIff(mode, BV(0, 1))])
+    ts.trans = And([Implies(EqualsOrIff(mode, BV(0, 1)), EqualsOrIff(TS.get_prime(cnt), BVAdd(cnt, step))),
+                    Implies(EqualsOrIff(mode, BV(1, 1)), EqualsOrIff(TS.get_prime(cnt), BV(0, 4)))])
+    hts = HTS("counter")
+    hts.add_ts(ts)
+
+    protected = hts.input_vars | hts.state_vars
+    reduced = ModelPasses.run(hts, "constants,aliases,strash,unused", protected)
+
+    # the constants and aliases are eliminated, and the unused variables are removed
+    assert set(reduced.eliminated) == set([one, step, mode])
+    assert dbg not in reduced.vars
+    assert protected <= reduced.vars
+
+    used = set([])
+    for formula in [reduced.single_init(), reduced.single_invar(), reduced.single_trans()]:
+        used |= set([TS.get_ref_var(v) for v in get_free_variables(formula)])
+    assert used == set([cnt])
+    # the transition of the constant mode is the only one left
+    assert reduced.single_trans().is_equals()
+
+def test_cache_reset():
+    reset_env()
+    ModelPasses.reset()
+    cnt = Symbol("cnt", BVType(4))
+    ts = TS("counter")
+    ts.vars = set([cnt])
+    ts.state_vars = set([cnt])
+    ts.init = EqualsOrIff(cnt, BV(0, 4))
+    hts = HTS("counter")
+    hts.add_ts(ts)
+    ModelPasses.run(hts, "unused", hts.state_vars)
+    assert ModelPasses.cache
+    assert structural_hash_dic
+
+    reset_env()
+    assert not ModelPasses.cache
+    assert not structural_hash_dic
+
+
+if __name__ == "__main__":
+    test_passes()
+    test_cache_reset()
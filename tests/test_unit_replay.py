@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+from cosa.environment import reset_env
+from cosa.representation import TS, HTS
+from cosa.analyzers.replay import TraceReplayer
+from pysmt.shortcuts import Symbol, BV, BVAdd, And, EqualsOrIff, Select, Store, Not
+from pysmt.typing import BVType, ArrayType
+
+SOLVER_NAME = "msat"
+
+def memory_hts():
+    [addr, data, rdata, cnt] = [Symbol(name, BVType(4)) for name in ["addr", "data", "rdata", "cnt"]]
+    mem = Symbol("mem", ArrayType(BVType(4), BVType(4)))
+
+    ts = TS("memory")
+    ts.vars = set([addr, data, rdata, cnt, mem])
+    ts.state_vars = set([cnt, mem])
+    ts.input_vars = set([addr, data])
+    ts.init = EqualsOrIff(cnt, BV(0, 4))
+    ts.invar = EqualsOrIff(rdata, Select(mem, addr))
+    ts.trans = And(EqualsOrIff(TS.get_prime(cnt), BVAdd(cnt, data)),
+                   EqualsOrIff(TS.get_prime(mem), Store(mem, addr, data)))
+    hts = HTS("memory")
+    hts.add_ts(ts)
+    return hts
+
+def test_missing_values():
+    reset_env()
+    hts = memory_hts()
+
+    # the inputs and the initial content of the memory are not in the trace
+    replayer = TraceReplayer(hts, solver_name=SOLVER_NAME)
+    index = replayer.simulator.index
+    names = dict([(v.symbol_name(), index[v]) for v in replayer.simulator.vars])
+    steps = [{names["cnt"]: 0, names["addr"]: 2, names["rdata"]: 7}, {names["cnt"]: 3}, {names["cnt"]: 5, names["rdata"]: 3}]
+
+    result = replayer.replay(steps)
+    assert result.valid
+    states = result.states
+    assert [state[names["cnt"]] for state in states] == [0, 3, 5]
+    assert states[0][names["mem"]].select(2) == 7
+    # the values of the inputs are the ones leading to the next state
+    assert [state[names["data"]] for state in states[:2]] == [3, 2]
+
+    # the replay is deterministic
+    assert TraceReplayer(hts, solver_name=SOLVER_NAME).replay(steps).states == states
+
+    # without a solver the missing values are reported
+    result = TraceReplayer(hts).replay(steps)
+    assert (not result.valid) and (result.step == 0)
+    assert "under-specified" in result.message
+
+def test_load_model():
+    reset_env()
+    hts = memory_hts()
+    [data, cnt] = [Symbol(name, BVType(4)) for name in ["data", "cnt"]]
+
+    # e.g., the model of a counterexample restricted to some variables
+    model = {}
+    for (t, (vcnt, vdata)) in enumerate([(0, 4), (4, 1), (5, 0)]):
+        model[TS.get_timed(cnt, t)] = BV(vcnt, 4)
+        model[TS.get_timed(data, t)] = BV(vdata, 4)
+
+    replayer = TraceReplayer(hts, solver_name=SOLVER_NAME)
+    steps = replayer.load_model(model, 2)
+    assert len(steps) == 3
+    assert steps[1][replayer.simulator.index[cnt]] == 4
+
+    result = replayer.replay(steps, Not(EqualsOrIff(cnt, BV(5, 4))))
+    assert result.valid and (not result.holds) and (result.step == 2)
+
+    # the counter cannot increase by 2 without writing 2
+    model[TS.get_timed(cnt, 2)] = BV(6, 4)
+    result = replayer.replay(replayer.load_model(model, 2))
+    assert (not result.valid) and (result.step == 2)
+
+
+if __name__ == "__main__":
+    test_missing_values()
+    test_load_model()
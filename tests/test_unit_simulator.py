@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+from cosa.environment import reset_env
+from cosa.analyzers.simulator import ConcreteSimulator, BitSlicedSimulator, _unslice
+from cosa.representation import TS, HTS
+from pysmt.shortcuts import Symbol, BV, BVAdd, BVAnd, BVXor, BVExtract, And, Not, Ite, EqualsOrIff
+from pysmt.typing import BVType, BOOL
+
+def counter():
+    [en] = [Symbol("en", BOOL)]
+    [cnt, mask, out] = [Symbol(name, BVType(4)) for name in ["cnt", "mask", "out"]]
+
+    ts = TS("counter")
+    ts.vars = set([en, cnt, mask, out])
+    ts.state_vars = set([cnt])
+    ts.input_vars = set([en, mask])
+    ts.init = EqualsOrIff(cnt, BV(0, 4))
+    ts.invar = And([EqualsOrIff(out, BVXor(BVAnd(cnt, mask), cnt)),
+                    Not(EqualsOrIff(mask, BV(15, 4)))])
+    ts.trans = EqualsOrIff(TS.get_prime(cnt), Ite(en, BVAdd(cnt, BV(1, 4)), cnt))
+    hts = HTS("counter")
+    hts.add_ts(ts)
+    return (hts, cnt, mask, out)
+
+def test_bit_sliced():
+    reset_env()
+    (hts, cnt, mask, out) = counter()
+    lanes = 40
+
+    sliced = BitSlicedSimulator(hts, lanes, 1)
+    assert sliced.is_supported()
+    sliced.compile()
+
+    # every lane satisfies the invariant, evaluated on all lanes at once
+    (state, alive) = sliced._init_lanes(sliced.ones)
+    assert alive == sliced.ones
+    scalar = ConcreteSimulator(hts)
+    scalar.compile()
+    index = dict([(v, i) for (i, v) in enumerate(sliced.vars)])
+    for row in sliced._lane_states(state, alive):
+        assert row[index[cnt]] == 0
+        assert row[index[mask]] != 15
+        assert row[index[out]] == (row[index[cnt]] & row[index[mask]]) ^ row[index[cnt]]
+
+    bad = EqualsOrIff(BVExtract(cnt, 1, 2), BV(3, 2))
+    (t, trace, coverage) = sliced.run_batch(10, bad, lanes)
+    assert t == 6
+    assert [s[index[cnt]] for s in trace] == list(range(7))
+    assert coverage[2] == 0 and coverage[3] > 0
+
+    # the same lane is checked by the per-lane simulator
+    check = scalar.compile_check(bad)
+    assert check(trace[-1]) and not any([check(s) for s in trace[:-1]])
+    assert _unslice((5, 0, 7), 3) == [1+4, 4, 1+4]
+
+def test_run_batch():
+    reset_env()
+    (hts, cnt, mask, out) = counter()
+    simulator = ConcreteSimulator(hts, 1)
+    simulator.compile()
+    (t, trace, coverage) = simulator.run_batch(3, EqualsOrIff(cnt, BV(5, 4)), 8)
+    assert t == -1 and trace == []
+    assert coverage[0] == 3 and len(coverage) == 4
+
+
+if __name__ == "__main__":
+    test_bit_sliced()
+    test_run_batch()